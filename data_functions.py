@@ -6,44 +6,666 @@
 Conversion of TELMOS2_v2.2 vb scripts
 """
 
-from typing import List, Union
+import json
+import os
+import re
+import struct
+from typing import Dict, List, Optional, Tuple, Union
 import numpy as np
 import pandas as pd
 
+from input_cache import cached_load
+from run_report import record_read, record_write
+from sparse_matrix import SparseMatrix
+from zone_system import ZoneSystem
+
+# Number of rows formatted at a time by write_fixed_format
+WRITE_BLOCK_ROWS = 20000
+# Number of matrix cells formatted at a time by matrix_to_odfile
+OD_WRITE_BLOCK_CELLS = 1 << 17
+# Formats that write_fixed_format can encode directly - "%d" and "%.Nf"
+_FORMAT_PATTERN = re.compile(r"^%(?:\.(\d{1,2}))?([df])$")
+_POWERS_OF_TEN = 10 ** np.arange(19, dtype=np.int64)
+
+# Binary matrix store. The file starts with STORE_MAGIC and the length of a
+# JSON header (little-endian uint64), followed by the header and then the
+# arrays. Each array starts on a STORE_ALIGNMENT byte boundary so that it
+# can be opened with np.memmap
+STORE_MAGIC = b"TEMSTORE"
+STORE_VERSION = 1
+STORE_ALIGNMENT = 64
+# Name of the array in a store converted from a text file
+STORE_ARRAY = "data"
+# Kinds of text file that can be converted to a store:
+#   - "od" - OD matrix files (origin, destination and value columns)
+#   - "table" - numeric files without a header (e.g. CTE/TOD files)
+#   - "csv" - CSV files with a header (e.g. the tmfs/tav files)
+STORE_KINDS = ["od", "table", "csv"]
+
+
+def _read_od_columns(in_file: str,
+                     num_columns: int,
+                     delimiter: str,
+                     header: bool,
+                     num_zones: Optional[int]
+                     ) -> Tuple[np.array, np.array, int]:
+    """Reads the origin, destination and value columns of an OD file in one
+    pass.
+
+    Returns:
+        Tuple[np.array, np.array, int]: The row-major cell index (from
+        zero) of each row in increasing order, the (rows, num_columns)
+        values and the number of zones.
+    """
+    data = pd.read_csv(in_file, sep=delimiter, header=header).values
+    record_read(in_file, rows=len(data))
+    if data.shape[1] < num_columns + 2:
+        raise ValueError(f"{in_file} should have {num_columns + 2} columns "
+                         f"but has {data.shape[1]}")
+    origins = data[:, 0].astype("int64")
+    destinations = data[:, 1].astype("int64")
+    if num_zones is None:
+        num_zones = int(max(origins.max(), destinations.max()))
+    if (min(origins.min(), destinations.min()) < 1
+            or max(origins.max(), destinations.max()) > num_zones):
+        raise ValueError(f"Zones in {in_file} should be between 1 and "
+                         f"{num_zones}")
+    cells = (origins - 1) * num_zones + (destinations - 1)
+    values = data[:, 2:num_columns + 2]
+    # Files are written in origin, destination order so the cells should
+    # be increasing. Any other order is sorted, if no pair is repeated
+    if np.any(cells[1:] <= cells[:-1]):
+        order = np.argsort(cells, kind="stable")
+        cells, values = cells[order], values[order]
+        repeated = cells[1:][cells[1:] == cells[:-1]]
+        if len(repeated):
+            raise ValueError(
+                f"{in_file} has repeated zone pairs, e.g. "
+                f"({repeated[0] // num_zones + 1}, "
+                f"{repeated[0] % num_zones + 1})")
+    return cells, values, num_zones
+
+
+def _od_matrices(in_file: str,
+                 num_columns: int,
+                 delimiter: str,
+                 header: bool,
+                 num_zones: Optional[int]
+                 ) -> np.array:
+    # Reads an OD file into a (num_columns, zones, zones) array
+    cells, values, num_zones = _read_od_columns(
+        in_file, num_columns, delimiter, header, num_zones)
+    matrices = np.zeros((num_columns, num_zones, num_zones))
+    if len(cells) == num_zones * num_zones:
+        # Every pair is present in order, so no scatter is needed
+        matrices.reshape(num_columns, -1)[:] = values.T
+    else:
+        matrices.reshape(num_columns, -1)[:, cells] = values.T
+    return matrices
+
 
 def odfile_to_matrix(in_file: str,
                      num_columns: int = 1,
                      delimiter: str = ",",
-                     header: bool = None
-                     ) -> np.array:
-    # Assumes that dat is ordered
-    data = pd.read_csv(in_file, sep=delimiter, index_col=[0, 1], header=header)
-    return_data = []
-    for col in range(num_columns):
-        return_data.append(np.array(data[col + 2].unstack()))
+                     header: bool = None,
+                     sparse: bool = False,
+                     num_zones: Optional[int] = None
+                     ) -> Union[np.array, SparseMatrix, List[SparseMatrix]]:
+    """Reads an OD file with origin, destination and num_columns value
+    columns into square matrices. Zone pairs missing from the file are 0.
+    in_file can also be a binary matrix store (see save_matrix_store),
+    which is opened without parsing.
+
+    Args:
+        in_file (str): OD file.
+        num_columns (int, optional): Number of value columns. Defaults to
+        1.
+        delimiter (str, optional): Defaults to ",".
+        header (bool, optional): Header row, passed to pd.read_csv.
+        Defaults to None.
+        sparse (bool, optional): Return a SparseMatrix (or a list of
+        SparseMatrix if num_columns > 1). Defaults to False.
+        num_zones (int, optional): Number of zones, e.g. from the zone
+        system. Defaults to None (the largest zone in the file).
+
+    Returns:
+        Union[np.array, SparseMatrix, List[SparseMatrix]]: A (zones, zones)
+        matrix if num_columns is 1, otherwise a (num_columns, zones, zones)
+        array.
+    """
+    if is_matrix_store(in_file):
+        return _store_to_matrix(in_file, num_columns, sparse, num_zones)
+    if sparse:
+        cells, values, num_zones = _read_od_columns(
+            in_file, num_columns, delimiter, header, num_zones)
+        return_data = [
+            SparseMatrix.from_coo(cells // num_zones, cells % num_zones,
+                                  values[:, col], (num_zones, num_zones))
+            for col in range(num_columns)
+        ]
+        return return_data if num_columns > 1 else return_data[0]
+
+    matrices = cached_load(
+        in_file, "odfile_to_matrix",
+        lambda: _od_matrices(in_file, num_columns, delimiter, header,
+                             num_zones),
+        params={"num_columns": num_columns, "delimiter": delimiter,
+                "header": header, "num_zones": num_zones})
     if num_columns > 1:
-        return return_data
+        return matrices
     else:
-        return return_data[0]
+        return matrices[0]
+
+
+def _matrix_rows(matrix: Union[np.array, SparseMatrix],
+                 start: int,
+                 stop: int
+                 ) -> np.array:
+    if isinstance(matrix, SparseMatrix):
+        return matrix.dense_rows(start, stop)
+    return np.asarray(matrix[start:stop], dtype="float64")
 
 
 def matrix_to_odfile(data: Union[np.array, List[np.array]],
                      out_file: str,
                      num_columns: int = 1,
-                     delimiter: str = ","
+                     delimiter: str = ",",
+                     fmt: Optional[str] = None
                      ) -> None:
-    # data is a NumPy array or list of NumPy arrays
-    def stack_matrix(matrix):
-        df = pd.DataFrame(matrix).stack().reset_index()
-        df.loc[:, :"level_1"] += 1
-        return df
+    """Writes matrices to an OD file with origin, destination and one value
+    column per matrix, in origin, destination order.
+
+    The rows are written in blocks of origins straight from the matrices
+    (a SparseMatrix is only made dense a block at a time). By default the
+    values are written as the shortest text that reads back as the same
+    value, as pandas.to_csv does. If fmt is given ("%.Nf") the values are
+    encoded in bulk, which is much faster. The file is written under a
+    temporary name and then renamed, so that a reader never sees a partly
+    written file.
+
+    Args:
+        data (Union[np.array, List[np.array]]): A (zones, zones) matrix, or
+        num_columns matrices as a list or (num_columns, zones, zones)
+        array.
+        out_file (str): Path to the output file.
+        num_columns (int, optional): Number of matrices. Defaults to 1.
+        delimiter (str, optional): Column delimiter. Defaults to ",".
+        fmt (str, optional): Format of the values. Defaults to None.
+
+    Raises:
+        ValueError: If data does not contain num_columns matrices or fmt is
+        not a "%.Nf" format
+    """
+    matrices = [data] if num_columns == 1 else list(data)
+    if len(matrices) != num_columns:
+        raise ValueError(f"Expected {num_columns} matrices but found "
+                         f"{len(matrices)}")
+    num_rows, num_cols = matrices[0].shape
+    block_rows = max(1, OD_WRITE_BLOCK_CELLS // num_cols)
+    destinations = np.arange(1, num_cols + 1)
+
+    if fmt is None:
+        # The lines of one origin, with the destinations filled in. The
+        # origins and values are filled in a block at a time
+        line = "%d" + delimiter + "{}" + (delimiter + "%r") * num_columns
+        row_template = "".join(line.format(j) + "\n" for j in destinations)
+    else:
+        plan = _format_plan(("%d", "%d") + (fmt, ) * num_columns)
+        if plan is None or plan[-1] is None:
+            raise ValueError(f"Unsupported OD file format '{fmt}'")
+        row_format = delimiter.join(
+            ["%d", "%d"] + [fmt] * num_columns) + "\n"
+
+    # Written to a temporary file first, as other runs from the same base
+    # (e.g. in a batch) may be writing or reading the same file
+    tmp_file = f"{out_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "w") as f:
+            for start in range(0, num_rows, block_rows):
+                stop = min(start + block_rows, num_rows)
+                values = np.stack([_matrix_rows(matrix, start, stop)
+                                   for matrix in matrices], axis=-1)
+                origins = np.arange(start + 1, stop + 1)[:, None]
+                if fmt is None:
+                    args = np.empty(values.shape[:2] + (num_columns + 1, ))
+                    args[..., 0] = origins
+                    args[..., 1:] = values
+                    f.write((row_template * (stop - start))
+                            % tuple(args.ravel().tolist()))
+                    continue
+                block = np.empty(values.shape[:2] + (num_columns + 2, ))
+                block[..., 0] = origins
+                block[..., 1] = destinations
+                block[..., 2:] = values
+                block = block.reshape(-1, num_columns + 2)
+                encoded = _encode_block(block, plan, delimiter.encode("ascii"))
+                if encoded is not None:
+                    f.write(encoded.decode("ascii"))
+                else:
+                    f.write((row_format * block.shape[0])
+                            % tuple(block.ravel().tolist()))
+        os.replace(tmp_file, out_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    record_write(out_file, rows=num_rows * num_cols)
+
+
+def _format_plan(fmt: Tuple[str, ...]) -> Optional[List[Optional[int]]]:
+    """Precision of each column for the "%d" (None) and "%.Nf" formats
+    supported by _encode_block, or None if any other format is used.
+    """
+    plan = []
+    for col_fmt in fmt:
+        match = _FORMAT_PATTERN.match(col_fmt)
+        if match is None:
+            return None
+        precision, kind = match.groups()
+        if kind == "d":
+            if precision is not None:
+                return None
+            plan.append(None)
+        else:
+            precision = 6 if precision is None else int(precision)
+            if precision > 15:
+                return None
+            plan.append(precision)
+    return plan
+
+
+def _encode_block(block: np.array,
+                  plan: List[Optional[int]],
+                  delimiter: bytes
+                  ) -> Optional[bytes]:
+    """Formats a 2D block of data as text, one column at a time, giving the
+    same result as applying the "%d"/"%.Nf" formats in plan to each value.
+    Returns None if the block contains values that cannot be encoded this
+    way (non-finite or very large values).
+    """
+    num_rows, num_cols = block.shape
+    if num_rows == 0 or not np.isfinite(block).all():
+        return None
+
+    columns = []
+    for col, precision in enumerate(plan):
+        values = block[:, col]
+        if precision is None:
+            # "%d" truncates towards zero
+            whole = np.trunc(values)
+            if np.any(np.abs(whole) >= 2 ** 53):
+                return None
+            negative = whole < 0
+            whole = np.abs(whole).astype(np.int64)
+            fraction = None
+            precision = 0
+        else:
+            scaled = np.abs(values) * 10.0 ** precision
+            if np.any(scaled >= 2 ** 53):
+                return None
+            rounded = np.rint(scaled)
+            # Values too close to a rounding boundary to be sure of the
+            # result are rounded by Python, which uses the exact value
+            close = np.flatnonzero(
+                np.abs(scaled - np.floor(scaled) - 0.5)
+                <= 4 * np.spacing(scaled)
+            )
+            for i in close:
+                rounded[i] = int(("%.*f" % (precision, abs(values[i])))
+                                 .replace(".", ""))
+            negative = np.signbit(values)
+            whole, fraction = np.divmod(rounded.astype(np.int64),
+                                        10 ** precision)
+        num_digits = 1 + np.searchsorted(_POWERS_OF_TEN[1:], whole,
+                                         side="right")
+        width = negative + num_digits
+        if precision > 0:
+            width = width + 1 + precision
+        columns.append((negative, whole, num_digits, fraction, precision,
+                        width))
+
+    row_width = sum(column[-1] for column in columns)
+    row_width = row_width + len(delimiter) * (num_cols - 1) + 1
+    row_end = np.cumsum(row_width)
+    buffer = np.empty(row_end[-1], dtype=np.uint8)
+
+    position = row_end - row_width
+    for col, (negative, whole, num_digits, fraction, precision,
+              _) in enumerate(columns):
+        buffer[position[negative]] = ord("-")
+        position = position + negative
+        last_digit = position + num_digits - 1
+        for i in range(num_digits.max()):
+            has_digit = num_digits > i
+            buffer[(last_digit - i)[has_digit]] = (
+                48 + (whole[has_digit] // 10 ** i) % 10)
+        position = position + num_digits
+        if precision > 0:
+            buffer[position] = ord(".")
+            for i in range(precision):
+                buffer[position + precision - i] = (
+                    48 + (fraction // 10 ** i) % 10)
+            position = position + 1 + precision
+        if col < num_cols - 1:
+            for i, char in enumerate(delimiter):
+                buffer[position + i] = char
+            position = position + len(delimiter)
+    buffer[position] = ord("\n")
+
+    return buffer.tobytes()
+
+
+def write_fixed_format(out_file: str,
+                       data: np.array,
+                       fmt: Union[str, List[str]],
+                       delimiter: str = ",",
+                       header: str = None
+                       ) -> None:
+    """Faster replacement for np.savetxt, producing identical output. The
+    "%d" and "%.Nf" formats are encoded directly from the array a column at
+    a time. Other formats fall back to formatting a block of rows with a
+    single format operation rather than one per row.
 
+    Args:
+        out_file (str): Path to the output file
+        data (np.array): 2D array to write
+        fmt (Union[str, List[str]]): Format for every column, or a list with
+        the format of each column
+        delimiter (str, optional): Column delimiter. Defaults to ",".
+        header (str, optional): Line written before the data. Defaults to
+        None.
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data[:, None]
+    if isinstance(fmt, str):
+        fmt = [fmt] * data.shape[1]
+    if len(fmt) != data.shape[1]:
+        raise ValueError("fmt has %d columns but data has %d" % (
+            len(fmt), data.shape[1]))
+    plan = _format_plan(tuple(fmt))
+    row_format = delimiter.join(fmt) + "\n"
+
+    # Written in text mode so line endings match np.savetxt on all platforms
+    with open(out_file, "w") as f:
+        if header is not None:
+            f.write(header + "\n")
+        for start in range(0, data.shape[0], WRITE_BLOCK_ROWS):
+            block = data[start:start + WRITE_BLOCK_ROWS]
+            encoded = None
+            if plan is not None:
+                encoded = _encode_block(block.astype("float64"), plan,
+                                        delimiter.encode("ascii"))
+            if encoded is not None:
+                f.write(encoded.decode("ascii"))
+            else:
+                f.write((row_format * block.shape[0])
+                        % tuple(block.ravel().tolist()))
+    record_write(out_file, rows=data.shape[0])
+
+
+def is_matrix_store(path: str) -> bool:
+    """Checks if path is a binary matrix store rather than a text file"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(STORE_MAGIC)) == STORE_MAGIC
+    except OSError:
+        return False
+
+
+def _store_aligned(position: int) -> int:
+    return -(-position // STORE_ALIGNMENT) * STORE_ALIGNMENT
+
+
+def save_matrix_store(out_file: str,
+                      arrays: Dict[str, np.array],
+                      labels: Optional[Dict[str, List[str]]] = None,
+                      attrs: Optional[dict] = None,
+                      zone_system: Optional[ZoneSystem] = None
+                      ) -> None:
+    """Saves arrays to a binary matrix store, which can be opened without
+    parsing by load_matrix_store.
+
+    Args:
+        out_file (str): Path to the store.
+        arrays (Dict[str, np.array]): Arrays to save, by name.
+        labels (Dict[str, List[str]], optional): Labels of the segments,
+        periods or columns of each array. Defaults to None.
+        attrs (dict, optional): Other details to save in the header, e.g.
+        the kind of text file the arrays were converted from. Defaults to
+        None.
+        zone_system (ZoneSystem, optional): Zone system of the arrays, whose
+        zone counts are saved in the header. Defaults to None.
+    """
+    labels = labels or {}
+    entries = {}
+    contiguous = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+        contiguous[name] = array
+        entries[name] = {"dtype": array.dtype.str,
+                         "shape": list(array.shape),
+                         "offset": offset,
+                         "labels": labels.get(name)}
+        offset = _store_aligned(offset + array.nbytes)
+    header = {"version": STORE_VERSION, "attrs": attrs or {},
+              "arrays": entries}
+    if zone_system is not None:
+        header["zones"] = {"num_zones": zone_system.num_zones,
+                           "num_internal": zone_system.num_internal}
+    header_bytes = json.dumps(header).encode("utf-8")
+    # Array offsets in the header are from the start of the array data
+    data_start = _store_aligned(len(STORE_MAGIC) + 8 + len(header_bytes))
+
+    with open(out_file, "wb") as f:
+        f.write(STORE_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in contiguous.items():
+            f.seek(data_start + entries[name]["offset"])
+            array.tofile(f)
+    record_write(out_file)
+
+
+def read_store_header(in_file: str) -> dict:
+    """Reads the header of a binary matrix store, giving the offset of each
+    array from the start of the file.
+
+    Raises:
+        ValueError: If in_file is not a binary matrix store, or was saved by
+        a different version
+    """
+    with open(in_file, "rb") as f:
+        if f.read(len(STORE_MAGIC)) != STORE_MAGIC:
+            raise ValueError(f"{in_file} is not a binary matrix store")
+        (length, ) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length).decode("utf-8"))
+    if header.get("version") != STORE_VERSION:
+        raise ValueError(f"{in_file} is a version {header.get('version')} "
+                         f"matrix store but version {STORE_VERSION} is "
+                         f"supported")
+    data_start = _store_aligned(len(STORE_MAGIC) + 8 + length)
+    for entry in header["arrays"].values():
+        entry["offset"] += data_start
+    return header
+
+
+def load_matrix_store(in_file: str,
+                      mmap: bool = True
+                      ) -> Tuple[Dict[str, np.array], dict]:
+    """Opens the arrays in a binary matrix store.
+
+    Args:
+        in_file (str): Path to the store.
+        mmap (bool, optional): Map the arrays from the file (read only), so
+        data is only read when it is used. Otherwise the arrays are read
+        into memory. Defaults to True.
+
+    Returns:
+        Tuple[Dict[str, np.array], dict]: The arrays by name and the store
+        header.
+    """
+    header = read_store_header(in_file)
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        count = int(np.prod(shape))
+        if mmap and count > 0:
+            # asarray gives a plain (read only) ndarray view of the map
+            arrays[name] = np.asarray(np.memmap(
+                in_file, dtype=dtype, mode="r", offset=entry["offset"],
+                shape=shape))
+        else:
+            with open(in_file, "rb") as f:
+                f.seek(entry["offset"])
+                arrays[name] = np.fromfile(f, dtype=dtype,
+                                           count=count).reshape(shape)
+    return arrays, header
+
+
+def _store_to_matrix(in_file: str,
+                     num_columns: int,
+                     sparse: bool,
+                     num_zones: Optional[int]
+                     ) -> Union[np.array, SparseMatrix, List[SparseMatrix]]:
+    # odfile_to_matrix for a binary matrix store
+    arrays, header = load_matrix_store(in_file)
+    if header["attrs"].get("kind") != "od":
+        raise ValueError(f"{in_file} does not contain an OD matrix")
+    matrices = arrays[STORE_ARRAY]
+    record_read(in_file, rows=matrices.size // max(num_columns, 1))
+    if matrices.ndim == 2:
+        matrices = matrices[None]
+    if len(matrices) != num_columns:
+        raise ValueError(f"{in_file} has {len(matrices)} matrices but "
+                         f"{num_columns} were expected")
+    if num_zones is not None and matrices.shape[1:] != (num_zones,
+                                                        num_zones):
+        raise ValueError(f"{in_file} has {matrices.shape[1]} zones but "
+                         f"{num_zones} were expected")
+    if sparse:
+        return_data = [SparseMatrix.from_dense(m) for m in matrices]
+        return return_data if num_columns > 1 else return_data[0]
     if num_columns > 1:
-        dfs = []
-        for matrix in data:
-            dfs.append(stack_matrix(matrix))
-        df = pd.concat([dfs[0].loc[:, :"level_1"]] + [x[0]
-                                                      for x in dfs], axis=1)
+        return matrices
+    return matrices[0]
+
+
+def load_table(in_file: str,
+               delimiter: str = ",",
+               skiprows: int = 0
+               ) -> np.array:
+    """Loads a numeric text file with np.loadtxt, or the table from a
+    binary matrix store (which is opened without parsing)"""
+    if is_matrix_store(in_file):
+        arrays, header = load_matrix_store(in_file)
+        if header["attrs"].get("kind") not in ("table", "csv"):
+            raise ValueError(f"{in_file} does not contain a table")
+        return arrays[STORE_ARRAY]
+    return cached_load(
+        in_file, "load_table",
+        lambda: np.loadtxt(in_file, delimiter=delimiter, skiprows=skiprows),
+        params={"delimiter": delimiter, "skiprows": skiprows})
+
+
+def load_csv(in_file: str, **kwargs) -> pd.DataFrame:
+    """Loads a CSV file with pd.read_csv (with kwargs), or the table from a
+    binary matrix store with its column names and types"""
+    if is_matrix_store(in_file):
+        arrays, header = load_matrix_store(in_file)
+        if header["attrs"].get("kind") != "csv":
+            raise ValueError(f"{in_file} does not contain a CSV table")
+        columns = header["arrays"][STORE_ARRAY]["labels"]
+        return pd.DataFrame(arrays[STORE_ARRAY], columns=columns).astype(
+            dict(zip(columns, header["attrs"]["dtypes"])))
+    return cached_load(in_file, "load_csv",
+                       lambda: pd.read_csv(in_file, **kwargs), params=kwargs)
+
+
+def store_kind(path: str) -> str:
+    """Guesses the kind of text file (see STORE_KINDS) from its name"""
+    name = os.path.basename(path).upper()
+    if name.endswith("TE.DAT"):
+        return "table"
+    if name.endswith(".DAT"):
+        return "od"
+    if name.endswith(".CTE") or name.endswith(".TOD"):
+        return "table"
+    if name.endswith(".CSV"):
+        return "csv"
+    raise ValueError(f"Cannot tell what kind of file {path} is, should be "
+                     f"one of {STORE_KINDS}")
+
+
+def text_to_store(in_file: str,
+                  out_file: str,
+                  kind: Optional[str] = None,
+                  delimiter: str = ",",
+                  zone_system: Optional[ZoneSystem] = None
+                  ) -> None:
+    """Converts a text file to a binary matrix store.
+
+    Args:
+        in_file (str): Text file.
+        out_file (str): Path to the store. Can be the same as in_file.
+        kind (str, optional): Kind of text file, one of STORE_KINDS.
+        Defaults to None (guessed by store_kind).
+        delimiter (str, optional): Column delimiter. Defaults to ",".
+        zone_system (ZoneSystem, optional): Zone system, which sets the
+        number of zones of OD matrices. Defaults to None.
+    """
+    kind = kind or store_kind(in_file)
+    if kind not in STORE_KINDS:
+        raise ValueError(f"kind should be one of {STORE_KINDS}")
+    attrs = {"kind": kind, "delimiter": delimiter}
+    labels = None
+    if kind == "od":
+        num_columns = pd.read_csv(in_file, sep=delimiter, header=None,
+                                  nrows=1).shape[1] - 2
+        data = odfile_to_matrix(
+            in_file, num_columns=num_columns, delimiter=delimiter,
+            num_zones=None if zone_system is None else zone_system.num_zones)
+    elif kind == "table":
+        data = np.loadtxt(in_file, delimiter=delimiter, ndmin=2)
+    else:
+        df = pd.read_csv(in_file, sep=delimiter)
+        data = df.values.astype("float64")
+        labels = {STORE_ARRAY: [str(c) for c in df.columns]}
+        attrs["dtypes"] = [str(dtype) for dtype in df.dtypes]
+    record_read(in_file, rows=len(data))
+    save_matrix_store(out_file, {STORE_ARRAY: data}, labels=labels,
+                      attrs=attrs, zone_system=zone_system)
+
+
+def store_to_text(in_file: str, out_file: str) -> None:
+    """Converts a binary matrix store made by text_to_store back to the text
+    format it was converted from. Values are written as the shortest text
+    that reads back as the same value, and integers (or, for tables, whole
+    numbers) without a decimal point."""
+    arrays, header = load_matrix_store(in_file, mmap=False)
+    kind = header["attrs"].get("kind")
+    delimiter = header["attrs"].get("delimiter", ",")
+    data = arrays[STORE_ARRAY]
+    if kind == "od":
+        matrix_to_odfile(data, out_file,
+                         num_columns=1 if data.ndim == 2 else len(data),
+                         delimiter=delimiter)
+        return
+    if kind not in ("table", "csv"):
+        raise ValueError(f"{in_file} was not converted from a text file")
+    column_header = None
+    if kind == "csv":
+        # Integer columns are written as integers, so they are read back
+        # with the same type
+        fmt = ["%d" if np.dtype(dtype).kind in "iu" else "%r"
+               for dtype in header["attrs"]["dtypes"]]
+        column_header = delimiter.join(
+            header["arrays"][STORE_ARRAY]["labels"])
     else:
-        df = stack_matrix(data)
-    df.to_csv(out_file, index=None, columns=None, header=None)
+        whole = np.all((data == np.trunc(data))
+                       & (np.abs(data) < 2 ** 53), axis=0)
+        fmt = ["%d" if is_whole else "%r" for is_whole in whole]
+    write_fixed_format(out_file, data, fmt, delimiter=delimiter,
+                       header=column_header)
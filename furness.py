@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Doubly constrained (Furness) balancing of trip matrices.
+
+Replaces the Cube smoothing process for the goods and add-in matrices: the
+base year matrix is used as the seed and is balanced to the forecast trip
+ends by iterative proportional fitting, alternately scaling the rows to the
+origin totals and the columns to the destination totals.
+
+Matrices can have leading axes (e.g. the three PT add-in matrices), which
+are balanced together.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+FURNESS_TOLERANCE = 1e-6
+FURNESS_MAX_ITERATIONS = 100
+# How the row and column targets are made to have the same total
+TARGET_BALANCE = ["average", "rows", "columns", "none"]
+
+
+def _scale_factors(targets: np.array, totals: np.array) -> np.array:
+    # Rows or columns with no trips cannot be scaled so are left as they are
+    return np.divide(targets, totals, out=np.ones_like(totals),
+                     where=totals > 0)
+
+
+def balance_targets(row_targets: np.array,
+                    col_targets: np.array,
+                    balance: str = "average"
+                    ) -> Tuple[np.array, np.array]:
+    """Scales the row and column targets so that they have the same total.
+
+    Args:
+        row_targets (np.array): Origin totals, with shape (..., n).
+        col_targets (np.array): Destination totals, with shape (..., n).
+        balance (str, optional): "rows" to keep the row total, "columns" to
+        keep the column total, "average" to use the average of the two or
+        "none" to leave the targets unchanged. Defaults to "average".
+
+    Raises:
+        ValueError: If balance is not in TARGET_BALANCE
+
+    Returns:
+        Tuple[np.array, np.array]: The row and column targets.
+    """
+    if balance not in TARGET_BALANCE:
+        raise ValueError(f"balance should be one of {TARGET_BALANCE} "
+                         f"but is '{balance}'")
+    if balance == "none":
+        return row_targets, col_targets
+    row_total = row_targets.sum(axis=-1, keepdims=True)
+    col_total = col_targets.sum(axis=-1, keepdims=True)
+    if balance == "rows":
+        total = row_total
+    elif balance == "columns":
+        total = col_total
+    else:
+        total = (row_total + col_total) / 2
+    return (row_targets * _scale_factors(total, row_total),
+            col_targets * _scale_factors(total, col_total))
+
+
+def furness(seed: np.array,
+            row_targets: np.array,
+            col_targets: np.array,
+            tolerance: float = FURNESS_TOLERANCE,
+            max_iterations: int = FURNESS_MAX_ITERATIONS,
+            zero_value: float = 0.0,
+            balance: str = "average"
+            ) -> Tuple[np.array, dict]:
+    """Balances seed to the row and column targets.
+
+    Cells that are zero in the seed stay zero, unless zero_value is given.
+    Rows (or columns) with no trips in the seed but a positive target cannot
+    be balanced, so their targets are set to zero before the targets are
+    balanced, and the trips lost are reported as "unmet_total".
+
+    Args:
+        seed (np.array): Seed matrix, with shape (..., n, m).
+        row_targets (np.array): Row totals, with shape (..., n).
+        col_targets (np.array): Column totals, with shape (..., m).
+        tolerance (float, optional): Largest relative difference between a
+        row total and its target once balanced. Defaults to
+        FURNESS_TOLERANCE.
+        max_iterations (int, optional): Maximum number of iterations.
+        Defaults to FURNESS_MAX_ITERATIONS.
+        zero_value (float, optional): Value used in place of zero seed
+        cells. Defaults to 0.0 (zero cells are kept).
+        balance (str, optional): How the target totals are made equal, see
+        balance_targets. Defaults to "average".
+
+    Raises:
+        ValueError: If the targets do not match the shape of seed, or
+        contain negative values
+
+    Returns:
+        Tuple[np.array, dict]: The balanced matrix and the convergence
+        details: "iterations", "converged", "max_error", "unmet_rows",
+        "unmet_columns" and "unmet_total".
+    """
+    matrix = np.array(seed, dtype="float64")
+    row_targets = np.asarray(row_targets, dtype="float64")
+    col_targets = np.asarray(col_targets, dtype="float64")
+    if (row_targets.shape != matrix.shape[:-1]
+            or col_targets.shape != matrix.shape[:-2] + matrix.shape[-1:]):
+        raise ValueError(
+            f"Targets with shapes {row_targets.shape} and {col_targets.shape}"
+            f" do not match the seed matrix with shape {matrix.shape}")
+    if np.any(row_targets < 0) or np.any(col_targets < 0):
+        raise ValueError("Furness targets cannot be negative")
+    if zero_value:
+        matrix[matrix == 0] = zero_value
+
+    # Targets that cannot be reached from the seed are dropped
+    unmet_rows = (matrix.sum(axis=-1) == 0) & (row_targets > 0)
+    unmet_cols = (matrix.sum(axis=-2) == 0) & (col_targets > 0)
+    unmet_total = (row_targets[unmet_rows].sum()
+                   + col_targets[unmet_cols].sum())
+    row_targets = np.where(unmet_rows, 0, row_targets)
+    col_targets = np.where(unmet_cols, 0, col_targets)
+    row_targets, col_targets = balance_targets(row_targets, col_targets,
+                                               balance=balance)
+
+    # The column totals are exact after each iteration, so convergence is
+    # measured on the row totals
+    error_scale = np.where(row_targets > 0, row_targets, 1)
+    row_sums = matrix.sum(axis=-1)
+    max_error = np.inf
+    iteration = 0
+    while iteration < max_iterations:
+        iteration += 1
+        matrix *= _scale_factors(row_targets, row_sums)[..., None]
+        matrix *= _scale_factors(col_targets, matrix.sum(axis=-2))[
+            ..., None, :]
+        row_sums = matrix.sum(axis=-1)
+        max_error = float(np.max(np.abs(row_sums - row_targets)
+                                 / error_scale, initial=0))
+        if max_error <= tolerance:
+            break
+
+    return matrix, {"iterations": iteration,
+                    "converged": max_error <= tolerance,
+                    "max_error": max_error,
+                    "unmet_rows": int(unmet_rows.sum()),
+                    "unmet_columns": int(unmet_cols.sum()),
+                    "unmet_total": float(unmet_total)}
+
+
+def furness_matrices(jobs: List[Tuple[np.array, np.array, np.array]],
+                     max_workers: Optional[int] = None,
+                     **kwargs
+                     ) -> List[Tuple[np.array, dict]]:
+    """Balances several matrices at the same time in a thread pool (numpy
+    releases the GIL for the array operations).
+
+    Args:
+        jobs (List[Tuple[np.array, np.array, np.array]]): The seed, row
+        targets and column targets of each matrix.
+        max_workers (int, optional): Number of threads. Defaults to None
+        (chosen by ThreadPoolExecutor).
+        **kwargs: Other arguments for furness.
+
+    Returns:
+        List[Tuple[np.array, dict]]: The result of furness for each job.
+    """
+    if max_workers == 1 or len(jobs) <= 1:
+        return [furness(*job, **kwargs) for job in jobs]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(furness, *job, **kwargs) for job in jobs]
+        return [future.result() for future in futures]
+
+
+def smooth_matrices(base: Dict[str, np.array],
+                    forecast: Dict[str, np.array],
+                    log_func: Callable = print,
+                    max_workers: Optional[int] = None,
+                    **kwargs
+                    ) -> Dict[str, np.array]:
+    """Balances each base matrix to the trip ends of the forecast matrix
+    with the same key.
+
+    Args:
+        base (Dict[str, np.array]): Base (seed) matrices.
+        forecast (Dict[str, np.array]): Forecast matrices, with the same
+        shape as the base matrices.
+        log_func (Callable, optional): Function used to log the result of
+        each matrix. Defaults to print.
+        max_workers (int, optional): Number of threads. Defaults to None.
+        **kwargs: Other arguments for furness.
+
+    Returns:
+        Dict[str, np.array]: The smoothed matrices.
+    """
+    keys = list(forecast)
+    jobs = [(base[k], forecast[k].sum(axis=-1), forecast[k].sum(axis=-2))
+            for k in keys]
+    results = furness_matrices(jobs, max_workers=max_workers, **kwargs)
+    smoothed = {}
+    for k, (matrix, info) in zip(keys, results):
+        smoothed[k] = matrix
+        status = "converged" if info["converged"] else "did not converge"
+        log_func(f"Smoothing {k} {status} after {info['iterations']} "
+                 f"iterations (max error {info['max_error']:.3g})")
+        if info["unmet_total"] > 0:
+            log_func(f"Smoothing {k}: {info['unmet_total']:.1f} trips in "
+                     f"{info['unmet_rows']} rows and {info['unmet_columns']} "
+                     f"columns with no base trips could not be assigned")
+    return smoothed
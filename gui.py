@@ -8,40 +8,19 @@ Created on Wed Jul  3 11:35:25 2019
 import tkinter as tk
 from tkinter import ttk, filedialog
 import json
+import multiprocessing
 import os
 import threading
 import queue
+import sys
 import traceback
 from webbrowser import open_new
-from telmos_script import telmos_all
+from progress import format_progress
+from run_settings import (ALT_FACTOR_VARS, VAR_DEFAULTS, normalise_settings,
+                          telmos_args)
 from widget_templates import LabelledEntry, TextLog
 
 
-# Global Parameters
-REBASING_RUN = 0
-
-VAR_DEFAULTS = {
-    "delta_root": ["Delta Root Directory", "DELTA"],
-    "tmfs_root": ["TMfS Root Directory", ""],
-    "forecast_year": ["Forecast Year", "18"],
-    "forecast_id": ["Forecast ID", "XXX"],
-    "forecast_scenario": ["Forecast Scenario", "XX"],
-    "base_year": ["Base Year", "18"],
-    "base_id": ["Base ID", "ZZZ"],
-    "base_scenario": ["Base Scenario", "ZZ"],
-    "Trip Rates": ["Trip Rate File", "",
-                   "Should be the same as the trip rates used to create the "
-                   "base year (pivot) file"],
-    "RTF File": ["RTF File", ""],
-    "PTF File": ["PTF File", ""],
-    "Airport Growth File": ["Airport Growth File", ""],
-    "home_working": ["Integrate Home Working", 1],
-    "old_tr_fmt": ["Use Old Trip Rate Format (Legacy)", 0],
-    "rebasing_run": ["Rebasing Run", REBASING_RUN]
-}
-
-ALT_FACTOR_VARS = ["Trip Rates", "RTF File", "PTF File", "Airport Growth File"]
-
 DESCRIPTION = (
     "This tool uses TELMoS planning data and trip rates from NTEM to "
     "apply growth to the calibrated forecast trip ends that are input "
@@ -82,6 +61,43 @@ ALT_FACTOR_TT = (
 )
 
 
+# The model (telmos_script, numpy and pandas) takes several seconds to import,
+# more in the bundled exe, so it is imported in a background thread once the
+# window is shown rather than when this module is loaded
+_model = {}
+_model_thread = None
+
+
+def _import_model():
+    try:
+        from telmos_script import telmos_all
+        _model["telmos_all"] = telmos_all
+    except Exception:
+        _model["error"] = sys.exc_info()
+
+
+def start_model_import():
+    """Starts importing the model in a background thread, if it has not
+    already been started"""
+    global _model_thread
+    if _model_thread is None:
+        _model_thread = threading.Thread(target=_import_model, daemon=True)
+        _model_thread.start()
+
+
+def run_model(*args, thread_queue=None, **kwargs):
+    """Runs telmos_all with args and kwargs once the model has been imported.
+    An error importing the model is put on thread_queue in the same way as an
+    error in the run."""
+    start_model_import()
+    _model_thread.join()
+    if "error" in _model:
+        if thread_queue is not None:
+            thread_queue.put(_model["error"])
+        return
+    _model["telmos_all"](*args, thread_queue=thread_queue, **kwargs)
+
+
 def toggle_widgets(base, target_state):
     """Toggles all child widgets of "base" to the target states, disabling
     input for text entry and button widgets. Skips widgets where this is
@@ -123,6 +139,8 @@ class Application:
         self.new_thread = None
         self.init_widgets(parent)
         parent.resizable(height=False, width=False)
+        # Import the model while the settings are being entered
+        parent.after_idle(start_model_import)
 
     def init_widgets(self, parent):
 
@@ -243,6 +261,24 @@ class Application:
             text=self.user_names["old_tr_fmt"],
             variable=self.vars["old_tr_fmt"]
         ).pack(side="top", anchor="w", padx=10)
+        # Add tickbox for running the model stages in separate processes
+        ttk.Checkbutton(
+            factor_frame,
+            text=self.user_names["parallel"],
+            variable=self.vars["parallel"]
+        ).pack(side="top", anchor="w", padx=10)
+        # Add tickbox for only rerunning stages with changed inputs
+        ttk.Checkbutton(
+            factor_frame,
+            text=self.user_names["skip_unchanged"],
+            variable=self.vars["skip_unchanged"]
+        ).pack(side="top", anchor="w", padx=10)
+        # Add tickbox for balancing the goods and add-in matrices
+        ttk.Checkbutton(
+            factor_frame,
+            text=self.user_names["smooth"],
+            variable=self.vars["smooth"]
+        ).pack(side="top", anchor="w", padx=10)
 
         for factor_var in ALT_FACTOR_VARS:
             user_name = self.user_names[factor_var]
@@ -293,33 +329,51 @@ class Application:
         self.progress = ttk.Progressbar(
             log_frame,
             length=280,
-            mode="indeterminate"
+            mode="determinate",
+            maximum=100
         )
         self.progress.pack(padx=5, pady=5)
+        self.progress_text = tk.StringVar()
+        ttk.Label(
+            log_frame,
+            textvariable=self.progress_text
+        ).pack(padx=5)
 
     def callback_run_script(self):
-        args = {k: x.get() for k, x in self.vars.items()}
-
-        boolean_args = ["rebasing_run", "home_working", "old_tr_fmt"]
-
-        for var_name in args:
-            if var_name in boolean_args:
-                args[var_name] = bool(int(args[var_name]))
-        args = tuple(args.values())
+        args, kwargs = telmos_args(
+            normalise_settings({k: x.get() for k, x in self.vars.items()}))
 
         toggle_widgets(self.main_frame, "disabled")
 
         self.thread_queue = queue.Queue()
-        self.new_thread = threading.Thread(target=telmos_all,
-                                           args=args)
-        self.new_thread._kwargs = {"thread_queue": self.thread_queue,
-                                   "print_func": self.log.add_message}
+        # Progress events are passed from the model thread through a queue,
+        # as the widgets can only be updated from the main thread
+        self.progress_queue = queue.Queue()
+        self.new_thread = threading.Thread(target=run_model, args=args)
+        self.new_thread._kwargs = dict(kwargs,
+                                       thread_queue=self.thread_queue,
+                                       print_func=self.log.add_message,
+                                       progress_func=self.progress_queue.put)
         self.new_thread.daemon = True
         self.new_thread.start()
-        self.progress.start()
+        self.progress["value"] = 0
+        self.progress_text.set("Starting" if _model else "Loading the model")
         self.after(100, self.listen_for_result)
 
+    def show_progress(self):
+        # Show the latest progress event, if there are any new ones
+        event = None
+        try:
+            while True:
+                event = self.progress_queue.get(0)
+        except queue.Empty:
+            pass
+        if event is not None:
+            self.progress["value"] = 100 * event.fraction
+            self.progress_text.set(format_progress(event))
+
     def listen_for_result(self):
+        self.show_progress()
         # Check if something is in queue
         try:
             exc = self.thread_queue.get(0)
@@ -333,7 +387,8 @@ class Application:
                     color="RED")
                 traceback.print_tb(exc[2])
             toggle_widgets(self.main_frame, "normal")
-            self.progress.stop()
+            if exc is not None:
+                self.progress_text.set("Failed")
             self.new_thread = None
 
     def export_settings(self):
@@ -391,6 +446,9 @@ class Application:
 
 
 if __name__ == "__main__":
+    # Required for the process pool used by parallel runs in the bundled exe
+    multiprocessing.freeze_support()
+
     root = tk.Tk()
     app = Application(root)
 
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+Keeps the parsed contents of model input files in a local cache folder so
+that they do not have to be parsed again on later runs.
+
+Most runs pivot from the same base year data, so the base matrices, trip
+end and pivot files are read in the same way every time. An InputCache is
+made active with set_input_cache, after which the loaders that use
+cached_load save the arrays they parse to the cache, and return the saved
+arrays (opened with np.memmap, so only read when used) when the same file
+is loaded again. When no cache is active cached_load just calls the loader.
+
+Each entry is identified by a key: a hash of the file path, size,
+modification time and content, the loader and its parameters. The total
+size of the entries is kept below a byte budget by removing the least
+recently used entries.
+
+The cache can be inspected or cleared from the command line:
+
+    python -m input_cache {cache_dir} info
+    python -m input_cache {cache_dir} clear
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from run_report import record_read
+from stage_cache import file_hash
+
+# Default size limit of the cache
+DEFAULT_CACHE_BYTES = 2 << 30
+# Increase when a loader changes so that previous entries are not used
+CACHE_VERSION = 1
+INDEX_FILE = "index.json"
+META_FILE = "meta.json"
+
+_active_cache = None
+
+
+def _save_entry(entry_dir: str, value: Any) -> None:
+    # Saves each array as a .npy file, with meta.json describing how to
+    # rebuild the value
+    if isinstance(value, np.ndarray):
+        meta = {"type": "array"}
+        arrays = [value]
+    elif isinstance(value, pd.DataFrame):
+        meta = {"type": "frame", "columns": value.columns.tolist()}
+        arrays = [value[column].values for column in value.columns]
+    elif isinstance(value, (tuple, list)) and all(
+            isinstance(x, np.ndarray) for x in value):
+        meta = {"type": type(value).__name__}
+        arrays = list(value)
+    else:
+        raise TypeError(f"Cannot cache a value of type {type(value)}")
+    for i, array in enumerate(arrays):
+        if array.dtype == object:
+            raise TypeError("Cannot cache arrays of Python objects")
+        np.save(os.path.join(entry_dir, f"{i}.npy"), array)
+    meta["count"] = len(arrays)
+    with open(os.path.join(entry_dir, META_FILE), "w") as f:
+        json.dump(meta, f)
+
+
+def _read_entry(entry_dir: str, mmap: bool = True) -> Tuple[dict, list]:
+    # Returns the meta data and (read only) arrays of an entry, opened with
+    # np.memmap or read into memory
+    with open(os.path.join(entry_dir, META_FILE), "r") as f:
+        meta = json.load(f)
+    arrays = [np.load(os.path.join(entry_dir, f"{i}.npy"),
+                      mmap_mode="r" if mmap else None)
+              for i in range(meta["count"])]
+    # asarray gives plain ndarray views of the memory maps
+    arrays = [np.asarray(array) for array in arrays]
+    for array in arrays:
+        array.setflags(write=False)
+    return meta, arrays
+
+
+def _build_value(meta: dict, arrays: list) -> Any:
+    if meta["type"] == "array":
+        return arrays[0]
+    if meta["type"] == "frame":
+        return pd.DataFrame(dict(zip(meta["columns"], arrays)),
+                            columns=meta["columns"])
+    if meta["type"] == "tuple":
+        return tuple(arrays)
+    return list(arrays)
+
+
+def _is_entry_name(name: str) -> bool:
+    # Entries are named by the SHA-1 hex digest of their key
+    return len(name) == 40 and all(c in "0123456789abcdef" for c in name)
+
+
+def _entry_bytes(entry_dir: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+
+
+class InputCache:
+    """Cache of parsed input files in cache_dir, limited to max_bytes.
+
+    Entries that have been loaded can also be kept in memory, up to
+    memory_bytes, so that a process that runs the model several times (e.g.
+    a job_service worker) does not read them again.
+
+    Args:
+        cache_dir (str): Folder to keep the cache in, created if it does
+        not exist.
+        max_bytes (int, optional): Size limit of the cache. Defaults to
+        DEFAULT_CACHE_BYTES.
+        memory_bytes (int, optional): Size limit of the entries kept in
+        memory. Defaults to 0 (entries are opened with np.memmap each time
+        they are loaded).
+        create (bool, optional): Flag if cache_dir should be created if it
+        does not exist. Defaults to True.
+    """
+
+    def __init__(self,
+                 cache_dir: str,
+                 max_bytes: int = DEFAULT_CACHE_BYTES,
+                 memory_bytes: int = 0,
+                 create: bool = True
+                 ) -> None:
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        # Entries held in memory, least recently used first
+        self._memory = OrderedDict()
+        if create and not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _read_index(self) -> dict:
+        index_file = os.path.join(self.cache_dir, INDEX_FILE)
+        try:
+            with open(index_file, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("entries", {})
+        index.setdefault("files", {})
+        return index
+
+    def _write_index(self, index: dict) -> None:
+        # Written to a temporary file first so that the index is never left
+        # partially written. Stages run in parallel processes can both
+        # update the index, in which case one update is lost, which only
+        # means an entry is parsed again
+        index_file = os.path.join(self.cache_dir, INDEX_FILE)
+        tmp_file = f"{index_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_file, index_file)
+
+    def _file_hash(self, path: str, index: dict) -> List:
+        # Reuse the hash of a file if its size and modification time are the
+        # same as when it was last hashed
+        stat = os.stat(path)
+        current = [stat.st_size, stat.st_mtime_ns]
+        known = index["files"].get(path)
+        if known is None or known[:2] != current:
+            known = current + [file_hash(path)]
+            index["files"][path] = known
+        return known
+
+    def key(self, path: str, loader: str, params: dict, index: dict) -> str:
+        """Returns the key of an entry"""
+        key_data = {
+            "version": CACHE_VERSION,
+            "path": path,
+            "file": self._file_hash(path, index),
+            "loader": loader,
+            "params": params
+        }
+        return hashlib.sha1(
+            json.dumps(key_data, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def get(self,
+            path: str,
+            loader: str,
+            params: Optional[dict] = None
+            ) -> Any:
+        """Returns the cached value of loader for path, or None if it is not
+        in the cache. Arrays loaded from the cache are read only."""
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            return None
+        index = self._read_index()
+        key = self.key(path, loader, params or {}, index)
+        entry_dir = os.path.join(self.cache_dir, key)
+        if key not in index["entries"] or not os.path.isdir(entry_dir):
+            # Saves any new file hash
+            self._write_index(index)
+            return None
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            meta, arrays = self._memory[key]
+        else:
+            try:
+                meta, arrays = _read_entry(
+                    entry_dir, mmap=self.memory_bytes <= 0)
+            except (OSError, ValueError):
+                # Damaged entries are replaced by the next put
+                return None
+            self._keep_in_memory(key, meta, arrays)
+        value = _build_value(meta, arrays)
+        index["entries"][key]["last_used"] = time.time()
+        self._write_index(index)
+        record_read(path)
+        return value
+
+    def _keep_in_memory(self, key: str, meta: dict, arrays: list) -> None:
+        # Keeps an entry in memory, removing the least recently used entries
+        # to stay within memory_bytes
+        size = sum(array.nbytes for array in arrays)
+        if self.memory_bytes <= 0 or size > self.memory_bytes:
+            return
+        self._memory[key] = (meta, arrays)
+        total = sum(sum(array.nbytes for array in entry[1])
+                    for entry in self._memory.values())
+        while total > self.memory_bytes:
+            _, (_, old_arrays) = self._memory.popitem(last=False)
+            total -= sum(array.nbytes for array in old_arrays)
+
+    def put(self,
+            path: str,
+            loader: str,
+            value: Any,
+            params: Optional[dict] = None
+            ) -> None:
+        """Saves the value of loader for path in the cache, then removes the
+        least recently used entries if the cache is larger than max_bytes.
+        Values that are not an array, a tuple or list of arrays or a
+        DataFrame are not saved."""
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            return
+        index = self._read_index()
+        key = self.key(path, loader, params or {}, index)
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            _save_entry(tmp_dir, value)
+        except TypeError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # Another process has saved the same entry
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        index["entries"][key] = {"path": path,
+                                 "loader": loader,
+                                 "bytes": _entry_bytes(entry_dir),
+                                 "last_used": time.time()}
+        self._evict(index, keep=key)
+        self._write_index(index)
+
+    def load(self,
+             path: str,
+             loader: str,
+             load_func: Callable[[], Any],
+             params: Optional[dict] = None
+             ) -> Any:
+        """Returns the cached value of load_func for path, or calls it and
+        saves the value if it is not in the cache.
+
+        Args:
+            path (str): Input file read by load_func.
+            loader (str): Name of the loader.
+            load_func (Callable[[], Any]): Function that reads path. It
+            should return an array, a tuple or list of arrays or a
+            DataFrame.
+            params (dict, optional): Other arguments that affect the value
+            returned by load_func. Defaults to None.
+
+        Returns:
+            Any: The value of load_func. Arrays loaded from the cache are
+            read only.
+        """
+        value = self.get(path, loader, params=params)
+        if value is None:
+            value = load_func()
+            self.put(path, loader, value, params=params)
+        return value
+
+    def _evict(self, index: dict, keep: Optional[str] = None) -> None:
+        # Removes the least recently used entries until the cache is within
+        # max_bytes
+        entries = index["entries"]
+        total = sum(entry["bytes"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entries[key]["bytes"]
+            del entries[key]
+            # Entries that are still open (e.g. on Windows) are left on disk
+            # and removed by clear, which finds them by their name
+            shutil.rmtree(os.path.join(self.cache_dir, key),
+                          ignore_errors=True)
+        # Forget the hashes of files that no longer have an entry
+        paths = {entry["path"] for entry in entries.values()}
+        index["files"] = {path: known for path, known in index["files"].items()
+                          if path in paths}
+
+    def info(self) -> Dict[str, Any]:
+        """Returns the number of entries, their total size and the entries,
+        most recently used first"""
+        entries = self._read_index()["entries"]
+        ordered = sorted(entries.values(), key=lambda e: e["last_used"],
+                         reverse=True)
+        return {"cache_dir": self.cache_dir,
+                "max_bytes": self.max_bytes,
+                "num_entries": len(entries),
+                "total_bytes": sum(e["bytes"] for e in entries.values()),
+                "entries": ordered}
+
+    def clear(self) -> None:
+        """Removes every entry from the cache, and the index. Only the files
+        made by the cache are removed.
+
+        Raises:
+            ValueError: If cache_dir does not have an index, so may not be
+            a cache folder
+        """
+        index_file = os.path.join(self.cache_dir, INDEX_FILE)
+        if not os.path.isfile(index_file):
+            raise ValueError(f"{self.cache_dir} is not an input cache, as it "
+                             f"does not contain {INDEX_FILE}")
+        keys = set(self._read_index()["entries"])
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".tmp"):
+                # Left by a process that stopped while saving
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+            elif entry.is_dir() and (entry.name in keys or (
+                    _is_entry_name(entry.name) and os.path.isfile(
+                        os.path.join(entry.path, META_FILE)))):
+                # Entries that were removed from the index but left on disk
+                # are found by their name
+                shutil.rmtree(entry.path, ignore_errors=True)
+        os.remove(index_file)
+        self._memory.clear()
+
+
+def set_input_cache(cache_dir: Optional[str],
+                    max_bytes: int = DEFAULT_CACHE_BYTES,
+                    memory_bytes: int = 0
+                    ) -> Optional[InputCache]:
+    """Makes an InputCache in cache_dir the active cache, or stops using a
+    cache if cache_dir is None"""
+    global _active_cache
+    _active_cache = None
+    if cache_dir is not None:
+        _active_cache = InputCache(cache_dir, max_bytes=max_bytes,
+                                   memory_bytes=memory_bytes)
+    return _active_cache
+
+
+def get_input_cache() -> Optional[InputCache]:
+    """Returns the active InputCache, if any"""
+    return _active_cache
+
+
+def cached_load(path: str,
+                loader: str,
+                load_func: Callable[[], Any],
+                params: Optional[dict] = None
+                ) -> Any:
+    """Loads path with load_func through the active InputCache (see
+    InputCache.load), or just calls load_func if no cache is active"""
+    if _active_cache is None:
+        return load_func()
+    return _active_cache.load(path, loader, load_func, params=params)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Inspect or clear a trip end model input cache")
+    parser.add_argument("cache_dir")
+    parser.add_argument("command", choices=["info", "clear"])
+    args = parser.parse_args()
+    cache = InputCache(args.cache_dir, create=False)
+    if args.command == "clear":
+        try:
+            cache.clear()
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Cleared {cache.cache_dir}")
+    else:
+        details = cache.info()
+        print(f"{details['num_entries']} entries, "
+              f"{details['total_bytes'] / 2 ** 20:.1f} MB in "
+              f"{details['cache_dir']}")
+        for entry in details["entries"]:
+            last_used = time.strftime("%Y-%m-%d %H:%M",
+                                      time.localtime(entry["last_used"]))
+            print(f"  {entry['bytes'] / 2 ** 20:8.1f} MB  {last_used}  "
+                  f"{entry['loader']}  {entry['path']}")
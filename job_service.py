@@ -0,0 +1,702 @@
+# -*- coding: utf-8 -*-
+"""
+Local service that queues trip end model runs (jobs) and runs them on this
+machine, so that several users can share a modelling server without
+over-subscribing its CPUs or duplicating runs.
+
+The service listens for HTTP requests on localhost only. Jobs are run by
+telmos_all in a fixed number of worker processes (by default one per
+core), highest priority first and then in the order they were submitted.
+A job with the same settings as a queued or running job is not added
+again, and a job that would write to the same output folder as a queued
+or running job with different settings is rejected.
+
+The workers are kept between jobs and share an input cache (see
+input_cache.py), with the most recently used inputs also kept in the
+memory of each worker. Jobs are given to a worker that last ran a job
+with the same base year if one is free, so that the base year inputs do
+not have to be read again.
+
+Start the service, then submit and follow jobs from another terminal:
+
+    python -m job_service serve --workers 4
+    python -m job_service submit settings.json --priority 1 --follow
+    python -m job_service status
+    python -m job_service log {job_id} --follow
+    python -m job_service cancel {job_id}
+
+The HTTP interface is:
+
+    GET    /status                 service, worker and queue details
+    GET    /jobs                   summary of each job
+    POST   /jobs                   submit {"settings": {...},
+                                           "options": {...}, "priority": 0}
+    GET    /jobs/{id}              details of a job
+    GET    /jobs/{id}/log?since=n  log lines from line n
+    GET    /jobs/{id}/stream       log lines and progress of a job as they
+                                   happen, one JSON object per line
+    POST   /jobs/{id}/cancel       cancel a queued or running job
+    DELETE /jobs/{id}              the same as cancel
+
+This module only uses the standard library; the model is only imported in
+the worker processes.
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import wait
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from progress import ProgressEvent, format_progress, print_progress
+from run_settings import normalise_settings, output_folder, telmos_args
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "tem_input_cache")
+# Size limit of the input cache shared by the workers, larger than
+# input_cache.DEFAULT_CACHE_BYTES as the service keeps inputs for many runs
+JOB_CACHE_BYTES = 8 << 30
+# Inputs kept in the memory of each worker
+DEFAULT_MEMORY_BYTES = 1 << 30
+# Number of finished jobs whose details are kept
+MAX_FINISHED_JOBS = 200
+# Longest time a stream waits without sending anything
+STREAM_TIMEOUT = 15
+
+ACTIVE_STATUSES = ["queued", "running"]
+# telmos_all options that can be given with a job. Stages are always run
+# one after another in a job, as the number of jobs is already limited to
+# the number of cores
+JOB_OPTIONS = ["smooth", "sparse", "skip_unchanged", "binary_check_file",
+               "just_pivots", "trace_memory", "profile"]
+
+
+def _worker_main(task_conn, event_conn, cache_options: Optional[dict]
+                 ) -> None:
+    """Runs the jobs sent through task_conn, sending their log messages,
+    progress and result back through event_conn"""
+    # Imported here so that only the workers load the model
+    from input_cache import set_input_cache
+    from telmos_script import telmos_all
+
+    if cache_options is not None:
+        set_input_cache(**cache_options)
+    while True:
+        try:
+            task = task_conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        job_id, settings, options = task
+
+        def print_func(message):
+            event_conn.send((job_id, "log", str(message)))
+
+        def progress_func(event):
+            event_conn.send((job_id, "progress", event._asdict()))
+
+        args, kwargs = telmos_args(settings)
+        kwargs.update(options, parallel=False)
+        try:
+            telmos_all(*args, print_func=print_func,
+                       progress_func=progress_func, **kwargs)
+        except Exception as e:
+            event_conn.send((job_id, "failed", f"{type(e).__name__}: {e}"))
+        else:
+            event_conn.send((job_id, "finished", None))
+
+
+class _Worker:
+    """A worker process and the pipes used to send it jobs and receive its
+    events"""
+
+    def __init__(self, cache_options: Optional[dict]) -> None:
+        task_recv, self.task_send = multiprocessing.Pipe(duplex=False)
+        self.event_recv, event_send = multiprocessing.Pipe(duplex=False)
+        # Not a daemon, as the model starts its own processes to read the
+        # goods files
+        self.process = multiprocessing.Process(
+            target=_worker_main,
+            args=(task_recv, event_send, cache_options))
+        self.process.start()
+        task_recv.close()
+        event_send.close()
+        self.job_id = None
+        self.base_key = None
+
+    def stop(self, timeout: float = 5) -> None:
+        try:
+            self.task_send.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+def _base_key(settings: dict) -> str:
+    # Jobs with the same base year read the same base year inputs
+    return json.dumps([settings[k] for k in ["delta_root", "tmfs_root",
+                                             "base_year", "base_id",
+                                             "base_scenario"]])
+
+
+class JobService:
+    """Queue of trip end model jobs run by a pool of worker processes.
+
+    Args:
+        max_workers (int, optional): Number of jobs run at the same time.
+        Defaults to None, the number of cores.
+        cache_dir (str, optional): Input cache folder shared by the
+        workers. Defaults to DEFAULT_CACHE_DIR; None does not use a cache.
+        cache_bytes (int, optional): Size limit of the input cache.
+        Defaults to JOB_CACHE_BYTES.
+        memory_bytes (int, optional): Size limit of the inputs kept in the
+        memory of each worker. Defaults to DEFAULT_MEMORY_BYTES.
+    """
+
+    def __init__(self,
+                 max_workers: Optional[int] = None,
+                 cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+                 cache_bytes: int = JOB_CACHE_BYTES,
+                 memory_bytes: int = DEFAULT_MEMORY_BYTES
+                 ) -> None:
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cache_options = None
+        if cache_dir is not None:
+            self.cache_options = dict(cache_dir=cache_dir,
+                                      max_bytes=cache_bytes,
+                                      memory_bytes=memory_bytes)
+        self.jobs = OrderedDict()
+        self.changed = threading.Condition()
+        self._queue = []
+        self._ids = itertools.count(1)
+        self._order = itertools.count()
+        self._workers = []
+        self._thread = None
+        self._stopping = False
+
+    def start(self) -> None:
+        """Starts the workers and the thread that gives them jobs"""
+        self._workers = [_Worker(self.cache_options)
+                         for _ in range(self.max_workers)]
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the workers, cancelling any running jobs"""
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+        with self.changed:
+            for job in self.jobs.values():
+                if job["status"] in ACTIVE_STATUSES:
+                    self._set_status(job, "cancelled",
+                                     "The service was stopped")
+        for worker in self._workers:
+            worker.stop()
+
+    def submit(self,
+               settings: dict,
+               options: Optional[dict] = None,
+               priority: int = 0
+               ) -> Tuple[dict, bool]:
+        """Adds a job to the queue.
+
+        Args:
+            settings (dict): Run settings, as saved by the GUI (see
+            run_settings.normalise_settings).
+            options (dict, optional): Other arguments of telmos_all, from
+            JOB_OPTIONS. Defaults to None.
+            priority (int, optional): Jobs with a higher priority are run
+            first. Defaults to 0.
+
+        Raises:
+            KeyError: If a setting does not exist
+            ValueError: If an option is not in JOB_OPTIONS, or another job
+            writes to the same output folder with different settings
+
+        Returns:
+            Tuple[dict, bool]: The job, and whether it is an existing job
+            with the same settings.
+        """
+        settings = normalise_settings(settings)
+        options = dict(options or {})
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown options {sorted(unknown)}, should be "
+                             f"from {JOB_OPTIONS}")
+        # Settings that only affect how a run is made are not compared
+        run_key = json.dumps([dict(settings, parallel=0), options],
+                             sort_keys=True)
+        folder = os.path.normcase(os.path.abspath(output_folder(settings)))
+        with self.changed:
+            for job in self.jobs.values():
+                if job["status"] not in ACTIVE_STATUSES:
+                    continue
+                if job["key"] == run_key:
+                    return self._summary(job), True
+                if job["folder"] == folder:
+                    raise ValueError(f"Job {job['id']} already writes to "
+                                     f"{folder} with different settings")
+            job_id = str(next(self._ids))
+            job = {
+                "id": job_id,
+                "name": f"{settings['forecast_year']}_"
+                        f"{settings['forecast_id']}",
+                "status": "queued",
+                "priority": int(priority),
+                "settings": settings,
+                "options": options,
+                "output_folder": output_folder(settings),
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+                "progress": None,
+                "error": None,
+                "log": [],
+                "key": run_key,
+                "folder": folder
+            }
+            self.jobs[job_id] = job
+            heapq.heappush(self._queue,
+                           (-job["priority"], next(self._order), job_id))
+            self.changed.notify_all()
+            return self._summary(job), False
+
+    def cancel(self, job_id: str) -> dict:
+        """Cancels a queued or running job, stopping its worker if it is
+        running (the worker is replaced by a new one).
+
+        Raises:
+            KeyError: If the job does not exist
+        """
+        with self.changed:
+            job = self.jobs[job_id]
+            if job["status"] == "running":
+                for worker in self._workers:
+                    if worker.job_id == job_id:
+                        worker.process.terminate()
+            if job["status"] in ACTIVE_STATUSES:
+                self._set_status(job, "cancelled")
+            return self._summary(job)
+
+    def job(self, job_id: str, log: bool = False) -> dict:
+        """Returns the details of a job, with its log if log is True
+
+        Raises:
+            KeyError: If the job does not exist
+        """
+        with self.changed:
+            job = self.jobs[job_id]
+            details = self._summary(job)
+            details.update(settings=job["settings"], options=job["options"],
+                           log_lines=len(job["log"]))
+            if log:
+                details["log"] = list(job["log"])
+            return details
+
+    def job_list(self) -> List[dict]:
+        """Returns the summary of each job"""
+        with self.changed:
+            return [self._summary(job) for job in self.jobs.values()]
+
+    def status(self) -> dict:
+        """Returns the details of the service"""
+        with self.changed:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {"workers": self.max_workers,
+                    "busy_workers": sum(worker.job_id is not None
+                                        for worker in self._workers),
+                    "jobs": counts,
+                    "cache": self.cache_options}
+
+    def log(self, job_id: str, since: int = 0) -> dict:
+        """Returns the log lines of a job from line since"""
+        with self.changed:
+            job = self.jobs[job_id]
+            return {"lines": job["log"][since:],
+                    "next": len(job["log"]),
+                    "status": job["status"]}
+
+    @staticmethod
+    def _summary(job: dict) -> dict:
+        return {k: job[k] for k in ["id", "name", "status", "priority",
+                                    "output_folder", "submitted", "started",
+                                    "finished", "progress", "error"]}
+
+    def _set_status(self,
+                    job: dict,
+                    status: str,
+                    error: Optional[str] = None
+                    ) -> None:
+        job["status"] = status
+        job["error"] = error
+        job["finished"] = time.time()
+        self.changed.notify_all()
+        # Forget the oldest finished jobs
+        finished = [k for k, v in self.jobs.items()
+                    if v["status"] not in ACTIVE_STATUSES]
+        for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job_id]
+
+    def _run(self) -> None:
+        # Receives the worker events and gives queued jobs to free workers
+        while not self._stopping:
+            workers = {worker.event_recv: worker for worker in self._workers}
+            for conn in wait(list(workers), timeout=0.2):
+                try:
+                    event = conn.recv()
+                except (EOFError, OSError):
+                    # The worker has stopped, it is replaced below
+                    continue
+                with self.changed:
+                    self._handle_event(workers[conn], event)
+            with self.changed:
+                self._replace_stopped_workers()
+                self._dispatch()
+
+    def _handle_event(self, worker: _Worker, event: tuple) -> None:
+        job_id, kind, data = event
+        job = self.jobs.get(job_id)
+        if kind in ("finished", "failed"):
+            worker.job_id = None
+        if job is None or job["status"] != "running":
+            # e.g. messages sent before a cancelled job was stopped
+            return
+        if kind == "log":
+            job["log"].append(data)
+        elif kind == "progress":
+            job["progress"] = data
+        else:
+            self._set_status(job, kind, data)
+            return
+        self.changed.notify_all()
+
+    def _replace_stopped_workers(self) -> None:
+        for i, worker in enumerate(self._workers):
+            if worker.process.is_alive():
+                continue
+            job = self.jobs.get(worker.job_id)
+            if job is not None and job["status"] == "running":
+                self._set_status(job, "failed", "The worker process stopped")
+            worker.process.join()
+            self._workers[i] = _Worker(self.cache_options)
+
+    def _dispatch(self) -> None:
+        idle = [worker for worker in self._workers if worker.job_id is None]
+        while idle and self._queue:
+            _, _, job_id = heapq.heappop(self._queue)
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != "queued":
+                # Cancelled while queued
+                continue
+            # Use a worker that has the base year inputs in memory if any
+            base_key = _base_key(job["settings"])
+            worker = next((w for w in idle if w.base_key == base_key),
+                          idle[0])
+            idle.remove(worker)
+            try:
+                worker.task_send.send((job_id, job["settings"],
+                                       job["options"]))
+            except OSError as e:
+                self._set_status(job, "failed", f"Could not start job: {e}")
+                continue
+            worker.job_id = job_id
+            worker.base_key = base_key
+            job["status"] = "running"
+            job["started"] = time.time()
+            self.changed.notify_all()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """HTTP interface of a JobService (see the module docstring)"""
+
+    @property
+    def service(self) -> JobService:
+        return self.server.service
+
+    def log_message(self, format, *args) -> None:
+        # Requests are not logged
+        pass
+
+    def _send_json(self, data, status: int = 200) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _route(self) -> Tuple[List[str], dict]:
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        return parts, {k: v[0] for k, v in parse_qs(url.query).items()}
+
+    def do_GET(self) -> None:
+        parts, query = self._route()
+        try:
+            if parts == ["status"]:
+                self._send_json(self.service.status())
+            elif parts == ["jobs"]:
+                self._send_json(self.service.job_list())
+            elif len(parts) == 2 and parts[0] == "jobs":
+                self._send_json(self.service.job(parts[1]))
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "log":
+                self._send_json(self.service.log(
+                    parts[1], since=int(query.get("since", 0))))
+            elif (len(parts) == 3 and parts[0] == "jobs"
+                    and parts[2] == "stream"):
+                self._stream(parts[1])
+            else:
+                self._send_json({"error": "Not found"}, 404)
+        except KeyError:
+            self._send_json({"error": "Job not found"}, 404)
+
+    def do_POST(self) -> None:
+        parts, _ = self._route()
+        try:
+            if parts == ["jobs"]:
+                request = self._read_json()
+                job, duplicate = self.service.submit(
+                    request.get("settings", {}),
+                    options=request.get("options"),
+                    priority=request.get("priority", 0))
+                self._send_json(dict(job, duplicate=duplicate),
+                                200 if duplicate else 201)
+            elif (len(parts) == 3 and parts[0] == "jobs"
+                    and parts[2] == "cancel"):
+                self._send_json(self.service.cancel(parts[1]))
+            else:
+                self._send_json({"error": "Not found"}, 404)
+        except KeyError as e:
+            self._send_json({"error": str(e).strip("'\"")}, 404)
+        except ValueError as e:
+            self._send_json({"error": str(e)}, 400)
+
+    def do_DELETE(self) -> None:
+        parts, _ = self._route()
+        if len(parts) == 2 and parts[0] == "jobs":
+            try:
+                self._send_json(self.service.cancel(parts[1]))
+            except KeyError:
+                self._send_json({"error": "Job not found"}, 404)
+        else:
+            self._send_json({"error": "Not found"}, 404)
+
+    def _stream(self, job_id: str) -> None:
+        # Sends the log lines and progress of a job as JSON lines until it
+        # is finished. The response has no length, so ends when the
+        # connection is closed.
+        service = self.service
+        job = service.jobs[job_id]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        since = 0
+        progress = None
+        while True:
+            with service.changed:
+                service.changed.wait_for(
+                    lambda: (len(job["log"]) > since
+                             or job["progress"] is not progress
+                             or job["status"] not in ACTIVE_STATUSES),
+                    timeout=STREAM_TIMEOUT)
+                lines = job["log"][since:]
+                new_progress = job["progress"]
+                status = job["status"]
+            since += len(lines)
+            events = [{"type": "log", "message": line} for line in lines]
+            if new_progress is not progress:
+                progress = new_progress
+                events.append(dict(progress, type="progress"))
+            if status not in ACTIVE_STATUSES:
+                events.append({"type": "status", "status": status,
+                               "error": job["error"]})
+            elif not events:
+                # Shows that the job is still queued or running
+                events.append({"type": "status", "status": status})
+            try:
+                for event in events:
+                    self.wfile.write(json.dumps(event).encode("utf-8")
+                                     + b"\n")
+                self.wfile.flush()
+            except OSError:
+                # The client has gone
+                return
+            if status not in ACTIVE_STATUSES:
+                return
+
+
+def serve(host: str = DEFAULT_HOST,
+          port: int = DEFAULT_PORT,
+          **kwargs
+          ) -> None:
+    """Runs a JobService (with kwargs) until interrupted"""
+    service = JobService(**kwargs)
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    service.start()
+    print(f"Job service running on http://{host}:{port} with "
+          f"{service.max_workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+def _request(method: str,
+             path: str,
+             data: Optional[dict] = None,
+             port: int = DEFAULT_PORT
+             ):
+    # Sends a request to the service and returns the response
+    request = urllib.request.Request(
+        f"http://{DEFAULT_HOST}:{port}{path}", method=method,
+        data=None if data is None else json.dumps(data).encode("utf-8"),
+        headers={"Content-Type": "application/json"})
+    try:
+        return urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        raise SystemExit(json.load(e).get("error", str(e)))
+    except urllib.error.URLError as e:
+        raise SystemExit(f"Could not connect to the job service: {e.reason}")
+
+
+def _call(method: str, path: str, data: Optional[dict] = None,
+          port: int = DEFAULT_PORT):
+    with _request(method, path, data, port) as response:
+        return json.load(response)
+
+
+def follow(job_id: str, port: int = DEFAULT_PORT) -> str:
+    """Prints the log and progress of a job until it is finished, and
+    returns its final status"""
+    status = None
+    with _request("GET", f"/jobs/{job_id}/stream", port=port) as response:
+        for line in response:
+            event = json.loads(line)
+            kind = event.pop("type")
+            if kind == "log":
+                print(f"\r\033[K{event['message']}")
+            elif kind == "progress":
+                print_progress(ProgressEvent(**event))
+            else:
+                status = event["status"]
+                if event.get("error"):
+                    print(f"\r\033[KJob {job_id} {status}: {event['error']}")
+    return status
+
+
+def _format_job(job: dict) -> str:
+    text = f"{job['id']:>4}  {job['name']:<12} {job['status']:<9}"
+    if job["status"] == "running" and job["progress"]:
+        text += f" {format_progress(ProgressEvent(**job['progress']))}"
+    elif job["error"]:
+        text += f" {job['error']}"
+    return text
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Queue and run trip end model jobs on this machine")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="Run the service")
+    serve_parser.add_argument("--workers", type=int,
+                              help="Jobs run at the same time, defaults to "
+                              "the number of cores")
+    serve_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                              help="Input cache folder")
+    serve_parser.add_argument("--cache-gb", type=float,
+                              default=JOB_CACHE_BYTES / 2 ** 30,
+                              help="Size limit of the input cache")
+    serve_parser.add_argument("--memory-gb", type=float,
+                              default=DEFAULT_MEMORY_BYTES / 2 ** 30,
+                              help="Inputs kept in memory by each worker")
+    submit_parser = commands.add_parser("submit", help="Submit jobs")
+    submit_parser.add_argument("settings", nargs="+",
+                               help="Settings files exported from the GUI")
+    submit_parser.add_argument("--priority", type=int, default=0)
+    submit_parser.add_argument("--options", default="{}",
+                               help=f"JSON object of options from "
+                               f"{JOB_OPTIONS}")
+    submit_parser.add_argument("--follow", action="store_true",
+                               help="Show the log of the job until it ends")
+    status_parser = commands.add_parser("status", help="Show jobs")
+    status_parser.add_argument("job_id", nargs="?")
+    log_parser = commands.add_parser("log", help="Show the log of a job")
+    log_parser.add_argument("job_id")
+    log_parser.add_argument("--follow", action="store_true")
+    cancel_parser = commands.add_parser("cancel", help="Cancel a job")
+    cancel_parser.add_argument("job_id")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(port=args.port, max_workers=args.workers,
+              cache_dir=args.cache_dir,
+              cache_bytes=int(args.cache_gb * 2 ** 30),
+              memory_bytes=int(args.memory_gb * 2 ** 30))
+    elif args.command == "submit":
+        from run_settings import load_settings
+        options = json.loads(args.options)
+        for settings_file in args.settings:
+            job = _call("POST", "/jobs", {
+                "settings": load_settings(settings_file),
+                "options": options,
+                "priority": args.priority}, port=args.port)
+            print(f"{'Already queued as' if job['duplicate'] else 'Queued'} "
+                  f"job {job['id']} ({job['name']})")
+            if args.follow and len(args.settings) == 1:
+                if follow(job["id"], port=args.port) != "finished":
+                    raise SystemExit(1)
+    elif args.command == "status":
+        if args.job_id:
+            print(json.dumps(_call("GET", f"/jobs/{args.job_id}",
+                                   port=args.port), indent=4))
+        else:
+            print(json.dumps(_call("GET", "/status", port=args.port)))
+            for job in _call("GET", "/jobs", port=args.port):
+                print(_format_job(job))
+    elif args.command == "log":
+        if args.follow:
+            follow(args.job_id, port=args.port)
+        else:
+            for line in _call("GET", f"/jobs/{args.job_id}/log",
+                              port=args.port)["lines"]:
+                print(line)
+    elif args.command == "cancel":
+        print(_format_job(_call("POST", f"/jobs/{args.job_id}/cancel",
+                                port=args.port)))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    # Required for the worker processes in the bundled exe
+    multiprocessing.freeze_support()
+    main()
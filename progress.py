@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Reports the progress of a model run as structured events.
+
+A ProgressTracker is made active with start_progress, after which each
+stage of the model (opened with progress_stage) reports its number of
+steps with set_progress_total and each completed step with progress_step.
+When no tracker is active these functions do nothing, so the model
+functions can be used without one.
+
+Every step is passed to the tracker's callback as a ProgressEvent, with the
+stage, step, number of steps, rows and files processed, elapsed time, and
+the fraction complete and estimated time remaining of the whole run. The
+time taken by each step is saved to a history file at the end of the run,
+and later runs use it to weight the steps and stages by how long they
+took, so that the fraction complete and ETA follow the actual run time
+rather than the number of steps.
+"""
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, NamedTuple, Optional
+
+# Name of the history file, saved in the "Runs" folder of tmfs_root
+PROGRESS_HISTORY_FILE = "progress_history.json"
+
+_active_tracker = None
+
+
+class ProgressEvent(NamedTuple):
+    """Progress of a run after a step of one of its stages"""
+    stage: str
+    step: int
+    total: Optional[int]
+    message: str
+    rows: int
+    files: int
+    elapsed: float
+    finished: bool = False
+    fraction: float = 0.0
+    eta: Optional[float] = None
+
+
+class ProgressTracker:
+    """Tracks the steps of the stages of one run and passes each step to
+    callback as a ProgressEvent.
+
+    Args:
+        callback (Callable[[ProgressEvent], None]): Function called after
+        each step.
+        stages (List[str]): Names of the stages of the run.
+        history_file (str, optional): JSON file with the step times of
+        earlier runs, which is updated when the run is finished. Defaults
+        to None, which estimates progress from the number of steps.
+    """
+
+    def __init__(self,
+                 callback: Callable[[ProgressEvent], None],
+                 stages: List[str],
+                 history_file: Optional[str] = None
+                 ) -> None:
+        self.callback = callback
+        self.history_file = history_file
+        self.history = {}
+        if history_file is not None:
+            try:
+                with open(history_file, "r") as f:
+                    self.history = json.load(f)
+            except (OSError, ValueError):
+                self.history = {}
+        self.start_time = time.perf_counter()
+        self.stages = {name: self._new_stage() for name in stages}
+        self._current = []
+
+    @staticmethod
+    def _new_stage() -> dict:
+        return {"step": 0, "total": None, "rows": 0, "files": 0,
+                "start": None, "end": None, "step_times": [],
+                "finished": False}
+
+    def _history_key(self, name: str) -> str:
+        return f"{name}/{self.stages[name]['total']}"
+
+    def _stage_estimate(self, name: str) -> Optional[dict]:
+        # Step times of the stage from an earlier run with the same steps,
+        # or any earlier run if the stage has not started yet
+        if self.stages[name]["total"] is None:
+            estimate = next((value for key, value in self.history.items()
+                             if key.rsplit("/", 1)[0] == name), None)
+        else:
+            estimate = self.history.get(self._history_key(name))
+        if estimate is None or estimate["wall_time"] <= 0:
+            return None
+        return estimate
+
+    def _stage_fraction(self, name: str, now: float) -> float:
+        stage = self.stages[name]
+        if stage["finished"]:
+            return 1.0
+        if stage["start"] is None or not stage["total"]:
+            return 0.0
+        step = min(stage["step"], stage["total"])
+        estimate = self._stage_estimate(name)
+        if estimate is None:
+            return step / stage["total"]
+        # The time since the stage started, limited to between the end of
+        # the last step and the end of the next step of the earlier run
+        step_times = estimate["step_times"]
+        done = step_times[step - 1] if step > 0 else 0.0
+        next_done = (step_times[step] if step < len(step_times)
+                     else estimate["wall_time"])
+        elapsed = min(max(now - stage["start"], done), next_done)
+        return min(elapsed / estimate["wall_time"], 1.0)
+
+    def fraction(self, now: Optional[float] = None) -> float:
+        """Fraction of the run that is complete. Stages are weighted by
+        their time in earlier runs if all of them are in the history,
+        otherwise equally."""
+        if now is None:
+            now = time.perf_counter()
+        if not self.stages:
+            return 1.0
+        estimates = [self._stage_estimate(name) for name in self.stages]
+        if all(estimate is not None for estimate in estimates):
+            weights = [estimate["wall_time"] for estimate in estimates]
+        else:
+            weights = [1.0] * len(self.stages)
+        fractions = [self._stage_fraction(name, now) for name in self.stages]
+        return (sum(w * f for w, f in zip(weights, fractions))
+                / sum(weights))
+
+    def eta(self, now: Optional[float] = None) -> Optional[float]:
+        """Estimated seconds until the run is finished, or None if nothing
+        has been completed yet"""
+        if now is None:
+            now = time.perf_counter()
+        fraction = self.fraction(now)
+        if fraction <= 0:
+            return None
+        elapsed = now - self.start_time
+        return elapsed * (1 - fraction) / fraction
+
+    def update(self, event: ProgressEvent) -> None:
+        """Records an event of one of the stages (e.g. from a stage run in
+        another process) and passes it to the callback with the progress of
+        the whole run"""
+        now = time.perf_counter()
+        if event.stage not in self.stages:
+            self.stages[event.stage] = self._new_stage()
+        stage = self.stages[event.stage]
+        if stage["start"] is None:
+            stage["start"] = now - event.elapsed
+        if event.step > len(stage["step_times"]):
+            stage["step_times"].append(now - stage["start"])
+        if event.finished and stage["end"] is None:
+            stage["end"] = now
+        stage.update(step=event.step, total=event.total, rows=event.rows,
+                     files=event.files, finished=event.finished)
+        self.callback(event._replace(fraction=self.fraction(now),
+                                     eta=self.eta(now)))
+
+    def _emit(self, name: str, message: str) -> None:
+        stage = self.stages[name]
+        self.update(ProgressEvent(
+            stage=name, step=stage["step"], total=stage["total"],
+            message=message, rows=stage["rows"], files=stage["files"],
+            elapsed=time.perf_counter() - stage["start"],
+            finished=stage["finished"]))
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Context manager for a stage of the run. The stage is complete
+        when the context exits without an error."""
+        if name not in self.stages:
+            self.stages[name] = self._new_stage()
+        self.stages[name]["start"] = time.perf_counter()
+        self._current.append(name)
+        try:
+            self._emit(name, f"Started {name}")
+            yield
+            self.stages[name]["finished"] = True
+            self._emit(name, f"Finished {name}")
+        finally:
+            self._current.pop()
+
+    def set_total(self, total: int) -> None:
+        """Sets the number of steps of the current stage"""
+        if self._current:
+            self.stages[self._current[-1]]["total"] = total
+
+    def step(self, message: str, rows: int = 0, files: int = 0) -> None:
+        """Records a completed step of the current stage"""
+        if not self._current:
+            return
+        name = self._current[-1]
+        stage = self.stages[name]
+        stage["step"] += 1
+        stage["rows"] += rows
+        stage["files"] += files
+        self._emit(name, message)
+
+    def save_history(self) -> None:
+        """Saves the step times of the finished stages to the history
+        file"""
+        if self.history_file is None:
+            return
+        for name, stage in self.stages.items():
+            if not stage["finished"] or not stage["total"]:
+                continue
+            self.history[self._history_key(name)] = {
+                "wall_time": stage["end"] - stage["start"],
+                "step_times": stage["step_times"][:stage["total"]]
+            }
+        # Written to a temporary file first, as other runs may be reading it
+        tmp_file = f"{self.history_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(self.history, f, indent=1)
+            os.replace(tmp_file, self.history_file)
+        except OSError:
+            # The history only improves the estimates, so is not essential
+            pass
+
+
+def start_progress(callback: Callable[[ProgressEvent], None],
+                   stages: List[str],
+                   history_file: Optional[str] = None
+                   ) -> ProgressTracker:
+    """Creates a ProgressTracker (see ProgressTracker for the arguments) and
+    makes it the active tracker"""
+    global _active_tracker
+    _active_tracker = ProgressTracker(callback, stages,
+                                      history_file=history_file)
+    return _active_tracker
+
+
+def stop_progress(save: bool = True) -> Optional[ProgressTracker]:
+    """Stops the active tracker, saving its history if save is True, and
+    returns it"""
+    global _active_tracker
+    tracker = _active_tracker
+    _active_tracker = None
+    if tracker is not None and save:
+        tracker.save_history()
+    return tracker
+
+
+@contextmanager
+def progress_stage(name: str) -> Iterator[None]:
+    """Opens a stage of the active tracker, if any"""
+    if _active_tracker is None:
+        yield
+        return
+    with _active_tracker.stage(name):
+        yield
+
+
+def set_progress_total(total: int) -> None:
+    """Sets the number of steps of the current stage of the active tracker,
+    if any"""
+    if _active_tracker is not None:
+        _active_tracker.set_total(total)
+
+
+def progress_step(message: str, rows: int = 0, files: int = 0) -> None:
+    """Records a completed step of the current stage of the active tracker,
+    if any"""
+    if _active_tracker is not None:
+        _active_tracker.step(message, rows=rows, files=files)
+
+
+def format_duration(seconds: float) -> str:
+    """Formats a number of seconds as e.g. "45 s" or "3 min 20 s" """
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} s"
+    return f"{seconds // 60} min {seconds % 60:02d} s"
+
+
+def format_progress(event: ProgressEvent) -> str:
+    """Describes an event as e.g. "45% - goods 3/9 - about 1 min 05 s
+    left" """
+    text = f"{event.fraction:.0%} - {event.stage}"
+    if event.total:
+        text += f" {min(event.step, event.total)}/{event.total}"
+    if event.eta is not None:
+        text += f" - about {format_duration(event.eta)} left"
+    return text
+
+
+def print_progress(event: ProgressEvent,
+                   width: int = 30,
+                   stream=None
+                   ) -> None:
+    """Shows a text progress bar for the command line, which is redrawn on
+    the same line after each event"""
+    stream = stream or sys.stderr
+    filled = int(round(width * event.fraction))
+    bar = "#" * filled + "-" * (width - filled)
+    stream.write(f"\r[{bar}] {format_progress(event)}\033[K")
+    if event.fraction >= 1:
+        stream.write("\n")
+    stream.flush()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Collects timing, memory and file statistics for each stage of a model run.
+
+A RunReport is made active with start_report, after which code wrapped in
+report_stage is timed and the files read and written by the model (recorded
+with record_read and record_write) are added to every open stage. When no
+report is active these functions do nothing, so the model functions can be
+used without a report.
+
+For each stage the report records the wall time, CPU time, peak memory
+traced by tracemalloc (if enabled), bytes and rows read and written, and
+optionally a cProfile dump of the outermost stages.
+"""
+
+import cProfile
+import datetime
+import json
+import os
+import platform
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+# Name of the report file written to the run folder
+REPORT_FILE = "run_report.json"
+
+_active_report = None
+
+
+class RunReport:
+    """Timing and file statistics for the stages of one model run.
+
+    Args:
+        trace_memory (bool, optional): Flag if the peak memory of each stage
+        should be measured with tracemalloc. This slows down the parts of the
+        model written in Python. Before Python 3.9 (which added
+        tracemalloc.reset_peak) tracing is restarted at the start of each
+        outermost stage instead, so only the outermost stages have a peak
+        (of the memory allocated during the stage), and the peak of the
+        stages inside them is None. Defaults to False.
+        profile_dir (str, optional): Folder to save a cProfile dump of each
+        outermost stage to, as "<stage>.prof". Defaults to None, which does
+        not profile the run.
+    """
+
+    def __init__(self,
+                 trace_memory: bool = False,
+                 profile_dir: Optional[str] = None
+                 ) -> None:
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+        self.stages = []
+        self._open = []
+        self._profiler = None
+        self.start_time = datetime.datetime.now()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def _update_peaks(self) -> None:
+        # tracemalloc only has one peak, so it is added to every open stage
+        # and reset when a stage starts or ends. Without reset_peak the peak
+        # is only reset when tracing is restarted at the start of an
+        # outermost stage, so is only added to the outermost stage
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        if hasattr(tracemalloc, "reset_peak"):
+            stages = self._open
+        else:
+            stages = self._open[:1]
+        for stage in stages:
+            stage["peak_memory"] = max(stage["peak_memory"] or 0, peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[dict]:
+        """Context manager that records the statistics of a stage. Stages
+        opened inside another stage are named "<outer>/<inner>"."""
+        if self._open:
+            name = self._open[-1]["name"] + "/" + name
+        record = {
+            "name": name,
+            "wall_time": None,
+            "cpu_time": None,
+            "peak_memory": None,
+            "bytes_read": 0,
+            "bytes_written": 0,
+            "rows_read": 0,
+            "rows_written": 0,
+            "files_read": 0,
+            "files_written": 0,
+            "skipped": False,
+            "error": None
+        }
+        self.stages.append(record)
+        if (self.trace_memory and not self._open
+                and not hasattr(tracemalloc, "reset_peak")):
+            # Restarting clears the peak of the earlier stages
+            tracemalloc.stop()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._update_peaks()
+        self._open.append(record)
+
+        profiler = None
+        if self.profile_dir is not None and self._profiler is None:
+            profiler = cProfile.Profile()
+            self._profiler = profiler
+            profiler.enable()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = "%s: %s" % (type(e).__name__, e)
+            raise
+        finally:
+            record["wall_time"] = time.perf_counter() - wall_start
+            record["cpu_time"] = time.process_time() - cpu_start
+            if profiler is not None:
+                profiler.disable()
+                self._profiler = None
+                if not os.path.isdir(self.profile_dir):
+                    os.makedirs(self.profile_dir)
+                profiler.dump_stats(os.path.join(
+                    self.profile_dir, name.replace("/", "_") + ".prof"))
+            self._update_peaks()
+            self._open.pop()
+
+    def add_file(self,
+                 path: str,
+                 mode: str,
+                 rows: Optional[int] = None
+                 ) -> None:
+        """Adds a file read (mode "read") or written (mode "written") to all
+        open stages"""
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+        for stage in self._open:
+            stage["bytes_" + mode] += size
+            stage["rows_" + mode] += rows or 0
+            stage["files_" + mode] += 1
+
+    def add_stages(self, stages: List[dict]) -> None:
+        """Adds stages recorded by a report in another process (as in
+        to_dict()["stages"]) inside the currently open stage"""
+        prefix = self._open[-1]["name"] + "/" if self._open else ""
+        for stage in stages:
+            stage = dict(stage, name=prefix + stage["name"])
+            self.stages.append(stage)
+
+    def to_dict(self, **run_details) -> dict:
+        """Returns the report as a dictionary that can be saved as JSON.
+        run_details are added to the report as they are."""
+        return {
+            "start_time": self.start_time.isoformat(timespec="seconds"),
+            "wall_time": time.perf_counter() - self._wall_start,
+            "cpu_time": time.process_time() - self._cpu_start,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "trace_memory": self.trace_memory,
+            "run": run_details,
+            "stages": self.stages
+        }
+
+    def save(self, path: str, **run_details) -> None:
+        """Saves the report as JSON to path"""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(**run_details), f, indent=1, default=str)
+
+
+def start_report(trace_memory: bool = False,
+                 profile_dir: Optional[str] = None
+                 ) -> RunReport:
+    """Creates a RunReport and makes it the active report"""
+    global _active_report
+    _active_report = RunReport(trace_memory=trace_memory,
+                               profile_dir=profile_dir)
+    return _active_report
+
+
+def stop_report() -> Optional[RunReport]:
+    """Stops recording to the active report and returns it"""
+    global _active_report
+    report = _active_report
+    _active_report = None
+    if report is not None and report.trace_memory and \
+            tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return report
+
+
+@contextmanager
+def report_stage(name: str) -> Iterator[dict]:
+    """Records the statistics of a stage in the active report. Yields the
+    stage record, or an empty dictionary if there is no active report."""
+    if _active_report is None:
+        yield {}
+        return
+    with _active_report.stage(name) as record:
+        yield record
+
+
+def record_read(path: str, rows: Optional[int] = None) -> None:
+    """Adds a file that has been read to the active report"""
+    if _active_report is not None:
+        _active_report.add_file(path, "read", rows)
+
+
+def record_write(path: str, rows: Optional[int] = None) -> None:
+    """Adds a file that has been written to the active report"""
+    if _active_report is not None:
+        _active_report.add_file(path, "written", rows)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Run settings shared by the GUI and the batch runner.
+
+Settings are saved by the GUI (Export Settings) as JSON with the display
+name of each setting as the key, e.g. {"Forecast Year": "25", ...}.
+load_settings also accepts the setting names used here (e.g.
+"forecast_year") and fills in any missing settings with their defaults.
+
+This module only uses the standard library so that it can be imported
+without loading the model.
+"""
+
+import json
+import os
+from typing import Dict, Tuple
+
+# Global Parameters
+REBASING_RUN = 0
+
+VAR_DEFAULTS = {
+    "delta_root": ["Delta Root Directory", "DELTA"],
+    "tmfs_root": ["TMfS Root Directory", ""],
+    "forecast_year": ["Forecast Year", "18"],
+    "forecast_id": ["Forecast ID", "XXX"],
+    "forecast_scenario": ["Forecast Scenario", "XX"],
+    "base_year": ["Base Year", "18"],
+    "base_id": ["Base ID", "ZZZ"],
+    "base_scenario": ["Base Scenario", "ZZ"],
+    "Trip Rates": ["Trip Rate File", "",
+                   "Should be the same as the trip rates used to create the "
+                   "base year (pivot) file"],
+    "RTF File": ["RTF File", ""],
+    "PTF File": ["PTF File", ""],
+    "Airport Growth File": ["Airport Growth File", ""],
+    "home_working": ["Integrate Home Working", 1],
+    "old_tr_fmt": ["Use Old Trip Rate Format (Legacy)", 0],
+    "rebasing_run": ["Rebasing Run", REBASING_RUN],
+    "parallel": ["Run Main, Goods and Add-ins in Parallel", 0],
+    "skip_unchanged": ["Skip Unchanged Stages", 0],
+    "smooth": ["Smooth Goods and Add-in Matrices", 0]
+}
+
+ALT_FACTOR_VARS = ["Trip Rates", "RTF File", "PTF File", "Airport Growth File"]
+
+# Settings that are passed to telmos_all as keyword arguments, the others
+# are passed by position in the order of VAR_DEFAULTS
+KEYWORD_VARS = ["parallel", "skip_unchanged", "smooth"]
+
+BOOLEAN_VARS = ["rebasing_run", "home_working", "old_tr_fmt",
+                "parallel", "skip_unchanged", "smooth"]
+
+
+def default_settings() -> Dict[str, object]:
+    """Returns the default value of each setting"""
+    return {k: value[1] for k, value in VAR_DEFAULTS.items()}
+
+
+def setting_name(key: str) -> str:
+    """Returns the name of a setting from its name or display name
+
+    Raises:
+        KeyError: If the setting does not exist
+    """
+    if key in VAR_DEFAULTS:
+        return key
+    for name, value in VAR_DEFAULTS.items():
+        if value[0] == key:
+            return name
+    raise KeyError(f"Setting {key} does not exist")
+
+
+def normalise_settings(settings: Dict[str, object]) -> Dict[str, object]:
+    """Returns settings keyed by setting name (rather than display name),
+    with the defaults for any missing settings. Flags are given as 0 or 1
+    and other settings as text, so that e.g. a forecast year of 25 or "25"
+    gives the same settings.
+
+    Raises:
+        KeyError: If a setting does not exist
+        ValueError: If a flag is not a number
+    """
+    normalised = default_settings()
+    for key, value in settings.items():
+        name = setting_name(key)
+        if name in BOOLEAN_VARS:
+            normalised[name] = int(bool(int(value)))
+        else:
+            normalised[name] = str(value)
+    return normalised
+
+
+def load_settings(settings_file: str) -> Dict[str, object]:
+    """Loads a settings file exported by the GUI (see normalise_settings)"""
+    with open(settings_file, "r") as f:
+        return normalise_settings(json.load(f))
+
+
+def telmos_args(settings: Dict[str, object]) -> Tuple[tuple, dict]:
+    """Returns the positional and keyword arguments of telmos_all for
+    settings (as returned by normalise_settings)"""
+    args = []
+    kwargs = {}
+    for key in VAR_DEFAULTS:
+        value = settings[key]
+        if key in BOOLEAN_VARS:
+            value = bool(int(value))
+        if key in KEYWORD_VARS:
+            kwargs[key] = value
+        else:
+            args.append(value)
+    return tuple(args), kwargs
+
+
+def output_folder(settings: Dict[str, object]) -> str:
+    """Returns the folder that a run with settings writes its outputs to"""
+    return os.path.join(settings["tmfs_root"], "Runs",
+                        str(settings["forecast_year"]), "Demand",
+                        str(settings["forecast_id"]))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the trip end model for many scenarios from the command line.
+
+Runs are given as settings files exported from the GUI (Export Settings)
+and/or scenario matrix files. A scenario matrix is a JSON file such as:
+
+    {
+        "settings": "base_settings.json",
+        "matrix": {
+            "forecast_year": ["25", "30", "35"],
+            "forecast_scenario": ["CD", "DL"],
+            "forecast_id": "{forecast_scenario}{forecast_year}"
+        },
+        "options": {"input_cache": "D:/TEM_cache"}
+    }
+
+which runs every combination of the listed values (here 3 years x 2
+scenarios) using the other settings from "settings" (a settings file,
+relative to the matrix file, or the settings themselves). Matrix values
+that are text are formatted with the settings of each run, so that each
+run can be given its own forecast ID. "options" are other arguments of
+telmos_all (e.g. "sparse", "input_cache").
+
+Identical runs are only run once, and runs that would write to the same
+output folder with different settings are rejected before any run
+starts. The runs are shared between --workers processes, and the log of
+each run (including its progress) and a summary of the status and
+timings of every run are saved in --output-dir. Run from the root of the
+repository:
+
+    python -m scripts.batch_run night1.json night2.json --workers 4
+    python -m scripts.batch_run --matrix scenarios.json --dry-run
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from typing import Dict, List, Tuple
+
+from run_settings import (load_settings, normalise_settings, output_folder,
+                          setting_name, telmos_args)
+
+SUMMARY_FILE = "batch_summary"
+LOG_DIR = "logs"
+
+
+def matrix_runs(matrix_file: str) -> List[Tuple[dict, dict]]:
+    """Returns the settings and telmos_all options of each run in a scenario
+    matrix file.
+
+    Raises:
+        ValueError: If the matrix file has unknown keys
+    """
+    with open(matrix_file, "r") as f:
+        matrix_def = json.load(f)
+    unknown = set(matrix_def) - {"settings", "matrix", "options"}
+    if unknown:
+        raise ValueError(f"Unknown keys in {matrix_file}: {sorted(unknown)}")
+
+    base = matrix_def.get("settings", {})
+    if isinstance(base, str):
+        base = load_settings(
+            os.path.join(os.path.dirname(matrix_file), base))
+    else:
+        base = normalise_settings(base)
+    options = matrix_def.get("options", {})
+
+    # Settings with a list of values are combined, text is formatted once
+    # the other values of each run are known
+    matrix = {setting_name(k): v
+              for k, v in matrix_def.get("matrix", {}).items()}
+    lists = {k: v for k, v in matrix.items() if isinstance(v, list)}
+    templates = {k: v for k, v in matrix.items() if not isinstance(v, list)}
+
+    runs = []
+    for values in product(*lists.values()):
+        settings = dict(base, **dict(zip(lists, values)))
+        for key, template in templates.items():
+            settings[key] = (template.format(**settings)
+                             if isinstance(template, str) else template)
+        runs.append((normalise_settings(settings), dict(options)))
+    return runs
+
+
+def plan_runs(runs: List[Tuple[dict, dict]]
+              ) -> Tuple[List[Tuple[str, dict, dict]], int]:
+    """Removes duplicate runs and names each run by its forecast year and
+    ID. Runs with the same name (e.g. with different TMfS root folders)
+    are also named by a short hash of their output folder.
+
+    Raises:
+        ValueError: If two different runs write to the same output folder
+
+    Returns:
+        Tuple[List[Tuple[str, dict, dict]], int]: The name, settings and
+        options of each run, and the number of duplicates removed.
+    """
+    planned = []
+    seen = set()
+    folders = {}
+    for settings, options in runs:
+        settings = normalise_settings(settings)
+        run_key = json.dumps([settings, options], sort_keys=True)
+        if run_key in seen:
+            continue
+        seen.add(run_key)
+        folder = os.path.normcase(os.path.abspath(output_folder(settings)))
+        if folder in folders:
+            raise ValueError(f"Runs {folders[folder]} and "
+                             f"{len(planned) + 1} both write to {folder} "
+                             f"with different settings")
+        folders[folder] = len(planned) + 1
+        name = f"{settings['forecast_year']}_{settings['forecast_id']}"
+        planned.append((name, settings, options))
+
+    # The names are used for the log files, so should be unique
+    names = [name for name, _, _ in planned]
+    for i, (name, settings, options) in enumerate(planned):
+        if names.count(name) > 1:
+            folder = os.path.normcase(os.path.abspath(
+                output_folder(settings)))
+            folder_hash = hashlib.sha1(folder.encode("utf-8")).hexdigest()
+            planned[i] = (f"{name}_{folder_hash[:6]}", settings, options)
+    return planned, len(runs) - len(planned)
+
+
+def run_one(settings: dict, options: dict, log_file: str) -> Dict:
+    """Runs telmos_all for one set of settings, writing its log messages to
+    log_file, and returns its status and timings"""
+    # Imported here so that the model is only loaded in the workers
+    from progress import format_progress
+    from telmos_script import telmos_all
+
+    args, kwargs = telmos_args(settings)
+    kwargs.update(options)
+    start = time.time()
+    cpu_start = time.process_time()
+    status = "finished"
+    error = ""
+    with open(log_file, "w") as log:
+        def print_func(message):
+            log.write(f"{message}\n")
+            log.flush()
+
+        def progress_func(event):
+            # Shows whether a long run is still making progress
+            print_func(f"Progress: {format_progress(event)}")
+
+        try:
+            telmos_all(*args, print_func=print_func,
+                       progress_func=progress_func, **kwargs)
+        except Exception as e:
+            status = "failed"
+            error = f"{type(e).__name__}: {e}"
+            traceback.print_exc(file=log)
+    return {"status": status,
+            "error": error,
+            "start": time.strftime("%Y-%m-%d %H:%M:%S",
+                                   time.localtime(start)),
+            "wall_time": round(time.time() - start, 3),
+            "cpu_time": round(time.process_time() - cpu_start, 3)}
+
+
+def write_summary(output_dir: str, results: List[Dict]) -> None:
+    """Saves the results of each run as JSON and CSV in output_dir"""
+    with open(os.path.join(output_dir, SUMMARY_FILE + ".json"), "w") as f:
+        json.dump(results, f, indent=4)
+    columns = ["name", "status", "start", "wall_time", "cpu_time",
+               "output_folder", "log_file", "error"]
+    with open(os.path.join(output_dir, SUMMARY_FILE + ".csv"), "w",
+              newline="") as f:
+        writer = csv.DictWriter(f, columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def run_batch(runs: List[Tuple[str, dict, dict]],
+              output_dir: str,
+              workers: int = 1,
+              print_func=print
+              ) -> List[Dict]:
+    """Runs each (name, settings, options) in runs in a pool of workers
+    processes, and saves a summary in output_dir.
+
+    Returns:
+        List[Dict]: The status and timings of each run, in the same order
+        as runs.
+    """
+    log_dir = os.path.join(output_dir, LOG_DIR)
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    results = [{"name": name,
+                "status": "queued",
+                "output_folder": output_folder(settings),
+                "log_file": os.path.join(log_dir, f"{name}.log"),
+                "settings": settings,
+                "options": options}
+               for name, settings, options in runs]
+    write_summary(output_dir, results)
+
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(run_one, settings, options, result["log_file"]): i
+            for i, ((_, settings, options), result)
+            in enumerate(zip(runs, results))
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            result = results[futures[future]]
+            try:
+                result.update(future.result())
+            except Exception as e:
+                # The worker process itself failed
+                result.update(status="failed",
+                              error=f"{type(e).__name__}: {e}")
+            message = (f"[{done}/{len(runs)}] {result['name']} "
+                       f"{result['status']}")
+            if "wall_time" in result:
+                message += f" in {result['wall_time']:.0f} s"
+            if result["error"]:
+                message += f": {result['error']}"
+            print_func(message)
+            # Rewritten after each run so that progress can be checked
+            write_summary(output_dir, results)
+    failed = sum(result["status"] != "finished" for result in results)
+    print_func(f"{len(runs) - failed} of {len(runs)} runs finished, "
+               f"{failed} failed in {time.time() - start:.0f} s. Summary "
+               f"saved to {os.path.join(output_dir, SUMMARY_FILE)}.csv")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run the trip end model for many scenarios")
+    parser.add_argument("settings", nargs="*",
+                        help="Settings files exported from the GUI")
+    parser.add_argument("--matrix", nargs="+", default=[],
+                        help="Scenario matrix files")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of runs at the same time")
+    parser.add_argument("--output-dir", default="batch_run",
+                        help="Folder for the run logs and summary")
+    parser.add_argument("--input-cache",
+                        help="Input cache folder shared by all runs (see "
+                        "input_cache.py)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="List the runs without running them")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers should be at least 1")
+
+    runs = [(load_settings(x), {}) for x in args.settings]
+    for matrix_file in args.matrix:
+        runs.extend(matrix_runs(matrix_file))
+    if not runs:
+        parser.error("No settings or scenario matrix files given")
+    if args.input_cache:
+        for _, options in runs:
+            options.setdefault("input_cache", args.input_cache)
+    try:
+        runs, duplicates = plan_runs(runs)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{len(runs)} runs ({duplicates} duplicates removed)")
+    if args.dry_run:
+        for name, settings, options in runs:
+            print(f"  {name}: {output_folder(settings)} {options or ''}")
+        return
+    results = run_batch(runs, args.output_dir, workers=args.workers)
+    if any(result["status"] != "finished" for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    # Required for the process pool in the bundled exe
+    multiprocessing.freeze_support()
+    main()
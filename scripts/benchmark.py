@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks the trip end model on synthetic zone systems of different sizes.
+
+Times telmos_main, telmos_goods and telmos_addins, and the readers and
+writers they use, on data created by scripts/synthetic_data.py, and the
+startup time of the GUI and of importing the model. The wall time and CPU
+time of each repeat and the peak memory traced by tracemalloc are written
+to a JSON file, so that results can be compared between commits:
+
+    python -m scripts.benchmark --zones 803 5000 --output new.json
+    python -m scripts.benchmark --compare old.json new.json
+
+Run from the root of the repository. The synthetic data is kept in
+--data-dir (one sub-folder per zone system) and reused by later runs.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from data_functions import odfile_to_matrix, matrix_to_odfile
+from scripts.synthetic_data import (generate_synthetic_data, BASE_SCENARIO,
+                                    FORECAST_SCENARIO)
+from telmos_addins import telmos_addins
+from telmos_goods import read_goods_file, load_goods_data, telmos_goods
+from telmos_main import (telmos_main, read_long_trip_rates,
+                         load_planning_data, load_cte_tod_files,
+                         save_trip_end_files, TOD_FILES, CTE_FILES,
+                         SPLIT_TR_FILE)
+from zone_system import load_zone_system, ZONE_DEF_FILE
+
+BENCHMARKS = ["gui_startup", "model_import",
+              "read_long_trip_rates", "load_planning_data",
+              "load_cte_tod_files", "save_trip_end_files", "telmos_main",
+              "read_goods_file", "load_goods_data", "telmos_goods",
+              "odfile_to_matrix", "matrix_to_odfile", "telmos_addins"]
+# Benchmarks that are timed in a new interpreter, as modules are only
+# imported once. They do not use the synthetic data, so are saved with 0
+# zones
+STARTUP_BENCHMARKS = {
+    # Time until the window is drawn, or until gui is imported if there is
+    # no display
+    "gui_startup": (
+        "import tkinter as tk\n"
+        "import gui\n"
+        "try:\n"
+        "    root = tk.Tk()\n"
+        "except tk.TclError:\n"
+        "    root = None\n"
+        "if root is not None:\n"
+        "    gui.Application(root)\n"
+        "    root.update()\n"
+    ),
+    # Time taken to import the model in the background of the GUI
+    "model_import": "import telmos_script\n"
+}
+STARTUP_TEMPLATE = (
+    "import os, time\n"
+    "wall_start = time.perf_counter()\n"
+    "cpu_start = time.process_time()\n"
+    "{code}"
+    "print(time.perf_counter() - wall_start,"
+    " time.process_time() - cpu_start, flush=True)\n"
+    # Exit without waiting for the model import started by the GUI
+    "os._exit(0)\n"
+)
+# Benchmarks that need the goods and add-in matrices
+MATRIX_BENCHMARKS = ["read_goods_file", "load_goods_data", "telmos_goods",
+                     "odfile_to_matrix", "matrix_to_odfile", "telmos_addins"]
+# Benchmarks that need data prepared before timing. These are given as a
+# function that returns the function to time
+PREPARED_BENCHMARKS = ["save_trip_end_files", "matrix_to_odfile"]
+
+
+def _benchmark_cases(delta_root: str,
+                     tmfs_root: str,
+                     scratch_dir: str
+                     ) -> Dict[str, Callable]:
+    """Returns the function to time for each benchmark, all taking no
+    arguments and using the synthetic data in delta_root and tmfs_root"""
+    base_year, base_id, base_scenario = BASE_SCENARIO
+    tel_year, tel_id, tel_scenario = FORECAST_SCENARIO
+    scenario_args = (delta_root, tmfs_root, tel_year, tel_id, tel_scenario,
+                     base_year, base_id, base_scenario)
+    base_dir = os.path.join(tmfs_root, "Runs", base_year, "Demand", base_id)
+    goods_file = os.path.join(delta_root, tel_scenario,
+                              "trfl%s%s.dat" % (tel_year, tel_scenario))
+    od_file = os.path.join(base_dir, "AMPT.DAT")
+    zone_system = load_zone_system(tmfs_root)
+
+    def write_trip_ends():
+        tod_data, cte_data = load_cte_tod_files(TOD_FILES, CTE_FILES,
+                                                base_dir)
+        return lambda: (save_trip_end_files(TOD_FILES, tod_data,
+                                            scratch_dir, 3),
+                        save_trip_end_files(CTE_FILES, cte_data,
+                                            scratch_dir, 5))
+
+    def write_od_matrix():
+        matrices = odfile_to_matrix(od_file, num_columns=3)
+        return lambda: matrix_to_odfile(
+            matrices, os.path.join(scratch_dir, "AMPT.DAT"), num_columns=3)
+
+    def no_log(message):
+        pass
+
+    return {
+        "read_long_trip_rates": lambda: read_long_trip_rates(
+            os.path.join(tmfs_root, "Factors", SPLIT_TR_FILE),
+            work_type_split=True, use_cache=False),
+        "load_planning_data": lambda: load_planning_data(
+            delta_root, tel_year, tel_scenario, integrate_home_working=True,
+            zone_system=zone_system),
+        "load_cte_tod_files": lambda: load_cte_tod_files(
+            TOD_FILES, CTE_FILES, base_dir),
+        "save_trip_end_files": write_trip_ends,
+        "telmos_main": lambda: telmos_main(
+            *scenario_args, is_rebasing_run=False, log_func=no_log,
+            integrate_home_working=True),
+        "read_goods_file": lambda: read_goods_file(goods_file),
+        "load_goods_data": lambda: load_goods_data(
+            goods_file, os.path.join(scratch_dir, "hgv.dat"),
+            os.path.join(scratch_dir, "lgv.dat"), zone_system),
+        "telmos_goods": lambda: telmos_goods(
+            *scenario_args, is_rebasing_run=False, log_func=no_log),
+        "odfile_to_matrix": lambda: odfile_to_matrix(od_file, num_columns=3),
+        "matrix_to_odfile": write_od_matrix,
+        "telmos_addins": lambda: telmos_addins(*scenario_args,
+                                               log_func=no_log)
+    }
+
+
+def time_function(func: Callable,
+                  repeats: int = 3,
+                  trace_memory: bool = True
+                  ) -> dict:
+    """Times func over a number of repeats, then runs it once more with
+    tracemalloc to find the peak memory allocated while it runs.
+
+    Returns:
+        dict: Wall and CPU time (seconds) of each repeat and the peak traced
+        memory (bytes).
+    """
+    wall_times = []
+    cpu_times = []
+    for _ in range(repeats):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        func()
+        cpu_times.append(time.process_time() - cpu_start)
+        wall_times.append(time.perf_counter() - wall_start)
+    result = {
+        "wall_times": wall_times,
+        "cpu_times": cpu_times,
+        "wall_min": min(wall_times),
+        "wall_median": statistics.median(wall_times),
+        "cpu_min": min(cpu_times),
+        "peak_memory": None
+    }
+    if trace_memory:
+        # Traced separately as tracemalloc slows down the timed runs
+        tracemalloc.start()
+        try:
+            func()
+            result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def time_startup(code: str, repeats: int = 3) -> dict:
+    """Times code in a new Python interpreter for each repeat, started from
+    the root of the repository.
+
+    Raises:
+        RuntimeError: If the interpreter fails
+
+    Returns:
+        dict: Wall and CPU time (seconds) of each repeat, in the same format
+        as time_function (with no peak memory).
+    """
+    wall_times = []
+    cpu_times = []
+    for _ in range(repeats):
+        process = subprocess.run(
+            [sys.executable, "-c", STARTUP_TEMPLATE.format(code=code)],
+            capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.strip().splitlines()[-1])
+        wall_time, cpu_time = process.stdout.split()[-2:]
+        wall_times.append(float(wall_time))
+        cpu_times.append(float(cpu_time))
+    return {
+        "wall_times": wall_times,
+        "cpu_times": cpu_times,
+        "wall_min": min(wall_times),
+        "wall_median": statistics.median(wall_times),
+        "cpu_min": min(cpu_times),
+        "peak_memory": None
+    }
+
+
+def run_benchmarks(zone_counts: List[int],
+                   data_dir: str,
+                   names: List[str] = None,
+                   repeats: int = 3,
+                   trace_memory: bool = True,
+                   log_func: Callable = print
+                   ) -> dict:
+    """Runs the benchmarks for each zone system, creating the synthetic data
+    in data_dir if it does not already exist.
+
+    Args:
+        zone_counts (List[int]): Total number of zones of each zone system.
+        data_dir (str): Folder to keep the synthetic data in.
+        names (List[str], optional): Benchmarks to run. Defaults to None,
+        which runs all of them.
+        repeats (int, optional): Number of timed runs. Defaults to 3.
+        trace_memory (bool, optional): Flag if the peak memory should be
+        measured. Defaults to True.
+
+    Returns:
+        dict: The benchmark results and details of the environment.
+    """
+    names = names or BENCHMARKS
+    results = []
+    for name in [x for x in names if x in STARTUP_BENCHMARKS]:
+        log_func(f"Running {name}")
+        result = {"name": name, "zones": 0, "error": None}
+        try:
+            result.update(time_startup(STARTUP_BENCHMARKS[name], repeats))
+        except Exception as e:
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+            log_func(f"Failed: {result['error']}")
+        else:
+            log_func(f"Best of {repeats}: {result['wall_min']:.3f}s")
+        results.append(result)
+
+    names = [x for x in names if x not in STARTUP_BENCHMARKS]
+    for num_zones in zone_counts if names else []:
+        root = os.path.join(data_dir, "zones_%d" % num_zones)
+        scratch_dir = os.path.join(root, "scratch")
+        matrices = any(x in MATRIX_BENCHMARKS for x in names)
+        if not os.path.isfile(os.path.join(
+                root, "TMFS", "Factors", ZONE_DEF_FILE)) or (
+                matrices and not os.path.isfile(os.path.join(
+                    root, "TMFS", "Runs", BASE_SCENARIO[0], "Demand",
+                    BASE_SCENARIO[1], "AMPT.DAT"))):
+            log_func(f"Creating synthetic data with {num_zones} zones")
+            generate_synthetic_data(root, num_zones, matrices=matrices)
+        if not os.path.isdir(scratch_dir):
+            os.makedirs(scratch_dir)
+        cases = _benchmark_cases(os.path.join(root, "DELTA"),
+                                 os.path.join(root, "TMFS"), scratch_dir)
+
+        for name in names:
+            log_func(f"Running {name} with {num_zones} zones")
+            result = {"name": name, "zones": num_zones, "error": None}
+            try:
+                func = cases[name]
+                if name in PREPARED_BENCHMARKS:
+                    func = func()
+                result.update(time_function(func, repeats, trace_memory))
+            except Exception as e:
+                # Record the failure so the remaining benchmarks still run
+                result["error"] = "%s: %s" % (type(e).__name__, e)
+                log_func(f"Failed: {result['error']}")
+            else:
+                log_func(f"Best of {repeats}: {result['wall_min']:.3f}s")
+            results.append(result)
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "repeats": repeats,
+        "results": results
+    }
+
+
+def compare_results(old: dict,
+                    new: dict,
+                    print_func: Callable = print
+                    ) -> None:
+    """Prints the change in time and memory of each benchmark between two
+    sets of results"""
+    old_results = {(r["name"], r["zones"]): r for r in old["results"]}
+    print_func("%-22s %7s %10s %10s %8s %8s" % (
+        "Benchmark", "Zones", "Old (s)", "New (s)", "Speedup", "Memory"))
+    for r in new["results"]:
+        o = old_results.get((r["name"], r["zones"]))
+        if o is None or o["error"] or r["error"]:
+            continue
+        memory = ""
+        if o["peak_memory"] and r["peak_memory"]:
+            memory = "%.2fx" % (r["peak_memory"] / o["peak_memory"])
+        print_func("%-22s %7d %10.3f %10.3f %7.2fx %8s" % (
+            r["name"], r["zones"], o["wall_min"], r["wall_min"],
+            o["wall_min"] / r["wall_min"], memory))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the trip end model on synthetic data")
+    parser.add_argument("--zones", type=int, nargs="+", default=[803],
+                        help="Total zones of each zone system to test")
+    parser.add_argument("--benchmarks", nargs="+", default=None,
+                        help="Names of the benchmarks to run (default all)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Do not measure peak memory")
+    parser.add_argument("--data-dir", default=os.path.join(
+        tempfile.gettempdir(), "trip_end_benchmark"),
+        help="Folder for the synthetic data")
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="JSON file to save the results to")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two results files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], "r") as f:
+            old_results = json.load(f)
+        with open(args.compare[1], "r") as f:
+            new_results = json.load(f)
+        compare_results(old_results, new_results)
+        sys.exit()
+
+    benchmark_results = run_benchmarks(args.zones, args.data_dir,
+                                       names=args.benchmarks,
+                                       repeats=args.repeats,
+                                       trace_memory=not args.no_memory)
+    with open(args.output, "w") as f:
+        json.dump(benchmark_results, f, indent=1)
+    print(f"Results saved to {args.output}")
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Converts trip end model input files between text and the binary matrix
+store format (see data_functions.save_matrix_store).
+
+The model reads either format from the same file name, so base year data
+can be converted in place to avoid parsing it on every run. For example,
+to convert the base year matrices, trip end and pivot files of a scenario:
+
+    python -m scripts.matrix_store to-binary "Runs/18/Demand/BAS/"*.DAT
+    python -m scripts.matrix_store to-binary "Runs/18/Demand/BAS/"*.CTE
+
+and to convert them back:
+
+    python -m scripts.matrix_store to-text "Runs/18/Demand/BAS/"*.DAT
+"""
+
+import argparse
+import os
+
+from data_functions import (STORE_KINDS, is_matrix_store, read_store_header,
+                            store_to_text, text_to_store)
+from zone_system import load_zone_system
+
+
+def _convert(in_file: str, out_file: str, convert, **kwargs) -> None:
+    # Converted via a temporary file so in place conversions are safe
+    tmp_file = out_file + ".tmp"
+    convert(in_file, tmp_file, **kwargs)
+    os.replace(tmp_file, out_file)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Convert files between text and binary matrix stores")
+    parser.add_argument("command", choices=["to-binary", "to-text", "info"])
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--output", help="Output file (if converting one "
+                        "file), defaults to converting in place")
+    parser.add_argument("--kind", choices=STORE_KINDS,
+                        help="Kind of text file, guessed from the name if "
+                        "not given")
+    parser.add_argument("--tmfs-root", help="TMfS root directory, to record "
+                        "its zone system in the stores")
+    args = parser.parse_args()
+    if args.output and len(args.files) > 1:
+        parser.error("--output can only be used with one file")
+
+    zone_system = None
+    if args.tmfs_root:
+        zone_system = load_zone_system(args.tmfs_root)
+    for in_file in args.files:
+        out_file = args.output or in_file
+        if args.command == "info":
+            if is_matrix_store(in_file):
+                header = read_store_header(in_file)
+                print(in_file, header["attrs"], {
+                    name: (entry["dtype"], entry["shape"])
+                    for name, entry in header["arrays"].items()})
+            else:
+                print(in_file, "text")
+        elif args.command == "to-binary":
+            if is_matrix_store(in_file):
+                print("Already binary: %s" % in_file)
+                continue
+            _convert(in_file, out_file, text_to_store, kind=args.kind,
+                     zone_system=zone_system)
+            print("Converted %s to binary" % in_file)
+        else:
+            if not is_matrix_store(in_file):
+                print("Already text: %s" % in_file)
+                continue
+            _convert(in_file, out_file, store_to_text)
+            print("Converted %s to text" % in_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Generates synthetic DELTA and tmfs_root directory trees for testing and
+benchmarking the trip end model at different zone system sizes.
+
+The generated data is random, but every file has the layout and zone counts
+the model expects, so a full run (main, goods and add-ins) can be made from
+the base scenario to the forecast scenario. The planning data for the
+forecast is the base planning data with a small amount of random growth.
+
+Example:
+    python -m scripts.synthetic_data "Synthetic 803" --zones 803
+
+Note that the goods and add-in inputs are full OD matrices, so their size
+grows with the square of the number of zones (about 60MB per matrix file at
+803 zones). Use matrices=False for large zone systems if only the main trip
+end calculations are needed.
+"""
+
+import argparse
+import json
+import os
+import shutil
+from itertools import product
+from typing import Dict
+
+import numpy as np
+
+from data_functions import write_fixed_format
+from telmos_main import TR_AREA_TYPES, TR_MODES, TR_PERIODS, TR_PURPOSES
+from zone_system import AREA_DEF_FILE, ZONE_DEF_FILE, TMFS18_DEFINITION
+
+# Standard factor files (trip rates, RTF/PTF, airport and attraction factors)
+STANDARD_INPUT_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "standard input"
+)
+# Factor files that are copied unchanged for every zone system
+COPY_FACTOR_FILES = {
+    "Attraction Factors.txt": "Attraction Factors.txt",
+    "TripRates.csv": "TripRates.csv",
+    "TripRatesSplit.csv": "TripRatesSplit.csv",
+    "airport_factors.csv": "airport_factors.csv",
+    "RTF.dat": "RTF.DAT",
+    "PTF.dat": "PTF.DAT"
+}
+# Number of external zones at the end of the zone system (as in TMfS18)
+EXTERNAL_ZONES = 16
+# Household types per zone in the population planning data
+HOUSEHOLD_TYPES = 8
+# Default scenario names, as (year, TMfS ID, TELMoS scenario)
+BASE_SCENARIO = ("18", "BAS", "AB")
+FORECAST_SCENARIO = ("25", "FOR", "CD")
+
+TOD_TYPES = ["HWZ_A1", "HOZ_A1", "HEZ_A1", "HSZ_A1"]
+TRIP_END_FILES = (
+    ["%s_%s" % (period, t) for period in ["AM", "IP"] for t in TOD_TYPES]
+    + ["PM_HSZ_A1"]
+)
+GOODS_FILES = ["%s%s.DAT" % (period, vehicle) for period in ["AM", "IP", "PM"]
+               for vehicle in ["HGV", "LGV"]]
+ADDIN_FILES = ["%s%s.DAT" % (period, purpose)
+               for period in ["AM", "IP", "PM"]
+               for purpose in ["PT", "COM", "EMP", "OTH"]]
+PRODUCTION_PIVOT_COLUMNS = 64
+
+
+def _od_columns(num_zones: int) -> np.array:
+    origins = np.repeat(np.arange(1, num_zones + 1), num_zones)
+    destinations = np.tile(np.arange(1, num_zones + 1), num_zones)
+    return np.stack((origins, destinations), axis=1)
+
+
+def _write_planning_data(scenario_dir: str,
+                         year: str,
+                         scenario: str,
+                         tav: np.array,
+                         tmfs: np.array
+                         ) -> None:
+    int_zones = tav.shape[0]
+    if not os.path.isdir(scenario_dir):
+        os.makedirs(scenario_dir)
+    zones = np.arange(1, int_zones + 1)[:, None]
+    write_fixed_format(
+        os.path.join(scenario_dir, "tav_%s%s.csv" % (year, scenario.lower())),
+        np.concatenate((zones, tav), axis=1),
+        fmt=["%d"] + ["%.3f"] * tav.shape[1],
+        header="zone,pop,emp,ag,ret,hos,fin,edu,hea"
+    )
+    household = np.stack(
+        (np.repeat(zones[:, 0], HOUSEHOLD_TYPES),
+         np.tile(np.arange(1, HOUSEHOLD_TYPES + 1), int_zones)),
+        axis=1
+    )
+    write_fixed_format(
+        os.path.join(scenario_dir, "tmfs%s%s.csv" % (year, scenario.lower())),
+        np.concatenate((household, tmfs), axis=1),
+        fmt=["%d", "%d"] + ["%.3f"] * tmfs.shape[1],
+        header=",".join(["zone", "hh_type"] + [
+            "p%d" % i for i in range(tmfs.shape[1])])
+    )
+
+
+def _write_goods_data(goods_file: str,
+                      num_zones: int,
+                      rng: np.random.Generator
+                      ) -> None:
+    # TELMoS goods files have a header line, then one line per zone pair
+    # for HGV (indicator 1) and LGV (indicator 2), in no particular order
+    od = _od_columns(num_zones)
+    blocks = []
+    for indicator in (1, 2):
+        values = np.round(rng.random(od.shape[0]) * 10, 3)
+        values[rng.random(od.shape[0]) < 0.3] = 0
+        blocks.append(np.concatenate(
+            (np.full((od.shape[0], 1), indicator), od, values[:, None]),
+            axis=1
+        ))
+    blocks = np.concatenate(blocks)
+    write_fixed_format(goods_file, blocks[rng.permutation(blocks.shape[0])],
+                       fmt=["%d", "%d", "%d", "%.3f"], delimiter=" ",
+                       header="Synthetic TELMoS goods data")
+
+
+def write_legacy_trip_rates(factors_dir: str,
+                            seed: int = 0,
+                            tag: str = None
+                            ) -> None:
+    """Writes random trip rates in the legacy format (one file of household
+    type by person type rates for each period, purpose, mode and area type,
+    including the off-peak) to factors_dir. tag is added to the file names,
+    e.g. "WAH" for the home working trip rates."""
+    rng = np.random.default_rng(seed)
+    for period, purpose, mode, area_type in product(
+            TR_PERIODS + ["OP"], TR_PURPOSES, TR_MODES, TR_AREA_TYPES):
+        file_name = "%s_%s_%s_%s" % (purpose, mode, period, area_type)
+        if tag is not None:
+            file_name += "_" + tag
+        np.savetxt(os.path.join(factors_dir, file_name + ".txt"),
+                   rng.random((HOUSEHOLD_TYPES, 11)), fmt="%.5f")
+
+
+def generate_synthetic_data(root: str,
+                            num_zones: int = 803,
+                            seed: int = 0,
+                            matrices: bool = True,
+                            home_working: bool = True,
+                            base: tuple = BASE_SCENARIO,
+                            forecast: tuple = FORECAST_SCENARIO
+                            ) -> Dict[str, str]:
+    """Creates a synthetic DELTA and tmfs_root directory tree in root.
+
+    Args:
+        root (str): Directory to create the trees in.
+        num_zones (int, optional): Total number of zones, including
+        EXTERNAL_ZONES external zones. Defaults to 803 (TMfS18).
+        seed (int, optional): Seed for the random data. Defaults to 0.
+        matrices (bool, optional): Flag if the goods and add-in OD matrices
+        should be created. Defaults to True.
+        home_working (bool, optional): Flag if the population planning data
+        should be split by WAH/WBC. Defaults to True.
+        base (tuple, optional): (year, TMfS ID, TELMoS scenario) of the base.
+        forecast (tuple, optional): (year, TMfS ID, TELMoS scenario) of the
+        forecast.
+
+    Returns:
+        Dict[str, str]: The delta_root and tmfs_root paths.
+    """
+    int_zones = num_zones - EXTERNAL_ZONES
+    if int_zones <= 711:
+        # The airport factors refer to zones 708-711
+        raise ValueError("Synthetic zone systems need at least 712 "
+                         "internal zones")
+    rng = np.random.default_rng(seed)
+    delta_root = os.path.join(root, "DELTA")
+    tmfs_root = os.path.join(root, "TMFS")
+    base_year, base_id, base_scenario = base
+    tel_year, _, tel_scenario = forecast
+
+    # Factors
+    factors_dir = os.path.join(tmfs_root, "Factors")
+    if not os.path.isdir(factors_dir):
+        os.makedirs(factors_dir)
+    for src, dst in COPY_FACTOR_FILES.items():
+        shutil.copy(os.path.join(STANDARD_INPUT_DIR, src),
+                    os.path.join(factors_dir, dst))
+    # Area types 3-8 as used by the trip rates
+    write_fixed_format(
+        os.path.join(factors_dir, AREA_DEF_FILE),
+        np.stack((np.arange(1, num_zones + 1),
+                  rng.integers(3, 9, num_zones)), axis=1),
+        fmt="%d",
+        header="TMfS,R"
+    )
+    # TELMoS and model zone numbers are the same, with the TMfS18 airports
+    with open(os.path.join(factors_dir, ZONE_DEF_FILE), "w") as f:
+        json.dump({"internal_zones": int_zones,
+                   "telmos_order": [[1, num_zones]],
+                   "airport_indices": TMFS18_DEFINITION["airport_indices"]},
+                  f, indent=1)
+
+    # Planning data - the home working split adds 4 population columns
+    tav = rng.random((int_zones, 8)) * 500
+    tmfs = rng.random((int_zones * HOUSEHOLD_TYPES,
+                       13 if home_working else 9)) * 50
+    _write_planning_data(os.path.join(delta_root, base_scenario),
+                         base_year, base_scenario, tav, tmfs)
+    _write_planning_data(os.path.join(delta_root, tel_scenario),
+                         tel_year, tel_scenario,
+                         tav * rng.uniform(0.9, 1.2, tav.shape),
+                         tmfs * rng.uniform(0.9, 1.2, tmfs.shape))
+
+    # Base year pivot and trip end files
+    base_dir = os.path.join(tmfs_root, "Runs", base_year, "Demand", base_id)
+    if not os.path.isdir(base_dir):
+        os.makedirs(base_dir)
+    write_fixed_format(
+        os.path.join(base_dir, "tmfs%s_%s.csv" % (base_year, base_id)),
+        rng.random((int_zones, PRODUCTION_PIVOT_COLUMNS)) * 100,
+        fmt="%.3f",
+        header=",".join("c%d" % i for i in range(PRODUCTION_PIVOT_COLUMNS))
+    )
+    write_fixed_format(
+        os.path.join(base_dir, "tav_%s_%s.csv" % (base_year, base_id)),
+        rng.random((int_zones, 4)) * 100,
+        fmt="%.3f",
+        header="HW,HE,HO,HS"
+    )
+    zones = np.arange(1, int_zones + 1)[:, None]
+    for trip_end_file in TRIP_END_FILES:
+        write_fixed_format(
+            os.path.join(base_dir, trip_end_file + ".TOD"),
+            np.concatenate((zones, rng.random((int_zones, 5)) * 100), axis=1),
+            fmt=["%d"] + ["%.3f"] * 5
+        )
+        write_fixed_format(
+            os.path.join(base_dir,
+                         trip_end_file.replace("A1", "D0") + ".CTE"),
+            np.concatenate((zones, rng.random((int_zones, 8)) * 100), axis=1),
+            fmt=["%d"] + ["%.5f"] * 8
+        )
+
+    if matrices:
+        for year, scenario in ((base_year, base_scenario),
+                               (tel_year, tel_scenario)):
+            _write_goods_data(
+                os.path.join(delta_root, scenario,
+                             "trfl%s%s.dat" % (year, scenario)),
+                num_zones,
+                rng
+            )
+        od = _od_columns(num_zones)
+        for matrix_file in GOODS_FILES + ADDIN_FILES:
+            num_columns = 3 if "PT" in matrix_file else 1
+            values = np.round(rng.random((od.shape[0], num_columns)) * 5, 4)
+            write_fixed_format(
+                os.path.join(base_dir, matrix_file),
+                np.concatenate((od, values), axis=1),
+                fmt=["%d", "%d"] + ["%.4f"] * num_columns
+            )
+
+    return {"delta_root": delta_root, "tmfs_root": tmfs_root}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create synthetic trip end model input data")
+    parser.add_argument("root", help="Directory to create the data in")
+    parser.add_argument("--zones", type=int, default=803,
+                        help="Total number of zones (default 803)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-matrices", action="store_true",
+                        help="Do not create the goods and add-in matrices")
+    parser.add_argument("--no-home-working", action="store_true",
+                        help="Do not split the population by WAH/WBC")
+    args = parser.parse_args()
+    paths = generate_synthetic_data(
+        args.root, args.zones, seed=args.seed,
+        matrices=not args.no_matrices,
+        home_working=not args.no_home_working
+    )
+    print("Created %s and %s" % (paths["delta_root"], paths["tmfs_root"]))
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed sparse row (CSR) matrix used for the goods and add-in matrices.
+
+Most external to external cells and many goods cells are empty, so storing
+only the non-empty cells means memory and run time grow with the number of
+trips rather than the square of the number of zones.
+
+SparseMatrix supports the operations used by the goods and add-in stages
+in the same way as a numpy array: sum (with axis), multiplication and
+division (by a scalar or another SparseMatrix) and [:rows, :columns]
+slicing. Cells that are not stored are equal to fill_value, which is
+normally 0. The goods growth calculation replaces empty cells with 1
+(see fill_zeros), which gives a matrix whose unstored cells are 1.
+"""
+
+from typing import Tuple, Union
+
+import numpy as np
+
+
+class SparseMatrix:
+    """Two dimensional matrix in compressed sparse row format.
+
+    The columns of row i are indices[indptr[i]:indptr[i + 1]], in
+    increasing order, with values data[indptr[i]:indptr[i + 1]].
+
+    Args:
+        data (np.array): Values of the stored cells.
+        indices (np.array): Column of each stored cell.
+        indptr (np.array): Start of each row in data, with a final entry of
+        len(data).
+        shape (Tuple[int, int]): Number of rows and columns.
+        fill_value (float, optional): Value of the cells that are not
+        stored. Defaults to 0.0.
+    """
+
+    ndim = 2
+
+    def __init__(self,
+                 data: np.array,
+                 indices: np.array,
+                 indptr: np.array,
+                 shape: Tuple[int, int],
+                 fill_value: float = 0.0
+                 ) -> None:
+        self.data = np.asarray(data, dtype="float64")
+        self.indices = np.asarray(indices, dtype="int64")
+        self.indptr = np.asarray(indptr, dtype="int64")
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.fill_value = float(fill_value)
+        if (len(self.indptr) != self.shape[0] + 1
+                or len(self.indices) != len(self.data)
+                or self.indptr[-1] != len(self.data)):
+            raise ValueError("SparseMatrix arrays do not match its shape")
+
+    @classmethod
+    def from_coo(cls,
+                 rows: np.array,
+                 cols: np.array,
+                 values: np.array,
+                 shape: Tuple[int, int],
+                 fill_value: float = 0.0
+                 ) -> "SparseMatrix":
+        """Creates a matrix from the (zero-based) row, column and value of
+        each cell. Cells equal to fill_value are not stored.
+
+        Raises:
+            ValueError: If a cell is outside the matrix or is repeated
+        """
+        rows = np.asarray(rows, dtype="int64")
+        cols = np.asarray(cols, dtype="int64")
+        if len(rows) and (rows.min() < 0 or rows.max() >= shape[0]
+                          or cols.min() < 0 or cols.max() >= shape[1]):
+            raise ValueError(f"Cells are outside a matrix of shape {shape}")
+        return cls._from_keys(rows * shape[1] + cols, values, shape,
+                              fill_value)
+
+    @classmethod
+    def from_dense(cls,
+                   array: np.array,
+                   fill_value: float = 0.0
+                   ) -> "SparseMatrix":
+        """Creates a matrix from a dense 2D array"""
+        array = np.asarray(array)
+        keys = np.flatnonzero(array != fill_value)
+        return cls._from_keys(keys, array.ravel()[keys], array.shape,
+                              fill_value, check=False)
+
+    @classmethod
+    def _from_keys(cls,
+                   keys: np.array,
+                   values: np.array,
+                   shape: Tuple[int, int],
+                   fill_value: float,
+                   check: bool = True
+                   ) -> "SparseMatrix":
+        # keys are the row-major position of each cell
+        values = np.asarray(values, dtype="float64")
+        stored = values != fill_value
+        keys, values = keys[stored], values[stored]
+        if check and np.any(keys[1:] <= keys[:-1]):
+            order = np.argsort(keys, kind="stable")
+            keys, values = keys[order], values[order]
+            if np.any(keys[1:] == keys[:-1]):
+                repeated = keys[1:][keys[1:] == keys[:-1]][0]
+                raise ValueError(
+                    f"Cell ({repeated // shape[1]}, {repeated % shape[1]}) "
+                    f"is repeated")
+        rows = keys // shape[1]
+        indptr = np.zeros(shape[0] + 1, dtype="int64")
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return cls(values, keys - rows * shape[1], indptr, shape, fill_value)
+
+    @property
+    def nnz(self) -> int:
+        """Number of stored cells"""
+        return len(self.data)
+
+    @property
+    def size(self) -> int:
+        """Number of cells, as for a dense array"""
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def itemsize(self) -> int:
+        return self.data.itemsize
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the stored cells"""
+        return self.data.nbytes + self.indices.nbytes + self.indptr.nbytes
+
+    def __repr__(self) -> str:
+        return (f"SparseMatrix(shape={self.shape}, nnz={self.nnz}, "
+                f"fill_value={self.fill_value})")
+
+    def _rows(self) -> np.array:
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def _keys(self) -> np.array:
+        return self._rows() * self.shape[1] + self.indices
+
+    def _values_at(self, keys: np.array) -> np.array:
+        # Values of the cells at the (sorted) row-major positions keys
+        own_keys = self._keys()
+        if len(own_keys) == 0:
+            return np.full(len(keys), self.fill_value)
+        pos = np.minimum(np.searchsorted(own_keys, keys), len(own_keys) - 1)
+        return np.where(own_keys[pos] == keys, self.data[pos],
+                        self.fill_value)
+
+    def copy(self) -> "SparseMatrix":
+        return SparseMatrix(self.data.copy(), self.indices.copy(),
+                            self.indptr.copy(), self.shape, self.fill_value)
+
+    def to_dense(self, order: str = "C") -> np.array:
+        """Returns the matrix as a dense numpy array"""
+        array = np.full(self.shape, self.fill_value, dtype="float64",
+                        order=order)
+        array[self._rows(), self.indices] = self.data
+        return array
+
+    def dense_rows(self, start: int, stop: int) -> np.array:
+        """Returns rows start to stop as a dense numpy array"""
+        stop = min(stop, self.shape[0])
+        block = np.full((stop - start, self.shape[1]), self.fill_value)
+        first, last = self.indptr[start], self.indptr[stop]
+        rows = np.repeat(np.arange(stop - start),
+                         np.diff(self.indptr[start:stop + 1]))
+        block[rows, self.indices[first:last]] = self.data[first:last]
+        return block
+
+    def sum(self, axis: int = None) -> Union[float, np.array]:
+        """Sum of all cells (axis=None), each column (axis=0) or each row
+        (axis=1), including the unstored cells"""
+        if axis is None:
+            return (self.data.sum()
+                    + self.fill_value * (self.size - self.nnz))
+        if axis in (1, -1):
+            totals = np.add.reduceat(
+                np.append(self.data, 0), self.indptr[:-1])
+            # reduceat gives the next value for empty rows
+            counts = np.diff(self.indptr)
+            totals[counts == 0] = 0
+            return totals + self.fill_value * (self.shape[1] - counts)
+        if axis in (0, -2):
+            totals = np.bincount(self.indices, weights=self.data,
+                                 minlength=self.shape[1])
+            counts = np.bincount(self.indices, minlength=self.shape[1])
+            return totals + self.fill_value * (self.shape[0] - counts)
+        raise ValueError(f"axis {axis} is out of bounds for a 2D matrix")
+
+    def in_block(self, num_rows: int, num_cols: int) -> np.array:
+        """Boolean mask of the stored cells in the first num_rows rows and
+        num_cols columns"""
+        return (self._rows() < num_rows) & (self.indices < num_cols)
+
+    def resize(self, shape: Tuple[int, int]) -> "SparseMatrix":
+        """Returns the matrix cropped or padded (with fill_value) to
+        shape"""
+        keep = self.in_block(*shape)
+        return SparseMatrix._from_keys(
+            self._rows()[keep] * shape[1] + self.indices[keep],
+            self.data[keep], shape, self.fill_value, check=False)
+
+    def __getitem__(self, key: Tuple[slice, slice]) -> "SparseMatrix":
+        # Only [:rows, :columns] is supported
+        if (not isinstance(key, tuple) or len(key) != 2
+                or any(not isinstance(k, slice) or k.start not in (None, 0)
+                       or k.step not in (None, 1) for k in key)):
+            raise TypeError("SparseMatrix only supports [:rows, :columns] "
+                            "indexing")
+        shape = tuple(
+            dim if k.stop is None else min(max(k.stop, 0), dim)
+            for k, dim in zip(key, self.shape))
+        return self.resize(shape)
+
+    def fill_zeros(self, value: float) -> "SparseMatrix":
+        """Returns the matrix with every zero cell (stored or not) set to
+        value"""
+        result = self.copy()
+        result.data[result.data == 0] = value
+        if result.fill_value == 0:
+            result.fill_value = float(value)
+        return result
+
+    def _elementwise(self, other, op) -> "SparseMatrix":
+        if not isinstance(other, SparseMatrix):
+            result = self.copy()
+            result.data = op(result.data, other)
+            result.fill_value = float(op(result.fill_value, other))
+            return result
+        if other.shape != self.shape:
+            raise ValueError(f"Matrices have different shapes {self.shape} "
+                             f"and {other.shape}")
+        fill_value = float(op(self.fill_value, other.fill_value))
+        # Only cells stored in either matrix can differ from fill_value
+        keys = np.union1d(self._keys(), other._keys())
+        values = op(self._values_at(keys), other._values_at(keys))
+        return SparseMatrix._from_keys(keys, values, self.shape, fill_value,
+                                       check=False)
+
+    def __mul__(self, other) -> "SparseMatrix":
+        return self._elementwise(other, np.multiply)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other) -> "SparseMatrix":
+        return self._elementwise(other, np.true_divide)
+
+
+def as_dense(array: Union[np.array, SparseMatrix]) -> np.array:
+    """Returns array as a dense numpy array"""
+    if isinstance(array, SparseMatrix):
+        return array.to_dense()
+    return np.asarray(array)
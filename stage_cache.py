@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Records the inputs and outputs of each stage of a model run so that stages
+whose inputs have not changed can be skipped when the run is repeated.
+
+Each stage is identified by a key: a hash of its parameters, the content of
+its input files and the keys of the stages it depends on. When a stage
+finishes, the key and the hashes of its output files are saved to
+"<stage_dir>/<stage>.json", along with any value it returns (as
+"<stage>.npz"). On the next run the stage is skipped if its key matches and
+its output files are unchanged, so only the stages downstream of a change are
+recalculated, and a run that stopped part way through resumes from the first
+unfinished stage.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import numpy as np
+
+from run_report import report_stage
+
+# Name of the folder, within the run folder, that holds the stage records
+STAGE_DIR = "stages"
+# Increase when the stage record format or model calculations change so
+# that previous records are no longer used
+STAGE_VERSION = 1
+
+
+def file_hash(path: str) -> str:
+    """Returns the SHA1 hash of the content of a file"""
+    content_hash = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
+def _file_stat(path: str) -> list:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _save_value(path: str, value: Any) -> None:
+    if isinstance(value, dict):
+        np.savez(path, **{"dict_" + k: v for k, v in value.items()})
+    else:
+        np.savez(path, array=value)
+
+
+def _load_value(path: str) -> Any:
+    with np.load(path) as data:
+        if "array" in data.files:
+            return data["array"]
+        return {k[len("dict_"):]: data[k] for k in data.files}
+
+
+class StageRunner:
+    """Runs the stages of a model run, skipping those that are up to date.
+
+    If stage_dir is None every stage is run and nothing is recorded.
+    """
+
+    def __init__(self,
+                 stage_dir: Optional[str],
+                 log_func: Callable = print
+                 ) -> None:
+        self.stage_dir = stage_dir
+        self.log_func = log_func
+        self.keys = {}
+        # Hashes of files already seen by this runner, by path and stat
+        self.hashes = {}
+        if stage_dir is not None and not os.path.isdir(stage_dir):
+            os.makedirs(stage_dir)
+
+    def _hash_files(self,
+                    paths: Iterable[str],
+                    known: Dict[str, list]
+                    ) -> Dict[str, list]:
+        # Reuse the hash of a file if its size and modification time are the
+        # same as when it was last hashed
+        hashes = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"File does not exist: {path}")
+            stat = _file_stat(path)
+            for previous in (self.hashes.get(path), known.get(path)):
+                if previous is not None and previous[:2] == stat:
+                    hashes[path] = previous
+                    break
+            else:
+                hashes[path] = stat + [file_hash(path)]
+            self.hashes[path] = hashes[path]
+        return hashes
+
+    def _read_record(self, name: str) -> dict:
+        record_file = os.path.join(self.stage_dir, name + ".json")
+        if not os.path.isfile(record_file):
+            return {}
+        try:
+            with open(record_file, "r") as f:
+                return json.load(f)
+        except ValueError:
+            # Treat a damaged record as missing so the stage is rerun
+            return {}
+
+    def _write_record(self, name: str, record: dict) -> None:
+        record_file = os.path.join(self.stage_dir, name + ".json")
+        # Write to a temporary file first so that a record is never left
+        # partially written
+        with open(record_file + ".tmp", "w") as f:
+            json.dump(record, f, indent=1)
+        os.replace(record_file + ".tmp", record_file)
+
+    def _outputs_unchanged(self, record: dict) -> bool:
+        for path, (size, mtime, content_hash) in record["outputs"].items():
+            if not os.path.isfile(path):
+                return False
+            if _file_stat(path) != [size, mtime]:
+                if file_hash(path) != content_hash:
+                    return False
+        return True
+
+    def run(self,
+            name: str,
+            func: Callable,
+            inputs: Iterable[str] = (),
+            outputs: Iterable[str] = (),
+            params: dict = None,
+            upstream: Iterable[str] = ()
+            ) -> Any:
+        """Runs a stage if its inputs have changed since it was last run.
+
+        Args:
+            name (str): Name of the stage, unique within the run.
+            func (Callable): Function that runs the stage, taking no
+            arguments. It can return None, an array or a dictionary of
+            arrays, which is saved and returned again when the stage is
+            skipped.
+            inputs (Iterable[str], optional): Paths of the files read by the
+            stage.
+            outputs (Iterable[str], optional): Paths of the files written by
+            the stage. The stage is rerun if any of these are missing or have
+            been changed.
+            params (dict, optional): Other settings that affect the result of
+            the stage. Must be JSON serialisable.
+            upstream (Iterable[str], optional): Names of the stages, run
+            earlier with this runner, whose results are used by the stage.
+
+        Returns:
+            Any: The value returned by func.
+        """
+        # The stage is timed in the active run report (if any)
+        with report_stage(name) as stage_report:
+            if self.stage_dir is None:
+                return func()
+
+            record = self._read_record(name)
+            input_hashes = self._hash_files(inputs, record.get("inputs", {}))
+            try:
+                upstream_keys = {x: self.keys[x] for x in upstream}
+            except KeyError as e:
+                raise ValueError(f"Stage {name} depends on {e.args[0]} which "
+                                 f"has not been run") from None
+            key_data = {
+                "version": STAGE_VERSION,
+                "name": name,
+                "params": params or {},
+                "inputs": {k: v[2] for k, v in input_hashes.items()},
+                "upstream": upstream_keys
+            }
+            key = hashlib.sha1(
+                json.dumps(key_data, sort_keys=True).encode("utf-8")
+            ).hexdigest()
+            self.keys[name] = key
+
+            value_file = os.path.join(self.stage_dir, name + ".npz")
+            if record.get("key") == key and self._outputs_unchanged(record):
+                if not record["has_value"]:
+                    self.log_func(f"Skipping {name} stage - inputs unchanged")
+                    stage_report["skipped"] = True
+                    return None
+                if os.path.isfile(value_file):
+                    self.log_func(f"Skipping {name} stage - inputs unchanged")
+                    stage_report["skipped"] = True
+                    return _load_value(value_file)
+
+            # Remove the previous record so that the stage is not treated as
+            # finished if it fails part way through
+            record_file = os.path.join(self.stage_dir, name + ".json")
+            if os.path.isfile(record_file):
+                os.remove(record_file)
+            value = func()
+            if value is not None:
+                _save_value(value_file, value)
+            output_hashes = self._hash_files(outputs, {})
+            self._write_record(name, {
+                "key": key,
+                "inputs": input_hashes,
+                "outputs": output_hashes,
+                "has_value": value is not None
+            })
+            return value
@@ -7,12 +7,98 @@ Conversion of TELMOS2_v2.2 vb scripts
 """
 
 import os
-from typing import Callable
+from typing import Callable, List, Tuple, Union
 
 import numpy as np
 import pandas as pd
 
-from data_functions import odfile_to_matrix, matrix_to_odfile
+from data_functions import (odfile_to_matrix, matrix_to_odfile,
+                            write_fixed_format)
+from furness import smooth_matrices
+from progress import progress_step, set_progress_total
+from run_report import record_read, report_stage
+from sparse_matrix import SparseMatrix, as_dense
+from zone_system import ZoneSystem, load_zone_system, zone_system_files
+
+
+ADDIN_PURPOSES = ["PT", "COM", "EMP", "OTH"]
+ADDIN_PERIODS = ["AM", "IP", "PM"]
+ADDIN_FILES = ["%s%s.DAT" % (period, purpose) for period in ADDIN_PERIODS
+               for purpose in ADDIN_PURPOSES]
+# Smoothed (Furness balanced) matrices are saved as e.g. AMCOMSM.DAT
+SMOOTH_SUFFIX = "SM.DAT"
+# Format of the values in the forecast add-in matrix files, the same
+# precision as the trip end files
+MATRIX_FMT = "%.9f"
+
+
+def _factor_file_paths(tmfs_root: str,
+                       rtf_file: str,
+                       ptf_file: str
+                       ) -> Tuple[str, str]:
+    if rtf_file == "":
+        rtf_file = os.path.join(tmfs_root, "Factors", "RTF.DAT")
+    if ptf_file == "":
+        ptf_file = os.path.join(tmfs_root, "Factors", "PTF.DAT")
+    return rtf_file, ptf_file
+
+
+def _keep_internal(base: Union[np.array, SparseMatrix],
+                   forecast: Union[np.array, SparseMatrix],
+                   low_zones: int
+                   ) -> Union[np.array, SparseMatrix]:
+    # Sets the internal to internal cells of forecast back to the base
+    # values. forecast is base multiplied by a factor, so a SparseMatrix
+    # forecast stores the same cells as base
+    if isinstance(forecast, SparseMatrix):
+        internal = base.in_block(low_zones, low_zones)
+        forecast.data[internal] = base.data[internal]
+    else:
+        forecast[:low_zones, :low_zones] = base[:low_zones, :low_zones]
+    return forecast
+
+
+def _stack_dense(matrices: Union[np.array, SparseMatrix, list]) -> np.array:
+    # The PT add-ins are a list of 3 matrices
+    if isinstance(matrices, list):
+        return np.stack([as_dense(m) for m in matrices])
+    return as_dense(matrices)
+
+
+def addins_stage_files(delta_root: str,
+                       tmfs_root: str,
+                       tel_year: str,
+                       tel_id: str,
+                       tel_scenario: str,
+                       base_year: str,
+                       base_id: str,
+                       base_scenario: str,
+                       rtf_file: str = "",
+                       ptf_file: str = "",
+                       smooth: bool = False
+                       ) -> Tuple[List[str], List[str]]:
+    """Lists the files read and written by telmos_addins with the same
+    arguments.
+
+    Returns:
+        Tuple[List[str], List[str]]: The input files and output files.
+    """
+    base_filebase = os.path.join(tmfs_root, "Runs", base_year, "Demand",
+                                 base_id)
+    tel_filebase = os.path.join(tmfs_root, "Runs", tel_year, "Demand",
+                                tel_id)
+    inputs = list(_factor_file_paths(tmfs_root, rtf_file, ptf_file)) + [
+        os.path.join(base_filebase, filename) for filename in ADDIN_FILES
+    ] + zone_system_files(tmfs_root)
+    outputs = [os.path.join(tel_filebase, filename)
+               for filename in ADDIN_FILES]
+    outputs += [os.path.join(tel_filebase, filename.replace(".DAT", "TE.DAT"))
+                for filename in ADDIN_FILES]
+    if smooth:
+        outputs += [os.path.join(tel_filebase,
+                                 filename.replace(".DAT", SMOOTH_SUFFIX))
+                    for filename in ADDIN_FILES]
+    return inputs, outputs
 
 
 def telmos_addins(delta_root: str,
@@ -25,24 +111,32 @@ def telmos_addins(delta_root: str,
                   base_scenario: str,
                   rtf_file: str = "",
                   ptf_file: str = "",
-                  log_func: Callable = print
+                  log_func: Callable = print,
+                  zone_system: ZoneSystem = None,
+                  smooth: bool = False,
+                  sparse: bool = False
                   ) -> None:
+    """Calculates the forecast add-in trip ends.
+
+    If sparse is True the add-in matrices are held as SparseMatrix, so
+    only the non-zero cells are stored and calculated.
+
+    If smooth is True, each base add-in matrix is also balanced to the
+    forecast trip ends (see furness.smooth_matrices) and saved with
+    SMOOTH_SUFFIX, in place of the Cube smoothing process.
+    """
     log_func("Processing Addins...")
+    set_progress_total(len(ADDIN_FILES) + (1 if smooth else 0))
 
-    # This is now increased to 787 to represent the internal
-    # Cannot be done without hardcoding low_zones number if separate
-    #   to the rest of the model
-    low_zones = 787
+    # Growth is only applied to trips to or from external zones, so the
+    # internal to internal trips (below 'low_zones') are kept as the base
+    if zone_system is None:
+        zone_system = load_zone_system(tmfs_root)
+    low_zones = zone_system.num_internal
 
-    purposes = ["PT", "COM", "EMP", "OTH"]
-    periods = ["AM", "IP", "PM"]
-    filenames = ["%s%s.DAT" % (period, purpose) for period in periods
-                 for purpose in purposes]
+    filenames = ADDIN_FILES
 
-    if rtf_file == "":
-        rtf_file = os.path.join(tmfs_root, "Factors", "RTF.DAT")
-    if ptf_file == "":
-        ptf_file = os.path.join(tmfs_root, "Factors", "PTF.DAT")
+    rtf_file, ptf_file = _factor_file_paths(tmfs_root, rtf_file, ptf_file)
     for factor_file in [rtf_file, ptf_file]:
         if not os.path.isfile(factor_file):
             raise FileNotFoundError(
@@ -50,6 +144,8 @@ def telmos_addins(delta_root: str,
     # Load NRTF Array
     rtf_array = pd.read_csv(rtf_file)
     ptf_array = pd.read_csv(ptf_file)
+    record_read(rtf_file, rows=len(rtf_array))
+    record_read(ptf_file, rows=len(ptf_array))
 
     addin_array = {}
     new_addin_array = {}
@@ -70,7 +166,9 @@ def telmos_addins(delta_root: str,
         )
         addin_array[f_key] = odfile_to_matrix(
             file_path,
-            num_columns=num_columns
+            num_columns=num_columns,
+            sparse=sparse,
+            num_zones=zone_system.num_zones
         )
 
         # Apply NRTF growth
@@ -91,8 +189,8 @@ def telmos_addins(delta_root: str,
                 * rtf_array.loc[rtf_tel_mask]["CARS"].values[0]
                 / rtf_array.loc[rtf_base_mask]["CARS"].values[0]
             )
-            new_addin_array[f_key][:low_zones, :low_zones] = (
-                addin_array[f_key][:low_zones, :low_zones])
+            new_addin_array[f_key] = _keep_internal(
+                addin_array[f_key], new_addin_array[f_key], low_zones)
 
             # Set the output options for non PT files - only one column is used
             output_array = new_addin_array[f_key]
@@ -119,8 +217,8 @@ def telmos_addins(delta_root: str,
                     * ptf_array.loc[ptf_tel_mask]["PT"].values[0]
                     / ptf_array.loc[ptf_base_mask]["PT"].values[0]
                 )
-                new_pt_arrays[i][:low_zones, :low_zones] = (
-                    addin_array[f_key][i][:low_zones, :low_zones])
+                new_pt_arrays[i] = _keep_internal(
+                    addin_array[f_key][i], new_pt_arrays[i], low_zones)
             new_addin_array[f_key] = new_pt_arrays
 
             # Set the output options for PT files - three columns are needed
@@ -144,18 +242,20 @@ def telmos_addins(delta_root: str,
             )
 
         # Save full array to .DAT file
-#        matrix_to_odfile(output_array, out_file, num_columns=num_columns)
+        matrix_to_odfile(output_array, out_file, num_columns=num_columns,
+                         fmt=MATRIX_FMT)
 
         log_func("Saved matrix as %s" % str(out_file))
 
         # Check File sizes
         try:
-            if new_addin_array[f_key].nbytes < 250000:
+            if (new_addin_array[f_key].size
+                    * new_addin_array[f_key].itemsize < 250000):
                 log_func("Addin array is incomplete: %s" % f_key)
 
         except AttributeError:
             for m in new_addin_array[f_key]:
-                if m.nbytes < 250000:
+                if m.size * m.itemsize < 250000:
                     log_func("Addin array is incomplete: %s" % f_key)
         if te_array.nbytes < 500:
             log_func("Addin TE array is incomplete: %s" % f_key)
@@ -163,5 +263,30 @@ def telmos_addins(delta_root: str,
         out_file = os.path.join(tmfs_root, "Runs", tel_year, "Demand",
                                 tel_id, filename.replace(".DAT", "TE.DAT"))
         format_string = ["%d"] + ["%.9f" for _ in range(te_array.shape[1]-1)]
-        np.savetxt(out_file, te_array, delimiter=",", fmt=format_string)
+        write_fixed_format(out_file, te_array, delimiter=",",
+                           fmt=format_string)
         log_func("Saved Trip Ends to %s" % str(out_file))
+        progress_step(f"Calculated {f_key} add-ins", files=3,
+                      rows=te_array.shape[0])
+
+    if smooth:
+        # The three PT matrices are balanced together
+        with report_stage("smooth"):
+            smoothed = smooth_matrices(
+                {k: _stack_dense(array) for k, array in addin_array.items()},
+                {k: _stack_dense(array)
+                 for k, array in new_addin_array.items()},
+                log_func=log_func
+            )
+        for filename in filenames:
+            f_key = filename.replace(".DAT", "")
+            out_file = os.path.join(tmfs_root, "Runs", tel_year, "Demand",
+                                    tel_id,
+                                    filename.replace(".DAT", SMOOTH_SUFFIX))
+            if smoothed[f_key].ndim == 3:
+                matrix_to_odfile(list(smoothed[f_key]), out_file,
+                                 num_columns=len(smoothed[f_key]))
+            else:
+                matrix_to_odfile(smoothed[f_key], out_file)
+            log_func("Saved smoothed matrix as %s" % str(out_file))
+        progress_step("Smoothed add-in matrices", files=len(filenames))
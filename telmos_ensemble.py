@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+Ensemble (Monte Carlo) runs of the main trip end calculations.
+
+The production trip rates, student factors and attraction factors are
+perturbed by random factors described by a perturbation specification, and
+the attraction and production pivots and the forecast TOD/CTE trip ends are
+calculated for every draw. Draws are evaluated in batches along a leading
+draw axis, and the per-zone mean and percentiles across all draws are
+returned instead of writing a set of output files for each draw.
+
+The perturbation specification is a dictionary with an entry for any of the
+parameters in ENSEMBLE_PARAMETERS. Each entry is either the relative
+standard deviation of the perturbation, or a dictionary with the keys:
+
+- sd - relative standard deviation of the perturbation factor;
+- distribution - "normal" (default), "lognormal" or "uniform". All have a
+  mean of 1; and
+- correlated - if True, one factor is drawn for all values of the parameter
+  in each draw, otherwise (default) each value is perturbed independently.
+
+For example {"trip_rates": 0.05, "student_factors": {"sd": 0.1,
+"correlated": True}}.
+
+Example:
+    python telmos_ensemble.py perturbations.json --draws 1000 ...
+"""
+
+import argparse
+import json
+import os
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+from data_functions import load_table
+from telmos_main import (TOD_FILES, CTE_FILES, MALE_STUDENT_FACTOR,
+                         FEMALE_STUDENT_FACTOR, load_production_trip_rates,
+                         load_attraction_factors, load_planning_data,
+                         load_cte_tod_files, load_airport_growth,
+                         student_factor_adjustment, create_attraction_pivot,
+                         create_work_type_production_pivot, calculate_growth,
+                         apply_pivot_files)
+from run_report import record_read, record_write
+from zone_system import ZoneSystem, load_zone_system
+
+# Parameters that can be perturbed
+ENSEMBLE_PARAMETERS = ["trip_rates", "student_factors", "attraction_factors"]
+# Outputs that are summarised across the draws
+ENSEMBLE_OUTPUTS = ["attraction", "production", "tod", "cte"]
+DISTRIBUTIONS = ["normal", "lognormal", "uniform"]
+# Name of the summary file saved to the forecast output folder
+ENSEMBLE_FILE = "ensemble_summary.npz"
+
+
+def _parse_perturbation(name: str, spec) -> dict:
+    if name not in ENSEMBLE_PARAMETERS:
+        raise ValueError(f"Unknown ensemble parameter '{name}', should be "
+                         f"one of {ENSEMBLE_PARAMETERS}")
+    if not isinstance(spec, dict):
+        spec = {"sd": spec}
+    spec = dict({"distribution": "normal", "correlated": False}, **spec)
+    if spec["distribution"] not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown distribution '{spec['distribution']}' "
+                         f"for {name}, should be one of {DISTRIBUTIONS}")
+    if float(spec["sd"]) < 0:
+        raise ValueError(f"Standard deviation for {name} cannot be negative")
+    return spec
+
+
+def perturbation_factors(rng: np.random.Generator,
+                         spec: dict,
+                         shape: tuple
+                         ) -> np.array:
+    """Draws the factors (with mean 1) to multiply a parameter of the given
+    shape by, as described by a parsed perturbation spec. Normal factors are
+    limited to be at least 0."""
+    sd = float(spec["sd"])
+    size = () if spec["correlated"] else shape
+    if spec["distribution"] == "lognormal":
+        factors = np.exp(sd * rng.standard_normal(size) - sd ** 2 / 2)
+    elif spec["distribution"] == "uniform":
+        factors = 1 + sd * np.sqrt(3) * rng.uniform(-1, 1, size)
+    else:
+        factors = np.maximum(1 + sd * rng.standard_normal(size), 0)
+    return np.broadcast_to(factors, shape)
+
+
+def draw_parameters(rng: np.random.Generator,
+                    perturbations: Dict[str, dict],
+                    trip_rates,
+                    attraction_factors: np.array
+                    ) -> dict:
+    """Draws one set of perturbed parameters. The parameters are always drawn
+    in the order of ENSEMBLE_PARAMETERS, so each draw only depends on its
+    random generator."""
+    params = {
+        "trip_rates": trip_rates,
+        "male_student_factor": MALE_STUDENT_FACTOR,
+        "female_student_factor": FEMALE_STUDENT_FACTOR,
+        "attraction_factors": attraction_factors
+    }
+    for name in ENSEMBLE_PARAMETERS:
+        if name not in perturbations:
+            continue
+        spec = perturbations[name]
+        if name == "trip_rates":
+            if isinstance(trip_rates, dict):
+                params[name] = {
+                    work_type: trip_rates[work_type] * perturbation_factors(
+                        rng, spec, trip_rates[work_type].shape)
+                    for work_type in sorted(trip_rates)
+                }
+            else:
+                params[name] = trip_rates * perturbation_factors(
+                    rng, spec, trip_rates.shape)
+        elif name == "student_factors":
+            male, female = perturbation_factors(rng, spec, (2,))
+            params["male_student_factor"] = min(
+                MALE_STUDENT_FACTOR * male, 1)
+            params["female_student_factor"] = min(
+                FEMALE_STUDENT_FACTOR * female, 1)
+        else:
+            params[name] = attraction_factors * perturbation_factors(
+                rng, spec, attraction_factors.shape)
+    return params
+
+
+def _stack_parameters(draws: List[dict]) -> dict:
+    trip_rates = [x["trip_rates"] for x in draws]
+    if isinstance(trip_rates[0], dict):
+        trip_rates = {work_type: np.stack([x[work_type] for x in trip_rates])
+                      for work_type in trip_rates[0]}
+    else:
+        trip_rates = np.stack(trip_rates)
+    return {
+        "trip_rates": trip_rates,
+        "male_student_factor": np.array(
+            [x["male_student_factor"] for x in draws])[:, None],
+        "female_student_factor": np.array(
+            [x["female_student_factor"] for x in draws])[:, None],
+        "attraction_factors": np.stack(
+            [x["attraction_factors"] for x in draws])
+    }
+
+
+def summarise_draws(draws: np.array,
+                    percentiles: Sequence[float]
+                    ) -> Dict[str, np.array]:
+    """Returns the mean and percentiles of draws over the first axis"""
+    return {
+        "mean": draws.mean(axis=0, dtype="float64"),
+        "percentiles": np.percentile(draws, percentiles, axis=0)
+    }
+
+
+def telmos_ensemble(delta_root: str,
+                    tmfs_root: str,
+                    tel_year: str,
+                    tel_id: str,
+                    tel_scenario: str,
+                    base_year: str,
+                    base_id: str,
+                    base_scenario: str,
+                    perturbations: dict,
+                    num_draws: int,
+                    seed: int = 0,
+                    percentiles: Sequence[float] = (5, 50, 95),
+                    batch_size: int = 16,
+                    is_rebasing_run: bool = True,
+                    log_func: Callable = print,
+                    trip_rate_file: str = "",
+                    airport_growth_file: str = "",
+                    integrate_home_working: bool = False,
+                    legacy_trip_rates: bool = False,
+                    zone_system: ZoneSystem = None,
+                    save: bool = True
+                    ) -> Dict[str, Dict[str, np.array]]:
+    """Runs an ensemble of the main trip end calculations with perturbed
+    trip rates, student factors and attraction factors.
+
+    Args:
+        perturbations (dict): Perturbation specification (see module
+        docstring).
+        num_draws (int): Number of draws in the ensemble.
+        seed (int, optional): Seed for the random draws. Each draw has its
+        own random generator spawned from the seed, so the results do not
+        depend on batch_size. Defaults to 0.
+        percentiles (Sequence[float], optional): Percentiles to calculate.
+        Defaults to (5, 50, 95).
+        batch_size (int, optional): Number of draws evaluated together.
+        Memory use grows with the batch size (roughly 40MB per draw for
+        TMfS18, twice that with the home working split). Defaults to 16.
+        save (bool, optional): Flag if the summary should be saved as
+        ENSEMBLE_FILE in the forecast output folder. Defaults to True.
+
+    Other arguments are as for telmos_main.
+
+    Returns:
+        Dict[str, Dict[str, np.array]]: For each of ENSEMBLE_OUTPUTS, the
+        "mean" and "percentiles" across the draws. The percentiles have a
+        leading axis with one entry per percentile. "attraction" and
+        "production" are the pivot arrays (zones, columns), and "tod" and
+        "cte" are the forecast trip ends (file, zones, columns) with the
+        files in the order of TOD_FILES and CTE_FILES. The trip ends do
+        not have the zone number column of the saved files, so the TOD
+        columns are [C11, C12, C2, C0, Attractions] and the CTE columns are
+        [Car_C11, Car_C12, Car_C2, PT_C11, PT_C12, PT_C2, PT_C0,
+        Attractions]. Row i is zone i + 1. The draws are kept as float32,
+        so with no perturbation the mean matches the telmos_main outputs
+        to float32 precision (about 7 significant figures).
+    """
+    perturbations = {name: _parse_perturbation(name, spec)
+                     for name, spec in perturbations.items()}
+    if num_draws < 1:
+        raise ValueError("The ensemble needs at least one draw")
+    if zone_system is None:
+        zone_system = load_zone_system(tmfs_root)
+
+    log_func(f"Running Ensemble of {num_draws} Draws")
+    p_trip_rate_array = load_production_trip_rates(
+        tmfs_root,
+        trip_rate_file=trip_rate_file,
+        integrate_home_working=integrate_home_working,
+        legacy_trip_rates=legacy_trip_rates,
+        just_pivots=False,
+        log_func=log_func
+    )
+    attraction_factors = load_attraction_factors(tmfs_root)
+    tav_array, tmfs_array = load_planning_data(
+        delta_root, tel_year, tel_scenario, integrate_home_working,
+        zone_system=zone_system)
+
+    base_dir = os.path.join(tmfs_root, "Runs", base_year, "Demand", base_id)
+    base_tmfs_file = os.path.join(base_dir,
+                                  "tmfs%s_%s.csv" % (base_year, base_id))
+    base_tav_file = os.path.join(base_dir,
+                                 "tav_%s_%s.csv" % (base_year, base_id))
+    tmfs_base_array = load_table(base_tmfs_file, skiprows=1, delimiter=",")
+    tav_base_array = load_table(base_tav_file, skiprows=1, delimiter=",")
+    record_read(base_tmfs_file, rows=len(tmfs_base_array))
+    record_read(base_tav_file, rows=len(tav_base_array))
+    tod_data, cte_data = load_cte_tod_files(TOD_FILES, CTE_FILES, base_dir)
+
+    airport_growth = np.ones(zone_system.num_internal, dtype="float")
+    if is_rebasing_run is False:
+        airport_growth = load_airport_growth(
+            tmfs_root, tel_year, base_year, zone_system.num_internal,
+            airport_growth_file=airport_growth_file, log_func=log_func,
+            zone_system=zone_system)
+    area_corres_array = np.repeat(zone_system.area_types, 8)
+
+    rngs = [np.random.default_rng(s)
+            for s in np.random.SeedSequence(seed).spawn(num_draws)]
+    # The outputs of every draw are kept (as float32) to find percentiles
+    results = {}
+    for start in range(0, num_draws, batch_size):
+        stop = min(start + batch_size, num_draws)
+        log_func(f"Evaluating Draws {start + 1} to {stop}")
+        params = _stack_parameters([
+            draw_parameters(rng, perturbations, p_trip_rate_array,
+                            attraction_factors)
+            for rng in rngs[start:stop]
+        ])
+        draw_shape = (stop - start,)
+
+        attr_factors_array = create_attraction_pivot(
+            np.broadcast_to(tav_array, draw_shape + tav_array.shape),
+            params["attraction_factors"])
+
+        if integrate_home_working:
+            tmfs_adj_array = {
+                work_type: student_factor_adjustment(
+                    np.broadcast_to(x, draw_shape + x.shape),
+                    params["male_student_factor"],
+                    params["female_student_factor"])
+                for work_type, x in tmfs_array.items()
+            }
+        else:
+            tmfs_adj_array = student_factor_adjustment(
+                np.broadcast_to(tmfs_array, draw_shape + tmfs_array.shape),
+                params["male_student_factor"],
+                params["female_student_factor"])
+        prod_factor_array = create_work_type_production_pivot(
+            planning_data=tmfs_adj_array,
+            production_trip_rates=params["trip_rates"],
+            area_correspondence=area_corres_array,
+            output_shape=tmfs_base_array.shape,
+            just_pivots=False,
+            int_zones=zone_system.num_internal
+        )
+
+        # Growth is calculated from the values as rounded in the pivot files
+        attr_growth_array = calculate_growth(
+            base=tav_base_array.round(3),
+            forecast=attr_factors_array.round(3))
+        prod_growth_array = calculate_growth(
+            base=tmfs_base_array.round(3),
+            forecast=prod_factor_array.round(3))
+        tod_f_array, cte_f_array = apply_pivot_files(
+            tod_data,
+            cte_data,
+            prod_growth_array.round(5),
+            attr_growth_array.round(5),
+            airport_growth
+        )
+
+        # The first column of the trip ends is only filled with the zone
+        # numbers when they are saved, so is left out
+        batch = {"attraction": attr_factors_array,
+                 "production": prod_factor_array,
+                 "tod": tod_f_array[..., 1:],
+                 "cte": cte_f_array[..., 1:]}
+        for name, values in batch.items():
+            if name not in results:
+                results[name] = np.empty((num_draws,) + values.shape[1:],
+                                         dtype="float32")
+            results[name][start:stop] = values
+
+    log_func("Summarising Ensemble")
+    summary = {name: summarise_draws(results.pop(name), percentiles)
+               for name in ENSEMBLE_OUTPUTS}
+
+    if save:
+        output_dir = os.path.join(tmfs_root, "Runs", tel_year, "Demand",
+                                  tel_id)
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        save_ensemble_summary(os.path.join(output_dir, ENSEMBLE_FILE),
+                              summary, percentiles, perturbations,
+                              num_draws, seed)
+    log_func("Finished Ensemble")
+    return summary
+
+
+def save_ensemble_summary(path: str,
+                          summary: Dict[str, Dict[str, np.array]],
+                          percentiles: Sequence[float],
+                          perturbations: dict,
+                          num_draws: int,
+                          seed: int
+                          ) -> None:
+    """Saves an ensemble summary as a compressed npz file with the arrays
+    "<output>_mean" and "<output>_percentiles" for each output, and the
+    details of the ensemble."""
+    arrays = {}
+    for name, stats in summary.items():
+        arrays[name + "_mean"] = stats["mean"]
+        arrays[name + "_percentiles"] = stats["percentiles"]
+    np.savez_compressed(
+        path,
+        percentiles=np.asarray(percentiles, dtype="float"),
+        details=np.array(json.dumps({"perturbations": perturbations,
+                                     "num_draws": num_draws,
+                                     "seed": seed})),
+        **arrays
+    )
+    record_write(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run an ensemble of the main trip end calculations")
+    parser.add_argument("perturbations",
+                        help="JSON file with the perturbation specification")
+    parser.add_argument("delta_root")
+    parser.add_argument("tmfs_root")
+    parser.add_argument("tel_year")
+    parser.add_argument("tel_id")
+    parser.add_argument("tel_scenario")
+    parser.add_argument("base_year")
+    parser.add_argument("base_id")
+    parser.add_argument("base_scenario")
+    parser.add_argument("--draws", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--percentiles", type=float, nargs="+",
+                        default=[5, 50, 95])
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--home-working", action="store_true",
+                        help="Use the population split by WAH/WBC")
+    parser.add_argument("--airport-growth", action="store_true",
+                        help="Apply airport growth (not a rebasing run)")
+    args = parser.parse_args()
+    with open(args.perturbations, "r") as f:
+        perturbation_spec = json.load(f)
+    telmos_ensemble(args.delta_root, args.tmfs_root, args.tel_year,
+                    args.tel_id, args.tel_scenario, args.base_year,
+                    args.base_id, args.base_scenario, perturbation_spec,
+                    args.draws, seed=args.seed,
+                    percentiles=args.percentiles,
+                    batch_size=args.batch_size,
+                    is_rebasing_run=not args.airport_growth,
+                    integrate_home_working=args.home_working)
@@ -7,69 +7,253 @@ Conversion of TELMOS2_v2.2 vb scripts
 """
 
 import os
-from typing import Callable, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Tuple, Union
 
 import numpy as np
-import pandas as pd
+
+from data_functions import (matrix_to_odfile, odfile_to_matrix,
+                            write_fixed_format)
+from furness import smooth_matrices
+from input_cache import get_input_cache
+from progress import progress_step, set_progress_total
+from run_report import record_read, report_stage
+from sparse_matrix import SparseMatrix, as_dense
+from zone_system import ZoneSystem, load_zone_system, zone_system_files
+
+
+GOODS_FILES = ["AMHGV.DAT", "AMLGV.DAT", "IPHGV.DAT", "IPLGV.DAT",
+               "PMHGV.DAT", "PMLGV.DAT"]
+# Goods vehicle type indicators in the first column of the TELMoS goods file
+HGV_INDICATOR = 1
+LGV_INDICATOR = 2
+# Smoothed (Furness balanced) matrices are saved as e.g. AMHGVSM.DAT
+SMOOTH_SUFFIX = "SM.DAT"
+# Characters that separate the values of the TELMoS goods file
+_SEPARATORS = np.frombuffer(b" \t\r\n\f\v", dtype=np.uint8)
+
+
+def read_goods_file(goods_file: str) -> np.array:
+    """Reads the lines of a TELMoS goods file that start with the HGV or
+    LGV indicator, which should each have 4 values (indicator, origin,
+    destination, value). Other lines (e.g. the header) are skipped.
+
+    The whole file is read at once and the lines are found with array
+    operations on its bytes, so the values can be parsed in a single call
+    to np.fromstring.
+
+    Raises:
+        ValueError: If an HGV or LGV line does not have 4 values
+
+    Returns:
+        np.array: Array of shape (lines, 4)
+    """
+    with open(goods_file, "rb") as f:
+        data = f.read()
+    if not data:
+        return np.zeros((0, 4))
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    buf = np.frombuffer(data, dtype=np.uint8)
+
+    # Positions of the first character of each value, and of each line end
+    is_sep = np.isin(buf, _SEPARATORS)
+    value_start = ~is_sep
+    value_start[1:] &= is_sep[:-1]
+    value_starts = np.flatnonzero(value_start)
+    del value_start
+    line_ends = np.flatnonzero(buf == ord("\n"))
+    values_before = np.searchsorted(value_starts, line_ends)
+    line_values = np.diff(values_before, prepend=0)
+
+    # Lines are kept if their first value is a single character indicator
+    has_values = line_values > 0
+    first = np.zeros(len(line_ends), dtype="int64")
+    first[has_values] = value_starts[(values_before - line_values)[
+        has_values]]
+    del value_starts
+    indicator = buf[first]
+    is_goods = (has_values
+                & ((indicator == ord(str(HGV_INDICATOR)))
+                   | (indicator == ord(str(LGV_INDICATOR))))
+                & is_sep[first + 1])
+    del is_sep
+    bad_lines = np.flatnonzero(is_goods & (line_values != 4))
+    if len(bad_lines) > 0:
+        raise ValueError(f"Line {bad_lines[0] + 1} of {goods_file} should "
+                         f"have 4 values but has {line_values[bad_lines[0]]}")
+
+    if not is_goods.all():
+        line_lengths = np.diff(line_ends, prepend=-1)
+        data = buf[np.repeat(is_goods, line_lengths)].tobytes()
+    del buf
+    values = np.fromstring(data, sep=" ")
+    if values.size != 4 * is_goods.sum():
+        raise ValueError(f"Could not read the values in {goods_file}")
+    return values.reshape(-1, 4)
+
+
+def read_goods_files(goods_files: List[str],
+                     parallel: bool = True
+                     ) -> List[np.array]:
+    """Reads several TELMoS goods files with read_goods_file, in separate
+    processes if parallel is True. Files in the active input cache (see
+    input_cache) are not read again."""
+    cache = get_input_cache()
+    goods_values = [None] * len(goods_files)
+    if cache is not None:
+        goods_values = [cache.get(x, "read_goods_file") for x in goods_files]
+    to_read = [x for x, values in zip(goods_files, goods_values)
+               if values is None]
+    if parallel and len(to_read) > 1:
+        with ProcessPoolExecutor(max_workers=len(to_read)) as executor:
+            read_values = list(executor.map(read_goods_file, to_read))
+    else:
+        read_values = [read_goods_file(x) for x in to_read]
+    for goods_file, values in zip(to_read, read_values):
+        record_read(goods_file, rows=len(values))
+        if cache is not None:
+            cache.put(goods_file, "read_goods_file", values)
+    read_values = iter(read_values)
+    return [next(read_values) if values is None else values
+            for values in goods_values]
+
+
+def _goods_matrix(od_values: np.array,
+                  zone_system: ZoneSystem,
+                  goods_file: str,
+                  vehicle: str,
+                  sparse: bool = False
+                  ) -> Union[np.array, SparseMatrix]:
+    """Creates the (zones, zones) matrix of one vehicle type from the
+    (origin, destination, value) rows of a TELMoS goods file, renumbering
+    the TELMoS zones to model zones. Each zone pair should appear once.
+    If sparse is True only the non-zero cells are kept, as a
+    SparseMatrix."""
+    num_zones = zone_system.num_zones
+    if not len(od_values) == num_zones * num_zones:
+        raise ValueError(f"{vehicle} file requires {num_zones} * "
+                         f"{num_zones} entries")
+
+    # TELMoS zones may be numbered differently to the model zones (for
+    #  TMfS18, TELMoS zones 800-803 are internal zones 784-787 and external
+    #  zones 784-799 are renumbered to 788-803)
+    zones = od_values[:, :2].astype(int)
+    if zones.min() < 1 or zones.max() > num_zones:
+        raise ValueError(f"Zones in {goods_file} should be between "
+                         f"1 and {num_zones}")
+    zones = zone_system.telmos_to_model[zones] - 1
+
+    # Scatter the values into the matrix. As there are num_zones^2 rows,
+    # every pair is present if none are repeated. The matrix is stored in
+    # column-major order (as created by pivot_table previously) so that the
+    # matrix totals are summed in the same order
+    cells = zones[:, 1] * num_zones + zones[:, 0]
+    found = np.zeros(num_zones * num_zones, dtype=bool)
+    found[cells] = True
+    if not found.all():
+        missing = np.flatnonzero(~found)[0]
+        raise ValueError(
+            f"{vehicle} data in {goods_file}: zone pair "
+            f"({missing % num_zones + 1}, {missing // num_zones + 1}) is "
+            f"missing (a pair is repeated or absent)")
+    del found
+    if sparse:
+        return SparseMatrix.from_coo(zones[:, 0], zones[:, 1],
+                                     od_values[:, 2], (num_zones, num_zones))
+    matrix = np.empty((num_zones, num_zones), dtype="float64", order="F")
+    matrix.T.ravel()[cells] = od_values[:, 2]
+    return matrix
 
 
 def load_goods_data(goods_file: str,
                     hgv_output: str,
-                    lgv_output: str
+                    lgv_output: str,
+                    zone_system: ZoneSystem,
+                    goods_values: np.array = None,
+                    sparse: bool = False
                     ) -> Tuple[np.array, np.array]:
     '''
     Loading function for TELMoS goods files
-    Splits the data into LGV and HGV parts
+    Splits the data into LGV and HGV parts, renumbering the TELMoS zones to
+    model zones with zone_system.telmos_to_model. goods_values are the
+    values of goods_file if they have already been read with
+    read_goods_file. If sparse is True the matrices are returned as
+    SparseMatrix.
     '''
-    hgv_lines = []
-    lgv_lines = []
-    # Inconsistent format of input data - iterate through
-    # lines, use indicator to check if HGV / LGV
-    with open(goods_file, "r") as f:
-        for line in f:
-            split_line = line.split()
-            indicator = split_line.pop(0)
-            if indicator == "1":
-                hgv_lines.append(split_line)
-            elif indicator == "2":
-                lgv_lines.append(split_line)
-            else:
-                continue
-
-    # Frame should have 3 columns and an entry for each zone pair 1-803
-    hgv_df = pd.DataFrame(hgv_lines, columns=["I", "J", "V"], dtype="float64")
-    lgv_df = pd.DataFrame(lgv_lines, columns=["I", "J", "V"], dtype="float64")
-
-    if not len(hgv_df) == 803*803:
-        raise ValueError("HGV file requires 803 * 803 entries")
-    if not len(lgv_df) == 803*803:
-        raise ValueError("LGV file requires 803 * 803 entries")
-
-    # TELMoS file zones are numbered with 1-783 as internal, 784-799 external
-    #  and 800-803 internal. These should be renumbered to be in line with
-    #  TMfS numbering, inserting 800-803 before external zones
-    # Internal zones 800-803 get renumbered to 784-787,
-    # and external zones 784-799 renumbered to 788-803
-    zone_map = {
-        z: z if z < 784 else z+4 if z < 800 else z-16 for z in range(1, 804)
-    }
-
-    # Rewrap zone numbers as integers and renumber zones
-    for df in (hgv_df, lgv_df):
-        for col in ("I", "J"):
-            df[col] = df[col].astype(int).map(zone_map)
-        # Sort the renumbered dataframe
-        df.sort_values(by=["I", "J"], inplace=True)
-        df.reset_index(drop=True, inplace=True)
-
-    hgv_df.to_csv(hgv_output, index=False, header=False)
-    lgv_df.to_csv(lgv_output, index=False, header=False)
-
-    hgv_array = hgv_df.pivot_table(index="I", columns="J").to_numpy()
-    lgv_array = lgv_df.pivot_table(index="I", columns="J").to_numpy()
+    # Inconsistent format of input data - use indicator to check if
+    # HGV / LGV
+    if goods_values is None:
+        goods_values = read_goods_file(goods_file)
+        record_read(goods_file, rows=len(goods_values))
+
+    # Should be an entry for each zone pair
+    indicator = goods_values[:, 0]
+    hgv_array = _goods_matrix(goods_values[indicator == HGV_INDICATOR, 1:],
+                              zone_system, goods_file, "HGV", sparse=sparse)
+    lgv_array = _goods_matrix(goods_values[indicator == LGV_INDICATOR, 1:],
+                              zone_system, goods_file, "LGV", sparse=sparse)
+    del goods_values, indicator
+
+    # The renumbered files are written in origin, destination order
+    matrix_to_odfile(hgv_array, hgv_output)
+    matrix_to_odfile(lgv_array, lgv_output)
+
     return (hgv_array, lgv_array)
 
 
+def _fill_zeros(array: Union[np.array, SparseMatrix]
+                ) -> Union[np.array, SparseMatrix]:
+    # Empty cells are counted as 1 when calculating the goods growth. Dense
+    # arrays are filled in place, while a SparseMatrix keeps the empty cells
+    # unstored, with a fill value of 1
+    if isinstance(array, SparseMatrix):
+        return array.fill_zeros(1)
+    array[array == 0] = 1
+    return array
+
+
+def goods_stage_files(delta_root: str,
+                      tmfs_root: str,
+                      tel_year: str,
+                      tel_id: str,
+                      tel_scenario: str,
+                      base_year: str,
+                      base_id: str,
+                      base_scenario: str,
+                      smooth: bool = False
+                      ) -> Tuple[List[str], List[str]]:
+    """Lists the files read and written by telmos_goods with the same
+    arguments.
+
+    Returns:
+        Tuple[List[str], List[str]]: The input files and output files.
+    """
+    base_filebase = os.path.join(tmfs_root, "Runs", base_year, "Demand",
+                                 base_id)
+    tel_filebase = os.path.join(tmfs_root, "Runs", tel_year, "Demand",
+                                tel_id)
+    inputs = [
+        os.path.join(delta_root, tel_scenario,
+                     "trfl%s%s.dat" % (tel_year, tel_scenario)),
+        os.path.join(delta_root, base_scenario,
+                     "trfl%s%s.dat" % (base_year, base_scenario))
+    ] + [os.path.join(base_filebase, filename) for filename in GOODS_FILES]
+    inputs += zone_system_files(tmfs_root)
+    outputs = [
+        os.path.join(tel_filebase, "hgv%s%s.dat" % (tel_year, tel_id)),
+        os.path.join(tel_filebase, "lgv%s%s.dat" % (tel_year, tel_id)),
+        os.path.join(base_filebase, "hgv%s%s.dat" % (base_year, base_id)),
+        os.path.join(base_filebase, "lgv%s%s.dat" % (base_year, base_id))
+    ] + [os.path.join(tel_filebase, filename.replace(".DAT", "TE.DAT"))
+         for filename in GOODS_FILES]
+    if smooth:
+        outputs += [os.path.join(tel_filebase,
+                                 filename.replace(".DAT", SMOOTH_SUFFIX))
+                    for filename in GOODS_FILES]
+    return inputs, outputs
+
+
 def telmos_goods(delta_root: str,
                  tmfs_root: str,
                  tel_year: str,
@@ -79,12 +263,28 @@ def telmos_goods(delta_root: str,
                  base_id: str,
                  base_scenario: str,
                  is_rebasing_run: bool = True,
-                 log_func: Callable = print
+                 log_func: Callable = print,
+                 zone_system: ZoneSystem = None,
+                 parallel_parse: bool = True,
+                 smooth: bool = False,
+                 sparse: bool = False
                  ) -> None:
+    """Calculates the forecast goods vehicle trip ends.
+
+    If sparse is True the goods matrices are held as SparseMatrix, so only
+    the non-zero cells are stored and calculated.
+
+    If smooth is True, each base goods matrix is also balanced to the
+    forecast trip ends (see furness.smooth_matrices) and saved with
+    SMOOTH_SUFFIX, in place of the Cube smoothing process.
+    """
     # Set this to true if run is rebasing from TMfS07 to TMfS12 or
     # TMfS12 to TMfs14 => it resets the GV growth to 1.00
 
     log_func("Processing Goods...")
+    set_progress_total(3 + len(GOODS_FILES) + (1 if smooth else 0))
+    if zone_system is None:
+        zone_system = load_zone_system(tmfs_root)
 
     # # # Inputs # # #
     # sr1
@@ -130,8 +330,7 @@ def telmos_goods(delta_root: str,
     )
     # # # # # # # # #
 
-    filenames = ["AMHGV.DAT", "AMLGV.DAT", "IPHGV.DAT", "IPLGV.DAT",
-                 "PMHGV.DAT", "PMLGV.DAT"]
+    filenames = GOODS_FILES
     # # # Inputs # # #
     base_filebase = os.path.join(tmfs_root, "Runs", base_year, "Demand",
                                  base_id)
@@ -140,44 +339,69 @@ def telmos_goods(delta_root: str,
     tel_filebase = os.path.join(tmfs_root, "Runs", tel_year, "Demand",
                                 tel_id)
 
+    # Base and forecast goods files are read at the same time
+    with report_stage("read_goods_files"):
+        base_goods_values, tel_goods_values = read_goods_files(
+            [base_goods_file, tel_goods_file], parallel=parallel_parse)
+    progress_step("Read goods files", files=2,
+                  rows=len(base_goods_values) + len(tel_goods_values))
+
     # # # Load base_goods data
-    hgv_base_array, lgv_base_array = load_goods_data(
-        base_goods_file,
-        base_hgv_file,
-        base_lgv_file
-    )
+    with report_stage("parse_base"):
+        hgv_base_array, lgv_base_array = load_goods_data(
+            base_goods_file,
+            base_hgv_file,
+            base_lgv_file,
+            zone_system,
+            goods_values=base_goods_values,
+            sparse=sparse
+        )
+    progress_step("Calculated base goods matrices", files=2)
+    del base_goods_values
 
     zone_count = hgv_base_array.shape[0]
 
     # Repeat for tel data
-    hgv_tel_array, lgv_tel_array = load_goods_data(
-        tel_goods_file,
-        tel_hgv_file,
-        tel_lgv_file
-    )
+    with report_stage("parse_forecast"):
+        hgv_tel_array, lgv_tel_array = load_goods_data(
+            tel_goods_file,
+            tel_hgv_file,
+            tel_lgv_file,
+            zone_system,
+            goods_values=tel_goods_values,
+            sparse=sparse
+        )
+    progress_step("Calculated forecast goods matrices", files=2)
+    del tel_goods_values
 
     log_func("HGV Count = %s" % str(zone_count))
 
     # # # # # # # # # # # # # # #
 
-    goods_totals = {"TEL_HGV": np.sum(hgv_tel_array),
-                    "TEL_LGV": np.sum(lgv_tel_array),
-                    "BASE_HGV": np.sum(hgv_base_array),
-                    "BASE_LGV": np.sum(lgv_base_array)}
+    goods_totals = {"TEL_HGV": hgv_tel_array.sum(),
+                    "TEL_LGV": lgv_tel_array.sum(),
+                    "BASE_HGV": hgv_base_array.sum(),
+                    "BASE_LGV": lgv_base_array.sum()}
 
     # pad tel arrays to match base shape
-    result = np.zeros_like(hgv_base_array)
-    result[:hgv_tel_array.shape[0], :hgv_tel_array.shape[1]] = hgv_tel_array
-    hgv_tel_array = result
-    result = np.zeros_like(lgv_base_array)
-    result[:lgv_tel_array.shape[0], :lgv_tel_array.shape[1]] = lgv_tel_array
-    lgv_tel_array = result
+    if sparse:
+        hgv_tel_array = hgv_tel_array.resize(hgv_base_array.shape)
+        lgv_tel_array = lgv_tel_array.resize(lgv_base_array.shape)
+    else:
+        result = np.zeros_like(hgv_base_array)
+        result[:hgv_tel_array.shape[0],
+               :hgv_tel_array.shape[1]] = hgv_tel_array
+        hgv_tel_array = result
+        result = np.zeros_like(lgv_base_array)
+        result[:lgv_tel_array.shape[0],
+               :lgv_tel_array.shape[1]] = lgv_tel_array
+        lgv_tel_array = result
 
     # Totals are calculated then zeros filled in.
-    hgv_base_array[hgv_base_array == 0] = 1
-    lgv_base_array[lgv_base_array == 0] = 1
-    hgv_tel_array[hgv_tel_array == 0] = 1
-    lgv_tel_array[lgv_tel_array == 0] = 1
+    hgv_base_array = _fill_zeros(hgv_base_array)
+    lgv_base_array = _fill_zeros(lgv_base_array)
+    hgv_tel_array = _fill_zeros(hgv_tel_array)
+    lgv_tel_array = _fill_zeros(lgv_tel_array)
 
     goods_growth_array = {"HGV": hgv_tel_array / hgv_base_array,
                           "LGV": lgv_tel_array / lgv_base_array}
@@ -194,9 +418,9 @@ def telmos_goods(delta_root: str,
         goods_type = f_key[-3:]  # HGV or LGV
 
         # Read base values from file
-        base_goods_array[f_key] = np.array(pd.read_csv(
-            os.path.join(base_filebase, filename), header=None,
-            index_col=[0, 1]).unstack(-1))
+        base_matrix_file = os.path.join(base_filebase, filename)
+        base_goods_array[f_key] = odfile_to_matrix(
+            base_matrix_file, sparse=sparse, num_zones=zone_system.num_zones)
 
         # Apply growth for forecast
         forecast_goods_array[f_key] = (
@@ -206,10 +430,10 @@ def telmos_goods(delta_root: str,
 
         # Sum of base and forecast matrices - Only up to 783
         # - changed to hgv_count to reflect number of zones
-        goods_total["%s_base" % f_key] = np.sum(
-            base_goods_array[f_key][:zone_count, :zone_count])
-        goods_total["%s_forecast" % f_key] = np.sum(
-            forecast_goods_array[f_key][:zone_count, :zone_count])
+        goods_total["%s_base" % f_key] = (
+            base_goods_array[f_key][:zone_count, :zone_count].sum())
+        goods_total["%s_forecast" % f_key] = (
+            forecast_goods_array[f_key][:zone_count, :zone_count].sum())
 
         # Adjust TMfS Forecast matrices
         if is_rebasing_run is True:
@@ -223,14 +447,6 @@ def telmos_goods(delta_root: str,
                   goods_totals["TEL_%s" % goods_type]) /
                  (goods_total["%s_forecast" % f_key] *
                   goods_totals["BASE_%s" % goods_type])))
-        # Print these files stacked
-        df = pd.DataFrame(new_forecast_array[f_key]).stack().reset_index()
-        df.columns = ['I', 'J', 'V']
-
-        # Change zone numbers from 0-based to 1-based
-        df['I'] += 1
-        df['J'] += 1
-
         # Create Trip End Files
         te_array = np.stack(
             (
@@ -246,15 +462,36 @@ def telmos_goods(delta_root: str,
             tel_filebase,
             filename.replace(".DAT", "TE.DAT")
         )
-        np.savetxt(
+        write_fixed_format(
             save_path,
             te_array,
             fmt=["%d", "%.9f", "%.9f"],
             delimiter=","
         )
         log_func("Goods TE saved to %s" % save_path)
+        progress_step(f"Calculated {f_key} trip ends", files=2,
+                      rows=te_array.shape[0])
 
     # Check array sizes are > 250KBytes
     for k, array in new_forecast_array.items():
-        if array.nbytes < 250000:
+        if array.size * array.itemsize < 250000:
             log_func("Array is incomplete %s" % k)
+
+    if smooth:
+        with report_stage("smooth"):
+            forecast = {k: as_dense(array)
+                        for k, array in new_forecast_array.items()}
+            smoothed = smooth_matrices(
+                {k: as_dense(base_goods_array[k][:array.shape[0],
+                                                 :array.shape[1]])
+                 for k, array in forecast.items()},
+                forecast,
+                log_func=log_func
+            )
+        for filename in filenames:
+            save_path = os.path.join(
+                tel_filebase, filename.replace(".DAT", SMOOTH_SUFFIX))
+            matrix_to_odfile(smoothed[filename.replace(".DAT", "")],
+                             save_path)
+            log_func("Smoothed goods matrix saved to %s" % save_path)
+        progress_step("Smoothed goods matrices", files=len(filenames))
@@ -7,14 +7,20 @@ Conversion of TELMOS2_v2.2 vb scripts
 """
 
 import os
+import struct
 from itertools import product
 from typing import Callable, Dict, List, Tuple, Union
-from collections import defaultdict
 import warnings
 
 import numpy as np
 import pandas as pd
 
+from data_functions import load_csv, load_table, write_fixed_format
+from input_cache import cached_load
+from progress import progress_step, set_progress_total
+from run_report import record_read, record_write
+from stage_cache import StageRunner, file_hash
+from zone_system import ZoneSystem, load_zone_system, zone_system_files
 from scripts.extract_trip_rates import convert_rates_format
 
 # Factors applied to non-working to produce student population segmentation
@@ -25,10 +31,13 @@ FEMALE_STUDENT_FACTOR = 0.2453
 TR_FILE = "TripRates.csv"
 # Default Trip rate file for home-working split
 SPLIT_TR_FILE = "TripRatesSplit.csv"
+# Suffix added to the trip rate file name to store the compiled trip rates
+TR_CACHE_SUFFIX = ".compiled.npz"
+TR_CACHE_VERSION = 1
 # Default Airport factor file
 AIRPORT_FAC_FILE = "airport_factors.csv"
-# Default Area correspondence file
-AREA_DEF_FILE = "AreaCorrespondence.csv"
+# Attraction factors by employment type
+ATTRACTION_FAC_FILE = "Attraction Factors.txt"
 
 # Define the values used when reading in trip rates
 TR_PURPOSES = ["HBW", "HBO", "HBE", "HBS"]
@@ -37,9 +46,29 @@ TR_PERIODS = ["AM", "IP", "PM"]
 TR_AREA_TYPES = list(range(3, 9))
 TR_WORK_TYPES = ["WAH", "WBC"]
 
-# Define the number of zones (used to check inputs only)
-INT_ZONES = 787
-ALL_ZONES = 803
+# Base year calibrated trip end files
+TOD_FILES = ["%s_%s.TOD" % (prefix, t)
+             for prefix in ["AM", "IP"]
+             for t in ["HWZ_A1", "HOZ_A1_ALL", "HEZ_A1_ALL", "HSZ_A1"]
+             ] + ["PM_HSZ_A1.TOD"]
+CTE_FILES = [x.replace("A1", "D0").replace(".TOD", ".CTE") for x in TOD_FILES]
+
+# Optional check file of the split productions, written as text (one value
+# per line) or as binary (CHECK_MAGIC, the number of dimensions and the
+# shape as little-endian int64, then the float64 values)
+CHECK_FILE = "check2.csv"
+CHECK_FILE_BINARY = "check2.bin"
+CHECK_MAGIC = b"TEMCHK01"
+# Number of values formatted at a time when writing the text check file
+CHECK_BLOCK_VALUES = 1 << 16
+
+# Offset of the production growth columns used by each TOD/CTE file - each
+# period/purpose has 8 columns (mode, household type). PM(Education) uses the
+# same columns as IP(Education)
+PIVOT_PROD_GROWTH_OFFSETS = np.array([0, 8, 16, 24, 32, 40, 48, 56, 56])
+# Attraction growth purpose column used by each TOD/CTE file
+PIVOT_ATTR_GROWTH_IDXS = np.array([0, 2, 1, 3, 0, 2, 1, 3, 3])
+
 # Define checks for number of rows/columns in each input file
 INPUT_CHECKS = {
     "TR": [len(list(product(TR_PURPOSES,
@@ -54,37 +83,54 @@ INPUT_CHECKS = {
                                   TR_AREA_TYPES,
                                   range(120)))),  # 88 + 32 from WAH/WBC split
                  7],  # Exludes traveller type desc
-    "POP": [INT_ZONES * 8, 11],
-    "POP_SPLIT": [INT_ZONES * 8, 15],
-    "EMP": [INT_ZONES, 9],
-    "ATT_FAC": [15, 10],
-    "AREA": [ALL_ZONES, 2]
+    "ATT_FAC": [15, 10]
+}
+# Checks for inputs with a row per zone, as [zones ("internal" or "all"),
+# rows per zone, number of columns]. The number of rows is taken from the
+# zone system
+ZONE_INPUT_CHECKS = {
+    "POP": ["internal", 8, 11],
+    "POP_SPLIT": ["internal", 8, 15],
+    "EMP": ["internal", 1, 9]
 }
 
 
 def check_input_dims(df: pd.DataFrame,
                      input_check_flag: str,
                      input_file_name: str = None,
-                     raise_err: bool = True
+                     raise_err: bool = True,
+                     zone_system: ZoneSystem = None
                      ) -> bool:
     """Checks the dimensions of an input dataframe against the expected values
 
     Args:
         df (pd.DataFrame): The input dataframe to check
         input_check_flag (str): Flag used to get the expected values from
-        INPUT_CHECKS
+        INPUT_CHECKS or ZONE_INPUT_CHECKS
         input_file_name (str, optional): Name to display in the error/warning.
         Defaults to None.
         raise_err (bool, optional): If an error should be raised - if False,
         will just raise a warning. Defaults to True.
+        zone_system (ZoneSystem, optional): Zone system used to get the
+        number of rows for ZONE_INPUT_CHECKS. Defaults to None, which only
+        checks the number of columns of these inputs.
 
     Raises:
         ValueError: If the dimensions are not as expected
     """
     messages = []
     file_name = input_file_name or input_check_flag
-    target_dims = INPUT_CHECKS[input_check_flag]
-    if df.shape[0] != target_dims[0]:
+    if input_check_flag in ZONE_INPUT_CHECKS:
+        zones, rows_per_zone, columns = ZONE_INPUT_CHECKS[input_check_flag]
+        if zone_system is None:
+            target_dims = [None, columns]
+        elif zones == "internal":
+            target_dims = [zone_system.num_internal * rows_per_zone, columns]
+        else:
+            target_dims = [zone_system.num_zones * rows_per_zone, columns]
+    else:
+        target_dims = INPUT_CHECKS[input_check_flag]
+    if target_dims[0] is not None and df.shape[0] != target_dims[0]:
         messages.append(f"Incorrect number of rows in {file_name}: Should be "
                         f"{target_dims[0]} but found {df.shape[0]}")
     if df.shape[1] != target_dims[1]:
@@ -104,10 +150,8 @@ def read_trip_rates(factors_dir, just_pivots):
     Loads the production trip rate files into a numpy array
     '''
 
-    periods = TR_PERIODS
-
-    if just_pivots is True:
-        periods.append("OP")
+    # A new list, as TR_PERIODS is shared by the later runs in a process
+    periods = TR_PERIODS + (["OP"] if just_pivots is True else [])
 
     sr_array = []
     for area_type in TR_AREA_TYPES:
@@ -117,6 +161,7 @@ def read_trip_rates(factors_dir, just_pivots):
             file_name = "%s_%s_%s_%s.txt" % (purpose, mode, period, area_type)
             factor_file = os.path.join(factors_dir, file_name)
             data.append(np.loadtxt(factor_file))
+            record_read(factor_file, rows=len(data[-1]))
         sr_array.append(data)
     return np.asarray(sr_array)
 
@@ -127,9 +172,7 @@ def read_trip_rates_home_working(factors_dir: str,
                                  ) -> np.array:
 
     # Add off-peak to the period list if required
-    periods = TR_PERIODS
-    if just_pivots is True:
-        periods.append("OP")
+    periods = TR_PERIODS + (["OP"] if just_pivots is True else [])
 
     file_base = "{purp}_{mode}_{period}_{area}_{wah_tag}.txt"
 
@@ -154,97 +197,189 @@ def read_trip_rates_home_working(factors_dir: str,
             file_path = os.path.join(factors_dir, file_name)
 
             data.append(np.loadtxt(file_path))
+            record_read(file_path, rows=len(data[-1]))
 
         trip_rates.append(data)
 
     return np.asarray(trip_rates)
 
 
+def compile_trip_rates(tr_df: pd.DataFrame,
+                       work_type_split: bool = False
+                       ) -> Dict[str, np.array]:
+    """Compiles the long format trip rates into the (area, segment, household,
+    person) arrays used by create_production_pivot in one pass over the
+    dataframe. Segments are ordered by period, purpose, then mode and include
+    all periods found in the file (AM, IP, PM and optionally OP).
+
+    Args:
+        tr_df (pd.DataFrame): Trip rates as read from the combined file.
+        work_type_split (bool, optional): Flag if rates are split between
+        Working at Home and Working by Commute. Defaults to False.
+
+    Raises:
+        ValueError: If a trip rate is defined more than once, or if any of
+        the AM, IP or PM segments are missing a trip rate
+
+    Returns:
+        Dict[str, np.array]: Trip rates with the key "ALL", or the keys
+        ["WAH", "WBC"] if work_type_split is True.
+    """
+    periods = TR_PERIODS + ["OP"]
+    num_traveller_types = 88
+
+    # Convert each segmentation to its position in the output array, rows
+    # that do not match a known segmentation are ignored
+    codes = [
+        pd.Categorical(tr_df[col], categories=categories).codes
+        for col, categories in [("area", TR_AREA_TYPES),
+                                ("period", periods),
+                                ("purpose", TR_PURPOSES),
+                                ("mode", TR_MODES),
+                                ("traveller_type",
+                                 range(1, num_traveller_types + 1))]
+    ]
+    area, period, purpose, mode, traveller_type = codes
+    segment = (period * len(TR_PURPOSES) + purpose) * len(TR_MODES) + mode
+    valid = np.all(np.stack(codes) >= 0, axis=0)
+    trip_rate = tr_df["trip_rate"].to_numpy(dtype="float")
+
+    # Position of each traveller type in the wide (household, person) format
+    wide_positions = convert_rates_format(
+        np.arange(num_traveller_types),
+        direction="to_wide"
+    )
+
+    if work_type_split:
+        work_types = {work_type: ["ALL", work_type]
+                      for work_type in TR_WORK_TYPES}
+    else:
+        work_types = {"ALL": None}
+
+    trip_rates = {}
+    for work_type, use_work_types in work_types.items():
+        mask = valid
+        if use_work_types is not None:
+            mask = mask & tr_df["work_type"].isin(use_work_types).to_numpy()
+        flat_idx = np.ravel_multi_index(
+            (area[mask], segment[mask], traveller_type[mask]),
+            (len(TR_AREA_TYPES), len(periods) * 8, num_traveller_types)
+        )
+        counts = np.bincount(
+            flat_idx,
+            minlength=len(TR_AREA_TYPES) * len(periods) * 8
+            * num_traveller_types
+        )
+        if np.any(counts > 1):
+            raise ValueError(f"{np.sum(counts > 1)} trip rates are defined "
+                             f"more than once for work type {work_type}")
+
+        flat_rates = np.full(counts.shape, np.nan)
+        flat_rates[flat_idx] = trip_rate[mask]
+        flat_rates = flat_rates.reshape(
+            (len(TR_AREA_TYPES), len(periods) * 8, num_traveller_types))
+
+        # Off-peak rates are optional, all other periods are required
+        missing = np.isnan(flat_rates[:, :len(TR_PERIODS) * 8])
+        if np.any(missing):
+            raise ValueError(f"{missing.sum()} trip rates are missing for "
+                             f"work type {work_type}")
+
+        trip_rates[work_type] = flat_rates[:, :, wide_positions]
+
+    return trip_rates
+
+
 def read_long_trip_rates(trip_rate_path: str,
                          work_type_split: bool = False,
-                         just_pivots: bool = False
+                         just_pivots: bool = False,
+                         use_cache: bool = True
                          ) -> Union[np.array, Dict[str, np.array]]:
     """Alternative function to the original read_trip_rates and
     read_trip_rates_home_working functions. Reads in a single combined as
     generated by extract_trip_rates.py for easier input file management.
 
+    The compiled trip rates are saved alongside the trip rate file (with
+    TR_CACHE_SUFFIX appended to the name) and reused while the content of the
+    trip rate file is unchanged.
+
     Args:
         trip_rate_path (str): Path to the trip rate combined file.
         work_type_split (bool, optional): Flag if rates are split between
         Working at Home and Working by Commute. Defaults to False.
         just_pivots (bool, optional): Flag if only pivots are being created
         and all periods shoule be used. Defaults to False.
+        use_cache (bool, optional): Flag if the compiled trip rates should be
+        read from / saved to the cache file. Defaults to True.
 
     Returns:
         Union[np.array, Dict[str, np.array]]: Either a np.array object if
         work_type_split is False, or a dictionary with keys ["WAH", "WBC"]
         if True.
     """
-
-    # Define the segmentation required from the trip rate file - could move
-    # this to common constants
-    trip_rate_seg = ["purpose", "mode", "period", "area", "traveller_type"]
-    if work_type_split:
-        trip_rate_seg.append("work_type")
-    trip_rate_val = ["trip_rate"]
-
-    # Read in all trip rates as a dataframe
-    try:
-        tr_df = pd.read_csv(trip_rate_path)[trip_rate_seg + trip_rate_val]
-    except KeyError as e:
-        raise ValueError(f"Could not find {e} in trip rate file"
-                         f": {trip_rate_path}")
-
-    # Check input dimensions are correct
-    input_ok = check_input_dims(tr_df,
-                                "TR_SPLIT" if work_type_split else "TR",
-                                input_file_name="Trip Rate File",
-                                raise_err=False)
-
-    # Add off-peak to the period list if required
-    periods = TR_PERIODS
-    if just_pivots is True:
-        periods.append("OP")
-
-    # Setup an empty dictionary to store the rates [work_type]
-    trip_rates = defaultdict(lambda: defaultdict(list))
-
-    # Loop through all available segmentation for the trip rates
-    segmentations = product(TR_AREA_TYPES, periods, TR_PURPOSES, TR_MODES)
-    for area_type, period, purpose, mode in segmentations:
-        # Extract the segmentation from the dataframe
-        df = tr_df.loc[
-            (tr_df["period"] == period)
-            & (tr_df["mode"] == mode)
-            & (tr_df["purpose"] == purpose)
-            & (tr_df["area"] == area_type)
-        ]
-        # Extract just the traveller type, work type (if available) and
-        # trip rate
-        df = df[trip_rate_seg[4:] + trip_rate_val]
-
+    cache_path = trip_rate_path + TR_CACHE_SUFFIX
+    cache_key = None
+    if use_cache:
+        # Only hashed when the cache is used, as hashing reads the file
+        cache_key = "{}:{}:{}".format(TR_CACHE_VERSION,
+                                      file_hash(trip_rate_path),
+                                      work_type_split)
+
+    trip_rates = None
+    if use_cache and os.path.isfile(cache_path):
+        try:
+            with np.load(cache_path) as cache:
+                if str(cache["key"]) == cache_key:
+                    trip_rates = {k: cache[k] for k in cache.files
+                                  if k != "key"}
+                    record_read(cache_path)
+        except (OSError, ValueError, KeyError):
+            # Unreadable cache files are replaced below
+            trip_rates = None
+
+    if trip_rates is None:
+        # Define the segmentation required from the trip rate file - could
+        # move this to common constants
+        trip_rate_seg = ["purpose", "mode", "period", "area",
+                         "traveller_type"]
         if work_type_split:
-            for work_type in TR_WORK_TYPES:
-                use_work_types = ["ALL", work_type]
-                filtered_df = df.loc[df["work_type"].isin(use_work_types)]
-                arr = filtered_df.sort_values("traveller_type")[trip_rate_val]
-                arr = convert_rates_format(
-                    arr.values,
-                    direction="to_wide"
-                )
-                trip_rates[work_type][area_type].append(arr)
-        else:
-            arr = df.sort_values("traveller_type")[trip_rate_val]
-            arr = convert_rates_format(
-                arr.values,
-                direction="to_wide"
-            )
-            trip_rates["ALL"][area_type].append(arr)
-
-    # Combine into a single numpy array
-    for work_type in trip_rates:
-        tr_array = list(trip_rates[work_type].values())
-        trip_rates[work_type] = np.asarray(tr_array)
+            trip_rate_seg.append("work_type")
+        trip_rate_val = ["trip_rate"]
+
+        # Read in all trip rates as a dataframe
+        try:
+            tr_df = pd.read_csv(trip_rate_path)[trip_rate_seg + trip_rate_val]
+        except KeyError as e:
+            raise ValueError(f"Could not find {e} in trip rate file"
+                             f": {trip_rate_path}")
+        record_read(trip_rate_path, rows=len(tr_df))
+
+        # Check input dimensions are correct
+        check_input_dims(tr_df,
+                         "TR_SPLIT" if work_type_split else "TR",
+                         input_file_name="Trip Rate File",
+                         raise_err=False)
+
+        trip_rates = compile_trip_rates(tr_df, work_type_split)
+
+        if use_cache:
+            # Saved to a temporary file first, as runs in other processes
+            # may be reading the cache at the same time
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.savez(f, key=np.array(cache_key), **trip_rates)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                warnings.warn(f"Could not save compiled trip rates: {e}")
+
+    # Select the periods required
+    num_segments = 8 * (len(TR_PERIODS) + (1 if just_pivots is True else 0))
+    for work_type, rates in trip_rates.items():
+        if np.isnan(rates[:, :num_segments]).any():
+            raise ValueError(f"Off-peak trip rates are missing in "
+                             f"{trip_rate_path}")
+        trip_rates[work_type] = rates[:, :num_segments]
 
     if work_type_split:
         return trip_rates
@@ -252,46 +387,61 @@ def read_long_trip_rates(trip_rate_path: str,
         return trip_rates["ALL"]
 
 
+def trip_end_file_path(file_base: str, t_file: str) -> str:
+    """Returns the path of a base year CTE/TOD file in file_base"""
+    # TMfS14 had a long-distance module that required some CTE/TOD files
+    # to have _All appended to the end. This can now be removed if needed.
+    t_file_name = (
+        t_file if os.path.isfile(os.path.join(file_base, t_file))
+        else t_file.upper().replace("_ALL", "")
+    )
+    return os.path.join(file_base, t_file_name)
+
+
 def load_cte_tod_files(tod_files, cte_files, file_base):
     tod_data = []
     cte_data = []
     for t_file, c_file in zip(tod_files, cte_files):
-        # TMfS14 had a long-distance module that required some CTE/TOD files
-        # to have _All appended to the end. This can now be removed if needed.
-        t_file_name = (
-            t_file if os.path.isfile(os.path.join(file_base, t_file))
-            else t_file.upper().replace("_ALL", "")
-        )
-        c_file_name = (
-            c_file if os.path.isfile(os.path.join(file_base, c_file))
-            else c_file.upper().replace("_ALL", "")
-        )
-        tod_data.append(np.loadtxt(os.path.join(file_base, t_file_name),
-                                   delimiter=","))
-        cte_data.append(np.loadtxt(os.path.join(file_base, c_file_name),
-                                   delimiter=","))
+        t_file_path = trip_end_file_path(file_base, t_file)
+        c_file_path = trip_end_file_path(file_base, c_file)
+        tod_data.append(load_table(t_file_path, delimiter=","))
+        cte_data.append(load_table(c_file_path, delimiter=","))
+        record_read(t_file_path, rows=len(tod_data[-1]))
+        record_read(c_file_path, rows=len(cte_data[-1]))
     return (np.asarray(tod_data), np.asarray(cte_data))
 
 
-def student_factor_adjustment(population_data: np.array) -> np.array:
+def student_factor_adjustment(population_data: np.array,
+                              male_factor: Union[float, np.array] = None,
+                              female_factor: Union[float, np.array] = None
+                              ) -> np.array:
     """Split columns in the tmfs population data using student factors.
     Also removes unnecessary columns.
 
     Args:
         population_data (np.array): Numpy array of population data, extracted
-        from the DELTA directory.
+        from the DELTA directory. May have leading (e.g. scenario) axes.
+        male_factor (Union[float, np.array], optional): Male student factor,
+        or an array of factors that broadcasts against the leading axes and
+        rows of population_data. Defaults to MALE_STUDENT_FACTOR.
+        female_factor (Union[float, np.array], optional): As male_factor, for
+        females. Defaults to FEMALE_STUDENT_FACTOR.
 
     Returns:
         np.array: The adjusted array containing non-working split by student/
         non-students
     """
+    if male_factor is None:
+        male_factor = MALE_STUDENT_FACTOR
+    if female_factor is None:
+        female_factor = FEMALE_STUDENT_FACTOR
     adjusted_arr = np.copy(population_data)
 
-    adjusted_arr[:, :3] = adjusted_arr[:, 2:5]
-    adjusted_arr[:, 3] = adjusted_arr[:, 7] * MALE_STUDENT_FACTOR
-    adjusted_arr[:, 4] = adjusted_arr[:, 8] * FEMALE_STUDENT_FACTOR
-    adjusted_arr[:, 7] = adjusted_arr[:, 7] * (1 - MALE_STUDENT_FACTOR)
-    adjusted_arr[:, 8] = adjusted_arr[:, 8] * (1 - FEMALE_STUDENT_FACTOR)
+    adjusted_arr[..., :3] = adjusted_arr[..., 2:5]
+    adjusted_arr[..., 3] = adjusted_arr[..., 7] * male_factor
+    adjusted_arr[..., 4] = adjusted_arr[..., 8] * female_factor
+    adjusted_arr[..., 7] = adjusted_arr[..., 7] * (1 - male_factor)
+    adjusted_arr[..., 8] = adjusted_arr[..., 8] * (1 - female_factor)
 
     return adjusted_arr
 
@@ -304,93 +454,72 @@ def create_attraction_pivot(planning_data: np.array,
 
     Args:
         planning_data (np.array): Planning data from land use model, shape is
-        (num of zones, 8 columns)
+        (num of zones, 8 columns). May have leading (e.g. scenario) axes.
         attraction_trip_rates (np.array): Attraction trip rates, containing
-        15 attraction sites and 9 purposes
+        15 attraction sites and 9 purposes. May have the same leading axes
+        as planning_data.
 
     Returns:
         np.array: Attractions pivoting file, containing 4 purpose columns
     """
     # Purpose Columns are: Work, Employment, Other, Education - All HB
-    attr_factors_array = np.ones((planning_data.shape[0], 4), dtype="float32")
+    attr_factors_array = np.ones(planning_data.shape[:-1] + (4,),
+                                 dtype="float32")
 
     # Create Work column
     # planning columns - employment
-    work = planning_data[:, 2]
+    work = planning_data[..., 2]
     # Extract the single attraction factor (HB Work, All Jobs)
-    work_factor = attraction_trip_rates[0, 0]
-    attr_factors_array[:, 0] = work * work_factor
+    work_factor = attraction_trip_rates[..., 0, 0, None]
+    attr_factors_array[..., 0] = work * work_factor
 
     # Create Business/ In Employment column
     # planning columns - households, agricul and fishing, retail,
     # hospitality, local financial, education, health & sociol serv
-    employment = planning_data[:, [1, 3, 4, 5, 6, 7, 8]].sum(axis=1)
+    employment = planning_data[..., [1, 3, 4, 5, 6, 7, 8]].sum(axis=-1)
     # Extract the single attraction factor (HB Emp Business, All)
     # Note that this expects the same factor for e.g. schools, Hotels,
     # Retail, etc. - TODO: could use a combination instead
-    employment_factor = attraction_trip_rates[2, 1]
-    attr_factors_array[:, 1] = employment * employment_factor
+    employment_factor = attraction_trip_rates[..., 2, 1, None]
+    attr_factors_array[..., 1] = employment * employment_factor
 
     # Create Other column
     # planning columns - retail, health & socio serv, households,
     # agricul and fishing
-    other = planning_data[:, [4, 8, 1, 3]]
+    other = planning_data[..., [4, 8, 1, 3]]
     # Extract attraction factors -
     # [(HB Shopping, Retail),
     # (HB Personal Business, Health/Medical),
     # (HB Visiting, Households),
     # (HB Holiday, Agriculture/Fishing)]
-    other_factor = attraction_trip_rates[[6, 7, 1, 12], [3, 4, 8, 9]]
-    attr_factors_array[:, 2] = (other * other_factor).sum(axis=1)
+    other_factor = attraction_trip_rates[
+        ..., None, [6, 7, 1, 12], [3, 4, 8, 9]]
+    attr_factors_array[..., 2] = (other * other_factor).sum(axis=-1)
 
     # Create Education column
     # planning columns - education
-    education = planning_data[:, 7]
+    education = planning_data[..., 7]
     # Extract attraction factor - (HB Education, Schools).
     # Note that this expects the same factor for e.g. schools,
     # higher education, and adult education
-    education_factor = attraction_trip_rates[2, 2]
-    attr_factors_array[:, 3] = education * education_factor
+    education_factor = attraction_trip_rates[..., 2, 2, None]
+    attr_factors_array[..., 3] = education * education_factor
 
     return attr_factors_array
 
 
-def create_production_pivot(planning_data: np.array,
+def _split_productions_loop(planning_data: np.array,
                             production_trip_rates: np.array,
                             area_correspondence: np.array,
-                            output_shape: Tuple[int, int],
-                            just_pivots: bool,
-                            check_file: str = None,
-                            int_zones: int = None
+                            split_prod_array: np.array
                             ) -> np.array:
-    """Created the synthetic productions pivot file. Multiplies planning data
-    by relevant trip rates, based on : area type, period/purpose/mode,
-    household/person type.
-    Aggregates the household/person types to the 4 household types required
-
-    Args:
-        planning_data (np.array): Population split by employment type,
-        male/female, and age
-        production_trip_rates (np.array): Trip rates read from read_trip_rates
-        functions
-        area_correspondence (np.array): Area definition for each model zone
-        output_shape (Tuple[int, int]): Shape required by the output array
-        just_pivots (bool): If all time periods should be used
-        check_file (str, optional): Output path of optional check file.
-        Defaults to None.
-        int_zones (int, optional): Number of internal zones. Defaults to None.
+    """Original cell-by-cell calculation of the split productions, kept to
+    check the vectorised version against. Fills split_prod_array in place.
 
     Returns:
-        np.array: Synthetic productions used in pivoting. Saved as tmfsXXXX.csv
+        np.array: The split productions ordered (segment, person type, row),
+        matching the order of the check2 file
     """
-
-    split_prod_array = np.zeros((24, planning_data.shape[0], 11))
-    if just_pivots is True:
-        split_prod_array = np.zeros((32, planning_data.shape[0], 11))
-
-    # Store contents of check2 file to output later if required
-    check_file_data = []
-
     # Define the iterators
     segment_combinations = range(split_prod_array.shape[0])
     person_types = range(split_prod_array.shape[2])
@@ -398,8 +527,6 @@ def create_production_pivot(planning_data: np.array,
     #  VB version
     planning_data_rows = range(split_prod_array.shape[1] - 1)
 
-    int_zones = int_zones or (len(planning_data_rows) // 8)
-
     # Variable to track the current household type (8 types)
     household_num = 0
     household_types = 8
@@ -431,17 +558,172 @@ def create_production_pivot(planning_data: np.array,
                 household_num += 1
                 if household_num == household_types:
                     household_num = 0
-                check_file_data.append(
-                    str(split_prod_array[seg_num, row, person_num])
-                )
 
-    if check_file is not None:
+    return np.swapaxes(split_prod_array[:, :-1, :], -1, -2)
+
+
+def _split_productions(planning_data: np.array,
+                       production_trip_rates: np.array,
+                       area_correspondence: np.array,
+                       split_prod_array: np.array
+                       ) -> np.array:
+    """Vectorised version of _split_productions_loop. Gathers the trip rate
+    for every (segment, row, person type) with a single take from the
+    flattened trip rates and multiplies the planning data into
+    split_prod_array in place. planning_data and split_prod_array may have
+    matching leading (e.g. scenario) axes, and production_trip_rates may
+    have leading axes that broadcast against them (e.g. one set of trip
+    rates per draw of an ensemble, or per work type).
+
+    Returns:
+        np.array: View of the split productions ordered (segment, person
+        type, row), matching the order of the check2 file
+    """
+    num_segments, num_rows, num_persons = split_prod_array.shape[-3:]
+    # As in the loop version, the final planning data row is not used
+    num_rows -= 1
+    household_types = 8
+
+    segments = np.arange(num_segments)[:, None, None]
+    rows = np.arange(num_rows)[None, :, None]
+    persons = np.arange(num_persons)[None, None, :]
+
+    # The loop version keeps a running household counter that is never
+    # reset between person types or segments, so the household type used
+    # for a row depends on how many rows have been visited before it
+    loop_num = segments * num_persons + persons
+    household_num = (loop_num * num_rows + rows) % household_types
+
+    # Flat index of (area type, segment, household type, person type) in
+    # the trip rates
+    _, rate_segments, rate_households, rate_persons = \
+        production_trip_rates.shape[-4:]
+    area_idx = (area_correspondence[:num_rows] - 3)[:, None]
+    flat_idx = (((area_idx * rate_segments + segments) * rate_households
+                 + household_num) * rate_persons + persons)
+    trip_rates = np.take(
+        production_trip_rates.reshape(
+            production_trip_rates.shape[:-4] + (-1,)),
+        flat_idx,
+        axis=-1
+    )
+    np.multiply(planning_data[..., None, :num_rows, :num_persons],
+                trip_rates,
+                out=split_prod_array[..., :num_rows, :])
+
+    return np.swapaxes(split_prod_array[..., :num_rows, :], -1, -2)
+
+
+def write_check_file(check_file: str,
+                     products: np.array,
+                     binary: bool = False
+                     ) -> None:
+    """Writes the split productions to the check file, either as text with
+    one value per line in the order of products, or as binary (see
+    CHECK_MAGIC). The text is written in blocks of CHECK_BLOCK_VALUES so
+    only one block is formatted at a time.
+    """
+    if binary:
+        with open(check_file, "wb") as f:
+            f.write(CHECK_MAGIC)
+            f.write(struct.pack("<q", products.ndim))
+            f.write(struct.pack("<%dq" % products.ndim, *products.shape))
+            np.ascontiguousarray(products, dtype="<f8").tofile(f)
+    else:
+        values = products.reshape(-1)
         with open(check_file, "w", newline="") as f:
-            for line in check_file_data:
-                f.write(line)
+            if values.size == 0:
+                f.write("\n")
+            for start in range(0, values.size, CHECK_BLOCK_VALUES):
+                block = values[start:start + CHECK_BLOCK_VALUES].tolist()
+                f.write("\n".join(map(str, block)))
                 f.write("\n")
+    record_write(check_file, rows=products.size)
+
+
+def read_check_file(check_file: str) -> np.array:
+    """Reads a check file written by write_check_file. Binary files are
+    returned with their original (segment, person type, row) shape, text
+    files as a 1D array."""
+    with open(check_file, "rb") as f:
+        if f.read(len(CHECK_MAGIC)) == CHECK_MAGIC:
+            ndim = struct.unpack("<q", f.read(8))[0]
+            shape = struct.unpack("<%dq" % ndim, f.read(8 * ndim))
+            return np.fromfile(f, dtype="<f8").reshape(shape)
+    return np.loadtxt(check_file, dtype="float64", ndmin=1)
+
+
+def create_production_pivot(planning_data: np.array,
+                            production_trip_rates: np.array,
+                            area_correspondence: np.array,
+                            output_shape: Tuple[int, int],
+                            just_pivots: bool,
+                            check_file: Union[str, List[str]] = None,
+                            int_zones: int = None,
+                            use_loop: bool = False,
+                            binary_check_file: bool = False
+                            ) -> np.array:
+    """Created the synthetic productions pivot file. Multiplies planning data
+    by relevant trip rates, based on : area type, period/purpose/mode,
+    household/person type.
+    Aggregates the household/person types to the 4 household types required
+
+    Args:
+        planning_data (np.array): Population split by employment type,
+        male/female, and age. May be stacked along a leading scenario axis,
+        in which case the output has the same leading axis.
+        production_trip_rates (np.array): Trip rates read from read_trip_rates
+        functions. May have the same leading axes as planning_data.
+        area_correspondence (np.array): Area definition for each model zone
+        output_shape (Tuple[int, int]): Shape required by the output array
+        just_pivots (bool): If all time periods should be used
+        check_file (Union[str, List[str]], optional): Output path of optional
+        check file, or one path per scenario for stacked planning data.
+        Defaults to None.
+        int_zones (int, optional): Number of internal zones. Defaults to None.
+        use_loop (bool, optional): Use the original (slow) cell-by-cell loop
+        instead of the vectorised calculation. Both give identical results.
+        Defaults to False.
+        binary_check_file (bool, optional): Write the check file in the
+        binary format instead of text (see write_check_file). Defaults to
+        False.
+
+    Returns:
+        np.array: Synthetic productions used in pivoting. Saved as tmfsXXXX.csv
+    """
+    num_segments = 32 if just_pivots is True else 24
+    scenario_shape = planning_data.shape[:-2]
+    split_prod_array = np.zeros(
+        scenario_shape + (num_segments, planning_data.shape[-2], 11))
 
-    prod_factor_array = np.ones(output_shape)
+    segment_combinations = range(num_segments)
+    household_types = 8
+    int_zones = int_zones or ((split_prod_array.shape[-2] - 1) // 8)
+
+    if isinstance(check_file, str):
+        check_file = [check_file]
+
+    if use_loop:
+        products = np.zeros(
+            scenario_shape + (num_segments, 11, planning_data.shape[-2] - 1))
+        for idx in np.ndindex(scenario_shape):
+            products[idx] = _split_productions_loop(
+                planning_data[idx],
+                production_trip_rates,
+                area_correspondence,
+                split_prod_array[idx]
+            )
+    else:
+        products = _split_productions(
+            planning_data,
+            production_trip_rates,
+            area_correspondence,
+            split_prod_array
+        )
+    if check_file is not None:
+        for i, idx in enumerate(np.ndindex(scenario_shape)):
+            write_check_file(check_file[i], products[idx],
+                             binary=binary_check_file)
 
     # Just Pivots is a debug option to output an extended version of
     #  the pivoting files
@@ -453,9 +735,6 @@ def create_production_pivot(planning_data: np.array,
         #  the possible time periods
         # - 4 Periods * 4 Purposes * 2 Modes * 4 Aggregated Household types
         column_width = 4 * 4 * 2 * 4
-        prod_factor_array = np.zeros(
-            (output_shape[0], output_shape[1] +
-             int(column_width / 2)))
 
     # Aggregate the household types into C0, C11, C12, C2
     # - No cars available
@@ -472,30 +751,106 @@ def create_production_pivot(planning_data: np.array,
     agg_household_idxs = [c_0_idxs, c_11_idxs, c_12_idxs, c_2_idxs]
 
     prod_factor_array = np.zeros(
-        (len(segment_combinations), len(agg_household_idxs), int_zones)
+        scenario_shape
+        + (len(segment_combinations), len(agg_household_idxs), int_zones)
     )
 
     # Sum over all person types
-    split_prod_array = split_prod_array.sum(axis=2)
-    # Reshape to unstack household types
-    split_prod_array = split_prod_array.reshape(
-        (len(segment_combinations), household_types, int_zones),
-        order="F"
+    split_prod_array = split_prod_array.sum(axis=-1)
+    # Reshape to unstack household types - rows are ordered by zone then
+    # household type
+    split_prod_array = np.swapaxes(
+        split_prod_array.reshape(
+            scenario_shape
+            + (len(segment_combinations), int_zones, household_types)
+        ),
+        -1, -2
     )
 
     # Aggregate household types
     for i, idxs in enumerate(agg_household_idxs):
         # Slice to the aggregate household type indices and sum them
-        prod_factor_array[:, i, :] = split_prod_array[:, idxs, :].sum(axis=1)
+        prod_factor_array[..., i, :] = (
+            split_prod_array[..., idxs, :].sum(axis=-2))
 
     # Reshape to 2D array with the correct column order (transposed)
     required_segment_size = int(column_width / len(agg_household_idxs))
-    prod_factor_array = prod_factor_array[:required_segment_size, :, :]
-    prod_factor_array = prod_factor_array.reshape(column_width, int_zones).T
+    prod_factor_array = prod_factor_array[..., :required_segment_size, :, :]
+    prod_factor_array = np.swapaxes(
+        prod_factor_array.reshape(
+            scenario_shape + (column_width, int_zones)),
+        -1, -2
+    )
 
     return prod_factor_array
 
 
+def create_work_type_production_pivot(
+        planning_data: Union[np.array, Dict[str, np.array]],
+        production_trip_rates: Union[np.array, Dict[str, np.array]],
+        area_correspondence: np.array,
+        output_shape: Tuple[int, int],
+        just_pivots: bool,
+        int_zones: int,
+        check_file: Union[str, List[str]] = None,
+        binary_check_file: bool = False
+        ) -> np.array:
+    """Creates the synthetic productions pivot with create_production_pivot,
+    for population data that may be split by work type.
+
+    If planning_data is a dictionary of population data by work type (WAH,
+    WBC), the work types are stacked along a leading axis with their trip
+    rates and evaluated in a single pass, then added together. The check
+    file is only written for population data that is not split.
+
+    Returns:
+        np.array: Synthetic productions used in pivoting.
+    """
+    if not isinstance(planning_data, dict):
+        return create_production_pivot(
+            planning_data=planning_data,
+            production_trip_rates=production_trip_rates,
+            area_correspondence=area_correspondence,
+            output_shape=output_shape,
+            just_pivots=just_pivots,
+            check_file=check_file,
+            int_zones=int_zones,
+            binary_check_file=binary_check_file
+        )
+
+    # Check that the work types are valid (Should be WAH or WBC)
+    work_types = list(planning_data)
+    if any(work_type not in production_trip_rates
+           for work_type in work_types):
+        raise ValueError(
+            "Error: Could not find split in Trip Rates")
+
+    # The population in the columns that have not been split (1, 2, 5, 6)
+    # is in the data of both work types, so all other columns are halved to
+    # prevent double counts. This is done by halving the trip rates of
+    # those person types (the last trip rate axis) rather than the data
+    person_weights = np.full(planning_data[work_types[0]].shape[-1], 0.5)
+    person_weights[[1, 2, 5, 6]] = 1
+
+    # Work type axis is the last leading axis - (..., work type, rows,
+    # persons) for the data and (..., work type, area type, segment,
+    # household, person) for the trip rates
+    stacked_data = np.stack([planning_data[x] for x in work_types], axis=-3)
+    stacked_rates = np.stack(
+        [production_trip_rates[x] for x in work_types], axis=-5
+    ) * person_weights
+
+    prod_factor_array = create_production_pivot(
+        planning_data=stacked_data,
+        production_trip_rates=stacked_rates,
+        area_correspondence=area_correspondence,
+        output_shape=output_shape,
+        just_pivots=just_pivots,
+        int_zones=int_zones
+    )
+    return prod_factor_array.sum(axis=-3)
+
+
 def calculate_growth(base, forecast):
     growth = forecast / base
     growth = np.select(
@@ -509,23 +864,35 @@ def apply_attraction_matching(arr: np.array,
                               attraction_index: int
                               ) -> np.array:
     # Apply attraction matching to Work and Education matrices
-    prod_totals = {}
-    attr_totals = {}
-
-    attr_match_cols = {0: "AM_Work",
-                       4: "IP_Work",
-                       3: "AM_Edu",
-                       7: "IP_Edu",
-                       8: "PM_Edu"}
+    # [AM_Work, IP_Work, AM_Edu, IP_Edu, PM_Edu]
+    # arr may have leading (e.g. scenario) axes, totals are taken separately
+    # for each of them
+    attr_match_idxs = [0, 4, 3, 7, 8]
 
-    for idx, purp in attr_match_cols.items():
-        prod_totals[purp] = arr[idx, :, 1:attraction_index].sum()
-        attr_totals[purp] = arr[idx, :, attraction_index].sum()
-        arr[idx, :, attraction_index] *= prod_totals[purp] / attr_totals[purp]
+    matched = arr[..., attr_match_idxs, :, :]
+    prod_totals = matched[..., 1:attraction_index].sum(axis=(-2, -1))
+    attr_totals = matched[..., attraction_index].sum(axis=-1)
+    matched[..., attraction_index] *= (prod_totals / attr_totals)[..., None]
+    arr[..., attr_match_idxs, :, :] = matched
 
     return arr
 
 
+def _pivot_growth_index(num_prod_cols: int) -> np.array:
+    """Builds the columns of [production_growth, attraction_growth] to apply
+    to each TOD/CTE column, for every period/purpose.
+
+    Returns:
+        np.array: Index array with shape (period/purpose, columns). The
+        columns are [Car_C11, Car_C12, Car_C2, PT_C11, PT_C12, PT_C2, C0,
+        Attr] - the order of columns 1-8 of the CTE files.
+    """
+    offsets = PIVOT_PROD_GROWTH_OFFSETS[:, None]
+    attr_idxs = num_prod_cols + PIVOT_ATTR_GROWTH_IDXS[:, None]
+    return np.concatenate(
+        (offsets + [1, 2, 3, 5, 6, 7, 4], attr_idxs), axis=1)
+
+
 def apply_pivot_files(tod_data: np.array,
                       cte_data: np.array,
                       production_growth: np.array,
@@ -535,11 +902,10 @@ def apply_pivot_files(tod_data: np.array,
     '''
     Applies growth to the base cte and tod files
 
+    The growth arrays may have a leading scenario axis, in which case the
+    forecast arrays are returned with the same leading axis.
     '''
-    # Initialise forecast array for TOD data
-    tod_f_array = np.zeros_like(tod_data, dtype="float")
-
-    # Apply growth to generate forecast .TOD arrays
+    scenario_shape = production_growth.shape[:-2]
 
     # TOD/CTE array dimensions are:
     #  Period/Purpose = [AM(Work),AM(Other),AM(Business),AM(Education),
@@ -548,76 +914,34 @@ def apply_pivot_files(tod_data: np.array,
     #  Household Types / ATtractions = [TOD([C11, C12, C2, C0, Attractions]),
     #      CTE([Car_C11, Car_C12, Car_C2, PT_C11, PT_C12, PT_C2, PT_C0, Attr])]
 
-    # Reorder attraction growth purpose columns to match TOD/CTE order
-    tod_attr_growth_idxs = [0, 2, 1, 3, 0, 2, 1, 3, 3]
-    # Loop through AM and IP arrays
-    for j in range(tod_f_array.shape[0] - 1):
-        # Apply growth to C11, C12, and C2 columns by grouping Car / PT from
-        # the CTE array (as CTE is more precise)
-        # - extracting the relevant growth columns from the synthetic
-        #   future / base in 'production_growth'
-        tod_f_array[j, :, 1:4] = (
-            (cte_data[j, :, 1:4] * production_growth[:, (1+8*j):(4+8*j)])
-            + (cte_data[j, :, 4:7] * production_growth[:, (5+8*j):(8+8*j)])
-            ) * airport_growth[:, None]
-        # Apply the same process to C0 households (PT only)
-        tod_f_array[j, :, 4] = (
-            tod_data[j, :, 4]
-            * production_growth[:, (4+8*j)]
-            * airport_growth
-        )
-        # Finally apply attraction growth to the total attractions
-        #  (using tod_attr_growth_idxs to get the correct column in attraction
-        #   growth)
-        tod_f_array[j, :, 5] = (
-            tod_data[j, :, 5]
-            * attraction_growth[:, tod_attr_growth_idxs[j]]
-            * airport_growth
-        )
+    # Gather the growth for every period/purpose and CTE column at once,
+    # giving an array of shape (scenarios, period/purpose, zones, columns)
+    growth_idxs = _pivot_growth_index(production_growth.shape[-1])
+    growth = np.concatenate((production_growth, attraction_growth), axis=-1)
+    growth = np.ascontiguousarray(
+        np.moveaxis(growth[..., growth_idxs], -3, -2))
+    airport_growth = airport_growth[..., None, :, None]
 
-    # Handle PM(Education) separately to fetch correct column in growth arrays
-    tod_f_array[8, :, 1:4] = (
-        (cte_data[8, :, 1:4] * production_growth[:, (1+8*7):(4+8*7)])
-        + (cte_data[8, :, 4:7] * production_growth[:, (5+8*7):(8+8*7)])
-        ) * airport_growth[:, None]
-    tod_f_array[8, :, 4] = (
-        tod_data[8, :, 4]
-        * production_growth[:, (4+8*7)]
-        * airport_growth
-    )
-    tod_f_array[8, :, 5] = (
-        tod_data[8, :, 5]
-        * attraction_growth[:, tod_attr_growth_idxs[7]]
-        * airport_growth
-    )
+    # Apply growth to generate forecast .TOD arrays
+    # Growth is applied to C11, C12, and C2 columns by grouping Car / PT from
+    # the CTE array (as CTE is more precise). C0 households (PT only) and
+    # attractions use the values in the TOD array
+    tod_base = np.concatenate((cte_data[..., 1:7], tod_data[..., 4:6]),
+                              axis=-1)
+    tod_growth = np.multiply(tod_base, growth)
+    tod_f_array = np.zeros(scenario_shape + tod_data.shape, dtype="float")
+    np.add(tod_growth[..., 0:3], tod_growth[..., 3:6],
+           out=tod_f_array[..., 1:4])
+    tod_f_array[..., 4:6] = tod_growth[..., 6:8]
+    tod_f_array[..., 1:6] *= airport_growth
 
     # Apply attraction matching
     tod_f_array = apply_attraction_matching(tod_f_array, attraction_index=5)
 
-    cte_f_array = np.zeros_like(cte_data, dtype="float")
-    # Set the production growth indexes to use
-    prod_col_idxs = np.array([1, 2, 3, 5, 6, 7, 4])
-    for j in range(cte_f_array.shape[0]):
-        # Handle AM and IP using the standard growth columns
-        if j < 8:
-            cte_f_array[j, :, 1:8] = (
-                cte_data[j, :, 1:8]
-                * production_growth[:, prod_col_idxs+(j*8)]
-                * airport_growth[:, None]
-            )
-        # PM Requires a different index to access the growth
-        else:
-            cte_f_array[j, :, 1:8] = (
-                cte_data[j, :, 1:8]
-                * production_growth[:, prod_col_idxs+((j-1)*8)]
-                * airport_growth[:, None]
-            )
-        # Apply attraction growth
-        cte_f_array[j, :, 8] = (
-            cte_data[j, :, 8]
-            * attraction_growth[:, tod_attr_growth_idxs[j]]
-            * airport_growth
-        )
+    # Apply growth to generate forecast .CTE arrays
+    cte_f_array = np.zeros(scenario_shape + cte_data.shape, dtype="float")
+    np.multiply(cte_data[..., 1:9], growth, out=cte_f_array[..., 1:9])
+    cte_f_array[..., 1:9] *= airport_growth
 
     # Apply attraction matching
     cte_f_array = apply_attraction_matching(cte_f_array, attraction_index=8)
@@ -646,7 +970,7 @@ def save_trip_end_files(file_names: List[str],
             ),
             axis=1
         )
-        np.savetxt(
+        write_fixed_format(
             path,
             out_arr,
             delimiter=", ",
@@ -654,35 +978,62 @@ def save_trip_end_files(file_names: List[str],
         )
 
 
-def telmos_main(delta_root: str,
-                tmfs_root: str,
-                tel_year: str,
-                tel_id: str,
-                tel_scenario: str,
-                base_year: str,
-                base_id: str,
-                base_scenario: str,
-                is_rebasing_run: bool = True,
-                log_func: Callable = print,
-                just_pivots: bool = False,
-                trip_rate_file: str = "",
-                airport_growth_file: str = "",
-                integrate_home_working: bool = False,
-                legacy_trip_rates: bool = False
-                ) -> None:
-    '''
-    Applies growth to base year trip end files for input into the second stage
-    of the TMfS18 trip end model
-    '''
-
+def _trip_rate_path(tmfs_root: str,
+                    trip_rate_file: str,
+                    integrate_home_working: bool
+                    ) -> str:
     # Build paths to the trip rate file
-    factors_base = os.path.join(tmfs_root, "Factors")
     if trip_rate_file == "":
         # Use the default version
         tr_name = SPLIT_TR_FILE if integrate_home_working else TR_FILE
-        tr_path = os.path.join(factors_base, tr_name)
+        return os.path.join(tmfs_root, "Factors", tr_name)
+    return trip_rate_file
+
+
+def trip_rate_files(tmfs_root: str,
+                    trip_rate_file: str = "",
+                    integrate_home_working: bool = False,
+                    legacy_trip_rates: bool = False,
+                    just_pivots: bool = False
+                    ) -> List[str]:
+    """Lists the files read by load_production_trip_rates with the same
+    arguments.
+    """
+    if not legacy_trip_rates:
+        return [_trip_rate_path(tmfs_root, trip_rate_file,
+                                integrate_home_working)]
+    periods = TR_PERIODS + (["OP"] if just_pivots else [])
+    if integrate_home_working:
+        tags = ["_" + work_type for work_type in TR_WORK_TYPES]
     else:
-        tr_path = trip_rate_file
+        tags = [""]
+    return [
+        os.path.join(tmfs_root, "Factors", "%s_%s_%s_%s%s.txt" % (
+            purpose, mode, period, area_type, tag))
+        for tag in tags
+        for area_type in TR_AREA_TYPES
+        for period, purpose, mode in product(periods, TR_PURPOSES, TR_MODES)
+    ]
+
+
+def load_production_trip_rates(tmfs_root: str,
+                               trip_rate_file: str = "",
+                               integrate_home_working: bool = False,
+                               legacy_trip_rates: bool = False,
+                               just_pivots: bool = False,
+                               log_func: Callable = print
+                               ) -> Union[np.array, Dict[str, np.array]]:
+    """Loads the production trip rates from the "Factors" folder (or the
+    alternative trip rate file if given) in the format expected by
+    create_production_pivot.
+
+    Returns:
+        Union[np.array, Dict[str, np.array]]: Either a np.array object, or a
+        dictionary with keys ["WAH", "WBC"] if integrate_home_working is True.
+    """
+    factors_base = os.path.join(tmfs_root, "Factors")
+    tr_path = _trip_rate_path(tmfs_root, trip_rate_file,
+                              integrate_home_working)
     # Check that the required file exists
     if not os.path.isfile(tr_path):
         raise ValueError(f"Trip Rate file does not exist: {tr_path}")
@@ -715,32 +1066,70 @@ def telmos_main(delta_root: str,
     else:
         p_trip_rate_array = read_long_trip_rates(
             tr_path,
-            work_type_split=integrate_home_working
+            work_type_split=integrate_home_working,
+            just_pivots=just_pivots
         )
         log_func(f"Using Split Trip Rates: {integrate_home_working}")
         log_func(f"Loaded Trip Rate Factors from {tr_path}")
 
-    # Load in the student factors and attraction factors separately
-    log_func("Loading Attraction Factors")
-    attraction_file = "Attraction Factors.txt"
-    attraction_factors = pd.read_csv(
-        os.path.join(factors_base, attraction_file),
-        header=None,
-        delimiter=" "
+    return p_trip_rate_array
+
+
+def load_attraction_factors(tmfs_root: str) -> np.array:
+    """Loads the attraction trip rates from the "Factors" folder
+    """
+    attraction_file = os.path.join(tmfs_root, "Factors", ATTRACTION_FAC_FILE)
+    attraction_factors = cached_load(
+        attraction_file, "load_attraction_factors",
+        lambda: pd.read_csv(attraction_file, header=None, delimiter=" "))
+    record_read(attraction_file, rows=len(attraction_factors))
+    check_input_dims(attraction_factors,
+                     "ATT_FAC",
+                     "Attraction Factors")
+    return attraction_factors.values
+
+
+def planning_data_files(delta_root: str,
+                        tel_year: str,
+                        tel_scenario: str
+                        ) -> Tuple[str, str]:
+    """Returns the paths of the TELMoS employment (tav) and population (tmfs)
+    planning data files for one forecast scenario.
+    """
+    tel_tmfs_file = os.path.join(
+        delta_root,
+        tel_scenario,
+        "tmfs%s%s.csv" % (tel_year, tel_scenario.lower())
+    )
+    tel_tav_file = os.path.join(
+        delta_root,
+        tel_scenario,
+        "tav_%s%s.csv" % (tel_year, tel_scenario.lower())
     )
-    att_fac_ok = check_input_dims(attraction_factors,
-                                  "ATT_FAC",
-                                  "Attraction Factors")
-    attraction_factors = attraction_factors.values
+    return tel_tav_file, tel_tmfs_file
 
-    # Read in planning data and pivoting files
-    # planning data
 
+def load_planning_data(delta_root: str,
+                       tel_year: str,
+                       tel_scenario: str,
+                       integrate_home_working: bool = False,
+                       zone_system: ZoneSystem = None
+                       ) -> Tuple[np.array,
+                                  Union[np.array, Dict[str, np.array]]]:
+    """Loads the TELMoS employment (tav) and population (tmfs) planning data
+    for one forecast scenario from the DELTA directory. If zone_system is
+    given, the number of rows is checked against its internal zones.
+
+    Returns:
+        Tuple[np.array, Union[np.array, Dict[str, np.array]]]: The employment
+        planning data, and the population planning data with the columns
+        arranged as expected by student_factor_adjustment. The population data
+        is a dictionary with keys ["WAH", "WBC"] if integrate_home_working is
+        True.
+    """
     # If using home working split inputs, create 2 tmfs_array objects, one
     # for each split. These can be combined in create_production_pivot()
-    tel_scenario_tmfs = tel_scenario.lower()
     if integrate_home_working:
-        # tel_scenario_tmfs = "{}_hw".format(tel_scenario.lower())
         # Need to load in extra columns for the working at home split
         use_cols_tmfs = range(2, 15)
         # Define how the array will be split - take 2 sets of columns
@@ -750,59 +1139,30 @@ def telmos_main(delta_root: str,
         use_cols_tmfs = range(2, 11)
         split_tmfs = None
 
-    tel_tmfs_file = os.path.join(
-        delta_root,
-        tel_scenario,
-        "tmfs%s%s.csv" % (tel_year, tel_scenario_tmfs)
-    )
-    tel_tav_file = os.path.join(
-        delta_root,
-        tel_scenario,
-        "tav_%s%s.csv" % (tel_year, tel_scenario.lower())
-    )
-    # base pivoting files
-    base_tmfs_file = os.path.join(
-        tmfs_root,
-        "Runs",
-        base_year,
-        "Demand",
-        base_id,
-        "tmfs%s_%s.csv" % (base_year, base_id)
-    )
-    base_tav_file = os.path.join(
-        tmfs_root,
-        "Runs",
-        base_year,
-        "Demand",
-        base_id,
-        "tav_%s_%s.csv" % (base_year, base_id)
-    )
-
-    log_func("Loading Base Year Synthetic Productions")
-    tmfs_base_array = np.loadtxt(base_tmfs_file, skiprows=1, delimiter=",")
-    count_i = tmfs_base_array.shape[0]
-    tav_base_array = np.loadtxt(base_tav_file, skiprows=1, delimiter=",")
+    tel_tav_file, tel_tmfs_file = planning_data_files(delta_root, tel_year,
+                                                      tel_scenario)
 
-    log_func("Loading Future Year Planning Data")
-    tav_array = pd.read_csv(tel_tav_file)
+    tav_array = load_csv(tel_tav_file)
+    record_read(tel_tav_file, rows=len(tav_array))
     check_input_dims(tav_array,
                      "EMP",
                      input_file_name="Employment Planning Data",
-                     raise_err=True)
+                     raise_err=True,
+                     zone_system=zone_system)
     tav_array = tav_array.values
-    count_tav = tav_array.shape[0]
-    tmfs_array = pd.read_csv(tel_tmfs_file)
+    tmfs_array = load_csv(tel_tmfs_file)
+    record_read(tel_tmfs_file, rows=len(tmfs_array))
     # tmfs_array = np.loadtxt(tel_tmfs_file, skiprows=1, delimiter=",")
     # Check that the coorect number of columns are there
     check_input_dims(tmfs_array,
                      "POP_SPLIT" if integrate_home_working else "POP",
                      input_file_name="Population Planning Data",
-                     raise_err=True)
+                     raise_err=True,
+                     zone_system=zone_system)
     tmfs_array = tmfs_array.values
     tmfs_array = tmfs_array[:, list(use_cols_tmfs)]
     tmfs_array = np.concatenate(
         (np.zeros_like(tmfs_array[:, [0, 1]]), tmfs_array), axis=1)
-    count_tmfs = tmfs_array.shape[0]
 
     # Extract the columns required for the 2 versions of tmfs_array if required
     if split_tmfs:
@@ -821,138 +1181,383 @@ def telmos_main(delta_root: str,
             tmfs_array[:, 5], tmfs_array[:, 4].copy()
         )
 
-    log_func(f"Number of Zones: {count_tav}")
-    log_func(f"Planning Data Row Count {count_tmfs}")
+    return tav_array, tmfs_array
 
-    # # # # # # # # # # # # # # # #
-    # Put income segregation here #
-    # (not implemented)           #
-    # # # # # # # # # # # # # # # #
 
-    # Rearrange and account for students
-    log_func("Applying Student Factor Splits")
-    if split_tmfs:
-        tmfs_adj_array = {}
-        # Adjust each array individually
-        for work_type in tmfs_array:
-            tmfs_adj_array[work_type] = student_factor_adjustment(
-                tmfs_array[work_type]
-            )
-            tmfs_array_shape = tmfs_array[work_type].shape
-            tmfs_adj_array_shape = tmfs_adj_array[work_type].shape
-    else:
-        tmfs_adj_array = student_factor_adjustment(tmfs_array)
-        tmfs_array_shape = tmfs_array.shape
-        tmfs_adj_array_shape = tmfs_adj_array.shape
+def load_area_correspondence(tmfs_root: str) -> np.array:
+    """Loads the area type of each model zone from the "Factors" folder
+    """
+    return load_zone_system(tmfs_root).area_types
+
+
+def load_airport_growth(tmfs_root: str,
+                        tel_year: str,
+                        base_year: str,
+                        num_zones: int,
+                        airport_growth_file: str = "",
+                        log_func: Callable = print,
+                        zone_system: ZoneSystem = None
+                        ) -> np.array:
+    """Calculates the growth factor to apply to each zone for airport growth
+    between the base and forecast year. Zones that are not airports have a
+    factor of 1. The columns of the airport factor file are the zone indices
+    of the airports, which are checked against the airport zones of
+    zone_system if it is given.
+    """
+    # TMfS18 airport indices are as follows (zones are indices + 1):
+    #   708 = Edinburgh Airport
+    #   709 = Prestwick Airport
+    #   710 = Glasgow Airport
+    #   711 = Aberdeen Airport
+
+    # Factors updated as of TMfS 2018
+    #   708 = 4.97% Edinburgh
+    #   709 = 7.6%  Prestwick
+    #   710 = 3.33% Glasgow
+    #   711 = 1.86% Aberdeen
+
+    ####
+    #   Previous method for airport growth < TMfS18
+    #    (constant value per annum)
+
+    ####
+    #   New method for airport growth >= TMfS18 (growth varies
+    #        according to DfT 2017 aviation forecast)
+    # now reads in a file from "Factors" that contains the expected growth
+    # from 2017
+    airport_growth = np.ones(num_zones, dtype="float")
+    if airport_growth_file == "":
+        airport_growth_file = os.path.join(
+            tmfs_root,
+            "Factors",
+            AIRPORT_FAC_FILE
+        )
+    log_func(f"Loading Airport Factors from {airport_growth_file}")
+    if not os.path.isfile(airport_growth_file):
+        raise FileNotFoundError("File does not exist: {}".format(
+            airport_growth_file))
+    factors = pd.read_csv(airport_growth_file, index_col="Year")
+    record_read(airport_growth_file, rows=len(factors))
+    factors = factors.loc[int(tel_year) + 2000] / \
+        factors.loc[int(base_year) + 2000]
+    airport_idxs = factors.index.astype("int")
+    if zone_system is not None:
+        unknown = sorted(set(airport_idxs)
+                         - set(zone_system.airport_indices))
+        if unknown:
+            raise ValueError(
+                f"Airport factors given for zone indices {unknown} which are "
+                f"not airports in the zone system")
+    airport_growth[airport_idxs] = factors.values
+    return airport_growth
+
+
+def telmos_main(delta_root: str,
+                tmfs_root: str,
+                tel_year: str,
+                tel_id: str,
+                tel_scenario: str,
+                base_year: str,
+                base_id: str,
+                base_scenario: str,
+                is_rebasing_run: bool = True,
+                log_func: Callable = print,
+                just_pivots: bool = False,
+                trip_rate_file: str = "",
+                airport_growth_file: str = "",
+                integrate_home_working: bool = False,
+                legacy_trip_rates: bool = False,
+                stage_dir: str = None,
+                zone_system: ZoneSystem = None,
+                binary_check_file: bool = False
+                ) -> None:
+    '''
+    Applies growth to base year trip end files for input into the second stage
+    of the TMfS18 trip end model
+    '''
+    telmos_main_batch(delta_root,
+                      tmfs_root,
+                      [(tel_year, tel_id, tel_scenario)],
+                      base_year,
+                      base_id,
+                      base_scenario,
+                      is_rebasing_run=is_rebasing_run,
+                      log_func=log_func,
+                      just_pivots=just_pivots,
+                      trip_rate_file=trip_rate_file,
+                      airport_growth_file=airport_growth_file,
+                      integrate_home_working=integrate_home_working,
+                      legacy_trip_rates=legacy_trip_rates,
+                      stage_dir=stage_dir,
+                      zone_system=zone_system,
+                      binary_check_file=binary_check_file)
+
+
+def telmos_main_batch(delta_root: str,
+                      tmfs_root: str,
+                      forecasts: List[Tuple[str, str, str]],
+                      base_year: str,
+                      base_id: str,
+                      base_scenario: str,
+                      is_rebasing_run: bool = True,
+                      log_func: Callable = print,
+                      just_pivots: bool = False,
+                      trip_rate_file: str = "",
+                      airport_growth_file: str = "",
+                      integrate_home_working: bool = False,
+                      legacy_trip_rates: bool = False,
+                      stage_dir: str = None,
+                      zone_system: ZoneSystem = None,
+                      binary_check_file: bool = False
+                      ) -> None:
+    """Batched version of telmos_main. Applies growth to the base year trip
+    end files for several forecast scenarios that pivot from the same base.
+    The base year pivots, trip ends and factor files are loaded once, and the
+    planning data for all forecasts are stacked along a leading scenario axis
+    so that the pivoting and growth calculations are done in a single pass.
+
+    Args:
+        forecasts (List[Tuple[str, str, str]]): (tel_year, tel_id,
+        tel_scenario) of each forecast scenario to run.
+        stage_dir (str, optional): Folder to record the results of each
+        stage in (see stage_cache.StageRunner). Stages with the same inputs
+        as the previous run are skipped. Defaults to None, which runs every
+        stage.
+        zone_system (ZoneSystem, optional): Model zone system. Defaults to
+        None, which loads it from the "Factors" folder of tmfs_root.
+        binary_check_file (bool, optional): Write the split productions
+        check file (for runs without the home working split) as binary
+        CHECK_FILE_BINARY instead of text CHECK_FILE. Defaults to False.
+
+    Other arguments are as for telmos_main.
+    """
+    if len(forecasts) == 0:
+        return
+    if len(set((year, t_id) for year, t_id, _ in forecasts)) < len(forecasts):
+        raise ValueError("Forecast year and ID should be unique for each "
+                         "forecast in the batch")
 
-    # tmfs_adj_array = np.copy(tmfs_array)
-    # tmfs_adj_array[:,:3] = tmfs_adj_array[:,2:5]
-    # tmfs_adj_array[:,3] = tmfs_adj_array[:,7] * MALE_STUDENT_FACTOR
-    # tmfs_adj_array[:,4] = tmfs_adj_array[:,8] * FEMALE_STUDENT_FACTOR
-    # tmfs_adj_array[:,7] = tmfs_adj_array[:,7] * (1 - MALE_STUDENT_FACTOR)
-    # tmfs_adj_array[:,8] = tmfs_adj_array[:,8] * (1 - FEMALE_STUDENT_FACTOR)
+    factors_base = os.path.join(tmfs_root, "Factors")
+    if zone_system is None:
+        zone_system = load_zone_system(tmfs_root)
+    zone_files = zone_system_files(tmfs_root)
+    output_dirs = []
+    for tel_year, tel_id, _ in forecasts:
+        output_dir = os.path.join(tmfs_root, "Runs", tel_year, "Demand",
+                                  tel_id)
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        output_dirs.append(output_dir)
+
+    stages = StageRunner(stage_dir, log_func=log_func)
+    set_progress_total(3 if just_pivots else 5)
+    run_params = {"forecasts": forecasts,
+                  "base": [base_year, base_id, base_scenario],
+                  "integrate_home_working": integrate_home_working,
+                  "just_pivots": just_pivots,
+                  "zones": [zone_system.num_internal, zone_system.num_zones]}
+
+    # Read in planning data and pivoting files
+    # base pivoting files
+    base_tmfs_file = os.path.join(
+        tmfs_root,
+        "Runs",
+        base_year,
+        "Demand",
+        base_id,
+        "tmfs%s_%s.csv" % (base_year, base_id)
+    )
+    base_tav_file = os.path.join(
+        tmfs_root,
+        "Runs",
+        base_year,
+        "Demand",
+        base_id,
+        "tav_%s_%s.csv" % (base_year, base_id)
+    )
+    # planning data - one file of each per forecast
+    tel_tav_files = []
+    tel_tmfs_files = []
+    for tel_year, _, tel_scenario in forecasts:
+        tav_file, tmfs_file = planning_data_files(delta_root, tel_year,
+                                                  tel_scenario)
+        tel_tav_files.append(tav_file)
+        tel_tmfs_files.append(tmfs_file)
+
+    def load_planning_data_stacked():
+        # Stack the planning data along the first axis (one entry per
+        # forecast)
+        log_func("Loading Future Year Planning Data")
+        tav_array = []
+        tmfs_array = []
+        for tel_year, tel_id, tel_scenario in forecasts:
+            if len(forecasts) > 1:
+                log_func(f"Loading {tel_year} {tel_scenario} Planning Data")
+            tav, tmfs = load_planning_data(delta_root,
+                                           tel_year,
+                                           tel_scenario,
+                                           integrate_home_working,
+                                           zone_system=zone_system)
+            tav_array.append(tav)
+            tmfs_array.append(tmfs)
+        tav_array = np.stack(tav_array)
+        if integrate_home_working:
+            tmfs_array = {
+                work_type: np.stack([x[work_type] for x in tmfs_array])
+                for work_type in tmfs_array[0]
+            }
+        else:
+            tmfs_array = np.stack(tmfs_array)
+        return tav_array, tmfs_array
+
+    def trip_rate_stage():
+        return load_production_trip_rates(
+            tmfs_root,
+            trip_rate_file=trip_rate_file,
+            integrate_home_working=integrate_home_working,
+            legacy_trip_rates=legacy_trip_rates,
+            just_pivots=just_pivots,
+            log_func=log_func
+        )
+
+    p_trip_rate_array = stages.run(
+        "trip_rates",
+        trip_rate_stage,
+        inputs=trip_rate_files(tmfs_root, trip_rate_file,
+                               integrate_home_working, legacy_trip_rates,
+                               just_pivots),
+        params=dict(run_params, legacy_trip_rates=legacy_trip_rates)
+    )
+    progress_step("Loaded trip rates")
 
     # Attraction Factors
     # Apply the attraction factors to the tav array planning data
-    log_func("Creating Synthetic Attractions")
-    attr_file = os.path.join(tmfs_root, "Runs", tel_year, "Demand", tel_id,
-                             "tav_%s_%s.csv" % (tel_year, tel_id))
-    attr_factors_array = create_attraction_pivot(tav_array, attraction_factors)
-    # Output pivot attraction factors
-    np.savetxt(attr_file, attr_factors_array.round(3), delimiter=",",
-               header="HW,HE,HO,HS", fmt="%.3f", comments="")
-
-    # Calculate Attraction Growth Factors
-    log_func("Calculating Attraction Growth")
-    attr_growth_array = calculate_growth(
-        base=tav_base_array.round(3), forecast=attr_factors_array.round(3))
+    attr_files = [os.path.join(output_dir, "tav_%s_%s.csv" % (tel_year,
+                                                             tel_id))
+                  for (tel_year, tel_id, _), output_dir
+                  in zip(forecasts, output_dirs)]
+
+    def attraction_pivot_stage():
+        # Load in the student factors and attraction factors separately
+        log_func("Loading Attraction Factors")
+        attraction_factors = load_attraction_factors(tmfs_root)
+        tav_array, _ = load_planning_data_stacked()
+        log_func(f"Number of Zones: {tav_array.shape[1]}")
+
+        log_func("Creating Synthetic Attractions")
+        attr_factors_array = create_attraction_pivot(tav_array,
+                                                     attraction_factors)
+        # Output pivot attraction factors
+        for attr_file, attr_factors in zip(attr_files, attr_factors_array):
+            write_fixed_format(attr_file, attr_factors.round(3),
+                               delimiter=",", header="HW,HE,HO,HS",
+                               fmt="%.3f")
+        return attr_factors_array
+
+    attr_factors_array = stages.run(
+        "attraction_pivot",
+        attraction_pivot_stage,
+        inputs=[os.path.join(factors_base, ATTRACTION_FAC_FILE)]
+        + zone_files + tel_tav_files,
+        outputs=attr_files,
+        params=run_params
+    )
+    count_tav = attr_factors_array.shape[1]
+    progress_step("Calculated attraction pivots", rows=count_tav,
+                  files=len(attr_files))
 
     # # # # # # # # # # # #
     # Production Factors
-    log_func("Loading Area Correspondence Lookup")
-    area_corres_file = os.path.join(
-        tmfs_root, "Factors", AREA_DEF_FILE)
-    area_corres_array = pd.read_csv(area_corres_file, dtype="int")
-    area_ok = check_input_dims(area_corres_array,
-                               "AREA",
-                               "Area Definition File")
-    area_corres_array = area_corres_array.values[:, 1]
-    # Area correspondence array maps tmfs18 zones to their urban
-    #  rural classification - repeat for each of the household types
-    area_corres_array = np.repeat(area_corres_array, 8)
-
-    check_file = os.path.join(tmfs_root, "Runs", tel_year,
-                              "Demand", tel_id, "check2.csv")
-
-    # Create the production pivot data - multiplying population/planning data
-    # by the trip rates
-
-    # For home working split data, we need to combine the resulting pivot data
-    log_func("Creating Synthetic Productions")
-    if integrate_home_working:
-        prod_factor_array = None
-        for work_type in tmfs_adj_array:
-            # Check that the work type is valid (Should be WAH or WBC)
-            if work_type not in p_trip_rate_array:
-                raise ValueError("Error: Could not find split in Trip Rates")
-
-            # Pick out the columns that have not been split
-            split_cols = [1, 2, 5, 6]
-            # Halve all other columns to prevent double counts
-            split_pop_data = tmfs_adj_array[work_type].copy()
-            non_split_cols = [x for x in range(split_pop_data.shape[1])
-                              if x not in split_cols]
-            split_pop_data[:, non_split_cols] /= 2
-
-            temp_prod_factors = create_production_pivot(
-                planning_data=split_pop_data,
-                production_trip_rates=p_trip_rate_array[work_type],
-                area_correspondence=area_corres_array,
-                output_shape=tmfs_base_array.shape,
-                just_pivots=just_pivots,
-                int_zones=count_tav
-            )
+    # Output pivot production factors
+    prod_factor_files = [
+        os.path.join(output_dir, "tmfs%s_%s.csv" % (tel_year, tel_id))
+        for (tel_year, tel_id, _), output_dir in zip(forecasts, output_dirs)
+    ]
+    check_files = [
+        os.path.join(output_dir,
+                     CHECK_FILE_BINARY if binary_check_file else CHECK_FILE)
+        for output_dir in output_dirs
+    ]
 
-            if prod_factor_array is None:
-                prod_factor_array = temp_prod_factors
-            else:
-                prod_factor_array += temp_prod_factors
-    # Otherwise, can just use the output data
-    else:
-        prod_factor_array = create_production_pivot(
+    def production_pivot_stage():
+        log_func("Loading Base Year Synthetic Productions")
+        tmfs_base_array = load_table(base_tmfs_file, skiprows=1,
+                                     delimiter=",")
+        record_read(base_tmfs_file, rows=len(tmfs_base_array))
+        _, tmfs_array = load_planning_data_stacked()
+        if integrate_home_working:
+            count_tmfs = tmfs_array["WBC"].shape[1]
+        else:
+            count_tmfs = tmfs_array.shape[1]
+        log_func(f"Planning Data Row Count {count_tmfs}")
+
+        # # # # # # # # # # # # # # # #
+        # Put income segregation here #
+        # (not implemented)           #
+        # # # # # # # # # # # # # # # #
+
+        # Rearrange and account for students
+        log_func("Applying Student Factor Splits")
+        if integrate_home_working:
+            tmfs_adj_array = {}
+            # Adjust each array individually
+            for work_type in tmfs_array:
+                tmfs_adj_array[work_type] = student_factor_adjustment(
+                    tmfs_array[work_type]
+                )
+        else:
+            tmfs_adj_array = student_factor_adjustment(tmfs_array)
+
+        # Area correspondence array maps model zones to their urban
+        #  rural classification - repeat for each of the household types
+        area_corres_array = np.repeat(zone_system.area_types, 8)
+
+        # Create the production pivot data - multiplying population/planning
+        # data by the trip rates
+
+        # For home working split data, we need to combine the resulting pivot
+        # data
+        log_func("Creating Synthetic Productions")
+        prod_factor_array = create_work_type_production_pivot(
             planning_data=tmfs_adj_array,
             production_trip_rates=p_trip_rate_array,
             area_correspondence=area_corres_array,
             output_shape=tmfs_base_array.shape,
             just_pivots=just_pivots,
-            check_file=check_file,
-            int_zones=count_tav
+            int_zones=zone_system.num_internal,
+            check_file=check_files,
+            binary_check_file=binary_check_file
         )
 
-    prod_factor_file = os.path.join(
-        tmfs_root,
-        "Runs",
-        tel_year,
-        "Demand",
-        tel_id,
-        "tmfs%s_%s.csv" % (tel_year, tel_id)
+        purposes = ["W", "O", "E", "S"]
+        periods = ["A", "I"]
+        modes = ["C", "P"]
+        households = ["C0", "C11", "C12", "C2"]
+        if just_pivots:
+            periods.extend(["P", "O"])
+        file_header = [
+            f"{purp}{period}{mode} {hh}" for period, purp, mode, hh
+            in product(periods, purposes, modes, households)
+        ]
+        file_header = ",".join(file_header)
+
+        for prod_factor_file, prod_factors in zip(prod_factor_files,
+                                                  prod_factor_array):
+            write_fixed_format(prod_factor_file, prod_factors.round(3),
+                               delimiter=",", header=file_header, fmt="%.3f")
+        return prod_factor_array
+
+    prod_factor_array = stages.run(
+        "production_pivot",
+        production_pivot_stage,
+        inputs=zone_files + [base_tmfs_file] + tel_tmfs_files,
+        outputs=prod_factor_files + (
+            [] if integrate_home_working else check_files),
+        params=dict(run_params, binary_check_file=binary_check_file),
+        upstream=["trip_rates", "attraction_pivot"]
     )
-
-    # Output pivot production factors
-    purposes = ["W", "O", "E", "S"]
-    periods = ["A", "I"]
-    modes = ["C", "P"]
-    households = ["C0", "C11", "C12", "C2"]
-    if just_pivots:
-        periods.extend(["P", "O"])
-    file_header = [
-        f"{purp}{period}{mode} {hh}" for period, purp, mode, hh
-        in product(periods, purposes, modes, households)
-    ]
-    file_header = ",".join(file_header)
-
-    np.savetxt(prod_factor_file, prod_factor_array.round(3), delimiter=",",
-               header=file_header, fmt="%.3f", comments="")
+    progress_step("Calculated production pivots", rows=count_tav,
+                  files=len(prod_factor_files))
 
     if just_pivots:
         log_func("Completed calculating synthetic PAs")
@@ -960,91 +1565,109 @@ def telmos_main(delta_root: str,
         return
 
     # # # # # # # # # # #
-    # Production Growth Factors
+    # Growth Factors
     # Calculate growth from the base and tel_year pivot files
-    log_func("Calculating Production Growth")
-    prod_growth_array = calculate_growth(
-        base=tmfs_base_array.round(3),
-        forecast=prod_factor_array.round(3)
+    def growth_stage():
+        log_func("Loading Base Year Synthetic Productions")
+        tmfs_base_array = load_table(base_tmfs_file, skiprows=1,
+                                     delimiter=",")
+        tav_base_array = load_table(base_tav_file, skiprows=1, delimiter=",")
+        record_read(base_tmfs_file, rows=len(tmfs_base_array))
+        record_read(base_tav_file, rows=len(tav_base_array))
+
+        # Calculate Attraction Growth Factors
+        log_func("Calculating Attraction Growth")
+        attr_growth_array = calculate_growth(
+            base=tav_base_array.round(3),
+            forecast=attr_factors_array.round(3))
+
+        log_func("Calculating Production Growth")
+        prod_growth_array = calculate_growth(
+            base=tmfs_base_array.round(3),
+            forecast=prod_factor_array.round(3)
+        )
+        return {"production": prod_growth_array,
+                "attraction": attr_growth_array}
+
+    growth = stages.run(
+        "growth",
+        growth_stage,
+        inputs=[base_tmfs_file, base_tav_file],
+        params=run_params,
+        upstream=["attraction_pivot", "production_pivot"]
     )
-
-    log_func("Loading Base Year Calibrated Trip Ends")
-    prefixes = ["AM", "IP"]
-    types = ["HWZ_A1", "HOZ_A1_ALL", "HEZ_A1_ALL", "HSZ_A1"]
-    tod_files = ["%s_%s.TOD" % (prefix, t)
-                 for prefix in prefixes for t in types] + ["PM_HSZ_A1.TOD"]
-    cte_files = [("%s_%s.CTE" % (prefix, t)).replace("A1", "D0")
-                 for prefix in prefixes for t in types] + ["PM_HSZ_D0.CTE"]
+    progress_step("Calculated growth", rows=count_tav)
 
     cte_tod_base_path = os.path.join(
         tmfs_root, "Runs", base_year, "Demand", base_id)
-    tod_data, cte_data = load_cte_tod_files(
-        tod_files, cte_files, cte_tod_base_path)
-
-    airport_growth = np.ones(count_tav, dtype="float")
     if is_rebasing_run is False:
-        # Airport indices are as follows (zones are indices + 1):
-        #   708 = Edinburgh Airport
-        #   709 = Prestwick Airport
-        #   710 = Glasgow Airport
-        #   711 = Aberdeen Airport
-
-        # Factors updated as of TMfS 2018
-        #   708 = 4.97% Edinburgh
-        #   709 = 7.6%  Prestwick
-        #   710 = 3.33% Glasgow
-        #   711 = 1.86% Aberdeen
-
-        ####
-        #   Previous method for airport growth < TMfS18
-        #    (constant value per annum)
-
-        ####
-        #   New method for airport growth >= TMfS18 (growth varies
-        #        according to DfT 2017 aviation forecast)
-        # now reads in a file from "Factors" that contains the expected growth
-        # from 2017
         if airport_growth_file == "":
-            airport_growth_file = os.path.join(
-                tmfs_root,
-                "Factors",
-                AIRPORT_FAC_FILE
-            )
-        log_func(f"Loading Airport Factors from {airport_growth_file}")
-        if not os.path.isfile(airport_growth_file):
-            raise FileNotFoundError("File does not exist: {}".format(
-                airport_growth_file))
-        factors = pd.read_csv(airport_growth_file, index_col="Year")
-        factors = factors.loc[int(tel_year) + 2000] / \
-            factors.loc[int(base_year) + 2000]
-        airport_growth[factors.index.astype("int")] = factors.values
-
-    log_func("Applying Growth to Calibrated Trip Ends")
-    sw_array, sw_cte_array = apply_pivot_files(
-        tod_data,
-        cte_data,
-        prod_growth_array.round(5),
-        attr_growth_array.round(5),
-        airport_growth
-    )
-
-    # Print the TOD and CTE files - index +1: array(round(3))
-    # All the zones are internal, so are labelled continuously - 1->787
-    #   as of tmfs18
+            airport_growth_file = os.path.join(factors_base, AIRPORT_FAC_FILE)
+        airport_files = [airport_growth_file]
+    else:
+        airport_files = []
+    trip_end_files = [
+        os.path.join(output_dir, t_file.replace("_ALL", ""))
+        for output_dir in output_dirs
+        for t_file in TOD_FILES + CTE_FILES
+    ]
 
-    base_path = os.path.join(tmfs_root, "Runs", tel_year, "Demand", tel_id)
+    def apply_stage():
+        log_func("Loading Base Year Calibrated Trip Ends")
+        tod_data, cte_data = load_cte_tod_files(
+            TOD_FILES, CTE_FILES, cte_tod_base_path)
+
+        airport_growth = np.ones((len(forecasts), count_tav), dtype="float")
+        if is_rebasing_run is False:
+            for i, (tel_year, _, _) in enumerate(forecasts):
+                airport_growth[i] = load_airport_growth(
+                    tmfs_root,
+                    tel_year,
+                    base_year,
+                    count_tav,
+                    airport_growth_file=airport_growth_file,
+                    log_func=log_func,
+                    zone_system=zone_system
+                )
 
-    log_func("Saving .TOD Files")
-    save_trip_end_files(tod_files, sw_array, base_path, 3)
-    log_func("Saving .CTE Files")
-    save_trip_end_files(cte_files, sw_cte_array, base_path, 5)
+        log_func("Applying Growth to Calibrated Trip Ends")
+        sw_array, sw_cte_array = apply_pivot_files(
+            tod_data,
+            cte_data,
+            growth["production"].round(5),
+            growth["attraction"].round(5),
+            airport_growth
+        )
 
-    # Check that each array CTE and TOD is > 15kBytes
-    for i, test_array in enumerate(sw_array):
-        if test_array.nbytes < 15000:
-            log_func("TOD Array is incomplete: %d" % i)
-    for i, test_array in enumerate(sw_cte_array):
-        if test_array.nbytes < 15000:
-            log_func("CTE Array is incomplete: %d" % i)
+        # Print the TOD and CTE files - index +1: array(round(3))
+        # All the zones are internal, so are labelled continuously from 1
+        for output_dir, tod_f_array, cte_f_array in zip(
+                output_dirs, sw_array, sw_cte_array):
+            if len(forecasts) > 1:
+                log_func(f"Saving Trip Ends to {output_dir}")
+            log_func("Saving .TOD Files")
+            save_trip_end_files(TOD_FILES, tod_f_array, output_dir, 3)
+            log_func("Saving .CTE Files")
+            save_trip_end_files(CTE_FILES, cte_f_array, output_dir, 5)
+
+            # Check that each array CTE and TOD is > 15kBytes
+            for i, test_array in enumerate(tod_f_array):
+                if test_array.nbytes < 15000:
+                    log_func("TOD Array is incomplete: %d" % i)
+            for i, test_array in enumerate(cte_f_array):
+                if test_array.nbytes < 15000:
+                    log_func("CTE Array is incomplete: %d" % i)
+
+    stages.run(
+        "apply_growth",
+        apply_stage,
+        inputs=[trip_end_file_path(cte_tod_base_path, t_file)
+                for t_file in TOD_FILES + CTE_FILES] + airport_files
+        + zone_files,
+        outputs=trip_end_files,
+        params=dict(run_params, is_rebasing_run=is_rebasing_run),
+        upstream=["growth"]
+    )
+    progress_step("Applied growth to trip ends", files=len(trip_end_files))
 
     log_func("Finished Main Trip End Growth")
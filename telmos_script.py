@@ -8,14 +8,185 @@ The telmos_xxx files all replicate the old TMfS14 VB functions of the same
 names
 """
 
+import multiprocessing
 import queue
 import sys
 import os
-from typing import Callable
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, List, Optional, Tuple
 
+from input_cache import DEFAULT_CACHE_BYTES, set_input_cache
+from progress import (PROGRESS_HISTORY_FILE, ProgressEvent, print_progress,
+                      progress_stage, start_progress, stop_progress)
+from run_report import (REPORT_FILE, RunReport, report_stage, start_report,
+                        stop_report)
+from stage_cache import STAGE_DIR, StageRunner
 from telmos_main import telmos_main
-from telmos_goods import telmos_goods
-from telmos_addins import telmos_addins
+from telmos_goods import telmos_goods, goods_stage_files
+from telmos_addins import telmos_addins, addins_stage_files
+from zone_system import load_zone_system
+
+
+# Folder within the run folder for the cProfile dumps of each stage
+PROFILE_DIR = "profile"
+
+
+def _run_stage(stage_name: str,
+               stage_func: Callable,
+               args: tuple,
+               kwargs: dict,
+               log_queue: queue.Queue,
+               report_options: Optional[dict] = None,
+               cache_options: Optional[dict] = None,
+               progress: bool = False
+               ) -> Optional[List[dict]]:
+    """Runs one stage of the model in a worker process, sending its log
+    messages back to the parent through log_queue. If report_options are
+    given, the stage is recorded in a run report (see
+    run_report.start_report) and the stage records are returned. If
+    cache_options are given, the stage uses an input cache (see
+    input_cache.set_input_cache). If progress is True, the progress events
+    of the stage (see progress.py) are also sent through log_queue."""
+    def log_func(message):
+        log_queue.put((stage_name, message))
+
+    if cache_options is not None:
+        set_input_cache(**cache_options)
+    if progress:
+        start_progress(lambda event: log_queue.put((stage_name, event)),
+                       [stage_name])
+
+    report = None
+    if report_options is not None:
+        report = start_report(**report_options)
+    try:
+        with report_stage(stage_name), progress_stage(stage_name):
+            stage_func(*args, log_func=log_func, **kwargs)
+    finally:
+        stop_report()
+        stop_progress(save=False)
+    return None if report is None else report.stages
+
+
+def run_cached_stage(stage_dir: str,
+                     stage_name: str,
+                     stage_func: Callable,
+                     stage_files: Tuple[List[str], List[str]],
+                     params: dict,
+                     *args,
+                     log_func: Callable = print,
+                     **kwargs
+                     ) -> None:
+    """Runs stage_func as a single stage recorded in stage_dir, skipping it
+    if its input files (the first list in stage_files) and params are the
+    same as the last time it was run and its output files (the second list)
+    are unchanged"""
+    inputs, outputs = stage_files
+    StageRunner(stage_dir, log_func=log_func).run(
+        stage_name,
+        lambda: stage_func(*args, log_func=log_func, **kwargs),
+        inputs=inputs,
+        outputs=outputs,
+        params=params
+    )
+
+
+def run_stages_parallel(stages: List[Tuple[str, Callable, tuple, dict]],
+                        print_func: Callable = print,
+                        report_options: Optional[dict] = None,
+                        cache_options: Optional[dict] = None,
+                        progress_func: Optional[Callable] = None
+                        ) -> List[Optional[List[dict]]]:
+    """Runs independent stages of the model concurrently in a process pool.
+
+    Log messages are passed to print_func in the same order as if the stages
+    were run one after another: messages from the first unfinished stage are
+    shown as they arrive, and those from later stages are held until all
+    earlier stages have finished. If any stage fails, the exception from the
+    first failing stage (in stage order) is raised once all stages have
+    finished.
+
+    Args:
+        stages (List[Tuple[str, Callable, tuple, dict]]): The name, function,
+        positional and keyword arguments of each stage. The function must
+        accept a log_func keyword argument.
+        print_func (Callable, optional): Function used to display log
+        messages. Defaults to print.
+        report_options (dict, optional): Arguments for start_report if each
+        stage should record a run report. Defaults to None.
+        cache_options (dict, optional): Arguments for set_input_cache if
+        each stage should use an input cache. Defaults to None.
+        progress_func (Callable, optional): Function passed the progress
+        events (see progress.ProgressEvent) of each stage as they arrive.
+        Defaults to None.
+
+    Returns:
+        List[Optional[List[dict]]]: The run report stage records from each
+        stage, or None for each stage if report_options is None.
+    """
+    stage_names = [stage[0] for stage in stages]
+    messages = {name: [] for name in stage_names}
+    current = 0
+
+    with multiprocessing.Manager() as manager, \
+            ProcessPoolExecutor(max_workers=len(stages)) as pool:
+        log_queue = manager.Queue()
+        futures = {
+            name: pool.submit(_run_stage, name, func, args, kwargs, log_queue,
+                              report_options, cache_options,
+                              progress_func is not None)
+            for name, func, args, kwargs in stages
+        }
+        while current < len(stage_names):
+            # Check which stages are finished before collecting messages, so
+            # all messages from those stages have already been received
+            done = {name: future.done() for name, future in futures.items()}
+            try:
+                while True:
+                    name, message = log_queue.get(timeout=0.1)
+                    if isinstance(message, ProgressEvent):
+                        # Progress is shown as soon as it is received
+                        progress_func(message)
+                    else:
+                        messages[name].append(message)
+            except queue.Empty:
+                pass
+            # Show messages from the first unfinished stage, and all held
+            # messages from any stages that finished before it
+            while current < len(stage_names):
+                name = stage_names[current]
+                for message in messages[name]:
+                    print_func(message)
+                messages[name] = []
+                if not done[name]:
+                    break
+                current += 1
+
+    for name in stage_names:
+        exc = futures[name].exception()
+        if exc is not None:
+            raise exc
+    return [futures[name].result() for name in stage_names]
+
+
+def _save_report(report: RunReport,
+                 output_dir: str,
+                 status: str,
+                 scenario_args: tuple
+                 ) -> None:
+    stop_report()
+    run_details = dict(zip(
+        ["delta_root", "tmfs_root", "tel_year", "tel_id", "tel_scenario",
+         "base_year", "base_id", "base_scenario"],
+        scenario_args
+    ))
+    try:
+        report.save(os.path.join(output_dir, REPORT_FILE), status=status,
+                    **run_details)
+    except OSError:
+        # The report is not essential, so should not stop the run
+        pass
 
 
 def telmos_all(delta_root: str,
@@ -35,8 +206,41 @@ def telmos_all(delta_root: str,
                rebasing_run: bool,
                thread_queue: queue.Queue = None,
                print_func: Callable = print,
-               just_pivots: bool = False
+               just_pivots: bool = False,
+               parallel: bool = False,
+               skip_unchanged: bool = False,
+               trace_memory: bool = False,
+               profile: bool = False,
+               binary_check_file: bool = False,
+               smooth: bool = False,
+               sparse: bool = False,
+               input_cache: Optional[str] = None,
+               input_cache_bytes: int = DEFAULT_CACHE_BYTES,
+               progress_func: Optional[Callable] = None
                ) -> None:
+    """Runs the main, goods and add-ins stages of the trip end model for one
+    forecast scenario.
+
+    The wall time, CPU time and files read and written by each stage are
+    saved to REPORT_FILE in the output folder. If trace_memory is True the
+    peak memory of each stage is also recorded (using tracemalloc, which
+    slows the run down), and if profile is True a cProfile dump of each of
+    the main, goods and add-ins stages is saved in the PROFILE_DIR folder.
+    If binary_check_file is True the split productions check file is saved
+    in binary (check2.bin) rather than as text (check2.csv). If smooth is
+    True the goods and add-in base matrices are also balanced to the
+    forecast trip ends (see furness.py) and saved in the output folder. If
+    sparse is True the goods and add-in matrices are held as sparse matrices
+    (see sparse_matrix.py), which use less memory for large zone systems.
+    The sums are done in a different order, so the goods trip end outputs
+    (*HGVTE and *LGVTE) can differ from a dense run in the 9th decimal.
+    If input_cache is a folder, the parsed input files are kept there (up
+    to input_cache_bytes, see input_cache.py) so later runs do not have to
+    parse them again. If progress_func is given, it is passed a
+    progress.ProgressEvent after each step of the run, with the fraction
+    complete and an estimate of the time remaining based on earlier runs
+    (saved in PROGRESS_HISTORY_FILE in the "Runs" folder).
+    """
 
     factor_files = dict(rtf=rtf_file, ptf=ptf_file, airport=airport_file,
                         tr_file=trip_rate_file)
@@ -44,53 +248,111 @@ def telmos_all(delta_root: str,
     if print_func is None:
         print_func = print
 
+    scenario_args = (delta_root,
+                     tmfs_root,
+                     tel_year,
+                     tel_id,
+                     tel_scenario,
+                     base_year,
+                     base_id,
+                     base_scenario)
+    output_dir = os.path.join(tmfs_root, "Runs", tel_year, "Demand", tel_id)
+
+    report = None
+    # An input cache that is already active (e.g. in a job_service worker)
+    # is used if input_cache is not given
+    cache_options = None
     try:
 
         # Create a new directory for the output if it does not already exist
-        output_dir = os.path.join(
-            tmfs_root, "Runs", tel_year, "Demand", tel_id)
         if not os.path.isdir(output_dir):
             os.makedirs(output_dir)
 
-        telmos_main(delta_root,
-                    tmfs_root,
-                    tel_year,
-                    tel_id,
-                    tel_scenario,
-                    base_year,
-                    base_id,
-                    base_scenario,
-                    is_rebasing_run=rebasing_run,
-                    integrate_home_working=integrate_home_working,
-                    log_func=print_func,
-                    just_pivots=just_pivots,
-                    trip_rate_file=factor_files["tr_file"],
-                    airport_growth_file=factor_files["airport"],
-                    legacy_trip_rates=old_tr_fmt)
+        report_options = dict(
+            trace_memory=trace_memory,
+            profile_dir=(os.path.join(output_dir, PROFILE_DIR) if profile
+                         else None)
+        )
+        report = start_report(**report_options)
+        if input_cache is not None:
+            cache_options = dict(cache_dir=input_cache,
+                                 max_bytes=input_cache_bytes)
+            set_input_cache(**cache_options)
+
+        # The results of each stage are recorded in the output folder so
+        # that a rerun only repeats the stages whose inputs have changed
+        stage_dir = None
+        if skip_unchanged:
+            stage_dir = os.path.join(output_dir, STAGE_DIR)
+
+        # The zone system is loaded once and shared by all stages
+        zone_system = load_zone_system(tmfs_root)
+        print_func(f"Zone System: {zone_system.num_internal} internal and "
+                   f"{zone_system.num_external} external zones")
+
+        stages = [
+            ("main", telmos_main, scenario_args,
+             dict(is_rebasing_run=rebasing_run,
+                  integrate_home_working=integrate_home_working,
+                  just_pivots=just_pivots,
+                  trip_rate_file=factor_files["tr_file"],
+                  airport_growth_file=factor_files["airport"],
+                  legacy_trip_rates=old_tr_fmt,
+                  stage_dir=stage_dir,
+                  zone_system=zone_system,
+                  binary_check_file=binary_check_file))
+        ]
         if just_pivots is False:
-            telmos_goods(delta_root,
-                         tmfs_root,
-                         tel_year,
-                         tel_id,
-                         tel_scenario,
-                         base_year,
-                         base_id,
-                         base_scenario,
-                         is_rebasing_run=rebasing_run,
-                         log_func=print_func)
-
-            telmos_addins(delta_root,
-                          tmfs_root,
-                          tel_year,
-                          tel_id,
-                          tel_scenario,
-                          base_year,
-                          base_id,
-                          base_scenario,
-                          log_func=print_func,
-                          rtf_file=factor_files["rtf"],
-                          ptf_file=factor_files["ptf"])
+            goods_kwargs = dict(is_rebasing_run=rebasing_run, smooth=smooth,
+                                sparse=sparse)
+            addins_kwargs = dict(rtf_file=factor_files["rtf"],
+                                 ptf_file=factor_files["ptf"],
+                                 smooth=smooth, sparse=sparse)
+            goods_func = telmos_goods
+            addins_func = telmos_addins
+            if skip_unchanged:
+                goods_func = partial(
+                    run_cached_stage, stage_dir, "goods", telmos_goods,
+                    goods_stage_files(*scenario_args, smooth=smooth),
+                    dict(goods_kwargs, scenario=scenario_args))
+                addins_func = partial(
+                    run_cached_stage, stage_dir, "addins", telmos_addins,
+                    addins_stage_files(*scenario_args,
+                                       rtf_file=factor_files["rtf"],
+                                       ptf_file=factor_files["ptf"],
+                                       smooth=smooth),
+                    dict(addins_kwargs, scenario=scenario_args))
+            stages.append(("goods", goods_func, scenario_args,
+                           dict(goods_kwargs, zone_system=zone_system)))
+            stages.append(("addins", addins_func, scenario_args,
+                           dict(addins_kwargs, zone_system=zone_system)))
+
+        tracker = None
+        if progress_func is not None:
+            tracker = start_progress(
+                progress_func, [stage[0] for stage in stages],
+                history_file=os.path.join(tmfs_root, "Runs",
+                                          PROGRESS_HISTORY_FILE))
+
+        if parallel and len(stages) > 1:
+            # The stages read different inputs and write different outputs,
+            # so can be run at the same time
+            stage_reports = run_stages_parallel(
+                stages, print_func=print_func, report_options=report_options,
+                cache_options=cache_options,
+                progress_func=None if tracker is None else tracker.update)
+            for stage_report in stage_reports:
+                report.add_stages(stage_report)
+        else:
+            for stage_name, stage_func, args, kwargs in stages:
+                with report_stage(stage_name), progress_stage(stage_name):
+                    stage_func(*args, log_func=print_func, **kwargs)
     except Exception:
+        if cache_options is not None:
+            set_input_cache(None)
+        stop_progress(save=False)
+        if report is not None:
+            _save_report(report, output_dir, "failed", scenario_args)
         if thread_queue is not None:
             thread_queue.put(sys.exc_info())
             return
@@ -98,6 +360,10 @@ def telmos_all(delta_root: str,
             # Not running from GUI so raise the exception as normal
             raise
     else:
+        if cache_options is not None:
+            set_input_cache(None)
+        stop_progress()
+        _save_report(report, output_dir, "finished", scenario_args)
         if thread_queue is not None:
             thread_queue.put(None)
         print_func("Finished")
@@ -114,4 +380,7 @@ if __name__ == "__main__":
     base_scenario = "AE"
     diffs = telmos_all(delta_root, tmfs_root, tel_year, tel_id, tel_scenario,
                        base_year, base_id, base_scenario,
-                       rebasing_run=False, just_pivots=False)
+                       trip_rate_file="", rtf_file="", ptf_file="",
+                       airport_file="", integrate_home_working=True,
+                       old_tr_fmt=False, rebasing_run=False,
+                       just_pivots=False, progress_func=print_progress)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the batch runner, on synthetic data.
+"""
+
+import os
+
+from scripts.batch_run import plan_runs, run_batch
+from scripts.synthetic_data import (BASE_SCENARIO, FORECAST_SCENARIO,
+                                    generate_synthetic_data,
+                                    write_legacy_trip_rates)
+
+
+def test_runs_after_legacy_run_in_same_worker(tmp_path):
+    # The pool reuses its worker process, so the second run follows the
+    # legacy just_pivots run in the same process
+    paths = generate_synthetic_data(str(tmp_path / "data"), matrices=False,
+                                    home_working=False)
+    write_legacy_trip_rates(os.path.join(paths["tmfs_root"], "Factors"))
+    settings = dict(paths,
+                    forecast_year=FORECAST_SCENARIO[0],
+                    forecast_id="LEG",
+                    forecast_scenario=FORECAST_SCENARIO[2],
+                    base_year=BASE_SCENARIO[0],
+                    base_id=BASE_SCENARIO[1],
+                    base_scenario=BASE_SCENARIO[2],
+                    home_working=0,
+                    old_tr_fmt=1)
+    runs, _ = plan_runs([
+        (settings, {"just_pivots": True}),
+        (dict(settings, forecast_id="NEW", old_tr_fmt=0),
+         {"just_pivots": True})
+    ])
+
+    results = run_batch(runs, str(tmp_path / "batch"), workers=1,
+                        print_func=lambda message: None)
+
+    assert [r["status"] for r in results] == ["finished", "finished"], [
+        r["error"] for r in results]
+    assert [r["name"] for r in results] == ["25_LEG", "25_NEW"]
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Furness balancing in furness.py.
+"""
+
+import numpy as np
+import pytest
+
+from furness import (FURNESS_TOLERANCE, TARGET_BALANCE, furness,
+                     furness_matrices, smooth_matrices)
+
+
+def _random_problem(rng: np.random.Generator, shape=(12, 12)):
+    # A seed with some zero cells, and consistent targets from a matrix with
+    # the same zero cells
+    seed = rng.random(shape) * (rng.random(shape) < 0.7)
+    target_matrix = seed * rng.uniform(0.5, 2, shape)
+    return seed, target_matrix.sum(axis=-1), target_matrix.sum(axis=-2)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_converges_to_targets(seed):
+    rng = np.random.default_rng(seed)
+    matrix, rows, cols = _random_problem(rng)
+    result, info = furness(matrix, rows, cols)
+    assert info["converged"]
+    assert info["max_error"] <= FURNESS_TOLERANCE
+    assert info["unmet_total"] == 0
+    np.testing.assert_allclose(result.sum(axis=1), rows,
+                               rtol=FURNESS_TOLERANCE)
+    np.testing.assert_allclose(result.sum(axis=0), cols, rtol=1e-12)
+    # Zero cells stay zero
+    np.testing.assert_array_equal(result[matrix == 0], 0)
+    # The seed is not changed
+    assert not np.shares_memory(result, matrix)
+
+
+def test_leading_axes_balanced_separately():
+    rng = np.random.default_rng(1)
+    problems = [_random_problem(rng) for _ in range(3)]
+    # The matrices are iterated until all have converged, so are only
+    # compared to a tight tolerance
+    stacked, _ = furness(*[np.stack(parts) for parts in zip(*problems)],
+                         tolerance=1e-12, max_iterations=1000)
+    for i, problem in enumerate(problems):
+        single, _ = furness(*problem, tolerance=1e-12, max_iterations=1000)
+        np.testing.assert_allclose(stacked[i], single, rtol=1e-9)
+
+
+def test_stops_at_max_iterations():
+    rng = np.random.default_rng(2)
+    matrix, rows, cols = _random_problem(rng)
+    result, info = furness(matrix, rows, cols, max_iterations=1,
+                           tolerance=1e-12)
+    assert info["iterations"] == 1
+    assert not info["converged"]
+    assert info["max_error"] > 1e-12
+    np.testing.assert_allclose(result.sum(axis=0), cols, rtol=1e-12)
+
+
+def test_reports_targets_that_cannot_be_reached():
+    # A diagonal seed cannot have row totals different from its column
+    # totals
+    matrix = np.eye(3)
+    result, info = furness(matrix, [1, 2, 3], [3, 2, 1], max_iterations=20)
+    assert info["iterations"] == 20
+    assert not info["converged"]
+    assert np.isfinite(info["max_error"])
+
+
+def test_zero_seed_rows_and_columns():
+    matrix = np.array([[1.0, 2, 0],
+                       [0, 0, 0],
+                       [3, 1, 0]])
+    rows = np.array([6.0, 4, 8])
+    cols = np.array([9.0, 5, 4])
+    result, info = furness(matrix, rows, cols, balance="rows")
+    assert info["unmet_rows"] == 1
+    assert info["unmet_columns"] == 1
+    assert info["unmet_total"] == pytest.approx(8)
+    assert info["converged"]
+    np.testing.assert_array_equal(result[1], 0)
+    np.testing.assert_array_equal(result[:, 2], 0)
+    # The reachable targets are kept, and have the same total
+    np.testing.assert_allclose(result.sum(axis=1), [6, 0, 8], rtol=1e-6)
+    np.testing.assert_allclose(result.sum(axis=0), [9, 5, 0], rtol=1e-12)
+
+
+def test_zero_value_fills_seed():
+    matrix = np.array([[1.0, 0], [0, 0]])
+    result, info = furness(matrix, [2, 2], [2, 2], zero_value=1e-3)
+    assert info["converged"]
+    assert info["unmet_total"] == 0
+    assert np.all(result > 0)
+    np.testing.assert_allclose(result.sum(axis=1), [2, 2], rtol=1e-6)
+
+
+@pytest.mark.parametrize("balance, total", [("rows", 10), ("columns", 20),
+                                            ("average", 15)])
+def test_balance_modes(balance, total):
+    rng = np.random.default_rng(3)
+    matrix = rng.random((5, 5)) + 0.1
+    rows = rng.random(5)
+    cols = rng.random(5)
+    rows *= 10 / rows.sum()
+    cols *= 20 / cols.sum()
+    result, info = furness(matrix, rows, cols, balance=balance)
+    assert info["converged"]
+    assert result.sum() == pytest.approx(total)
+    # The targets are scaled, so keep their shares
+    np.testing.assert_allclose(result.sum(axis=1), rows * total / 10,
+                               rtol=1e-6)
+    np.testing.assert_allclose(result.sum(axis=0), cols * total / 20,
+                               rtol=1e-12)
+
+
+def test_balance_none_keeps_targets():
+    assert "none" in TARGET_BALANCE
+    matrix = np.ones((3, 3))
+    # Targets with the same total converge without balancing
+    result, info = furness(matrix, [1, 2, 3], [3, 2, 1], balance="none")
+    assert info["converged"]
+    np.testing.assert_allclose(result.sum(axis=0), [3, 2, 1], rtol=1e-12)
+    # Targets with different totals cannot all be met
+    _, info = furness(matrix, [1, 2, 3], [6, 4, 2], balance="none")
+    assert not info["converged"]
+
+
+def test_invalid_arguments():
+    matrix = np.ones((3, 3))
+    with pytest.raises(ValueError, match="balance"):
+        furness(matrix, np.ones(3), np.ones(3), balance="total")
+    with pytest.raises(ValueError, match="negative"):
+        furness(matrix, [1, -1, 1], np.ones(3))
+    with pytest.raises(ValueError, match="do not match"):
+        furness(matrix, np.ones(2), np.ones(3))
+
+
+def test_furness_matrices_and_smoothing():
+    rng = np.random.default_rng(4)
+    problems = [_random_problem(rng) for _ in range(4)]
+    threaded = furness_matrices(problems, max_workers=2)
+    for problem, (result, info) in zip(problems, threaded):
+        expected, expected_info = furness(*problem)
+        np.testing.assert_array_equal(result, expected)
+        assert info == expected_info
+
+    base = {"a": problems[0][0], "b": problems[1][0]}
+    forecast = {k: v * 2 for k, v in base.items()}
+    messages = []
+    smoothed = smooth_matrices(base, forecast, log_func=messages.append)
+    for k in base:
+        np.testing.assert_allclose(smoothed[k], forecast[k], rtol=1e-6)
+    assert len(messages) == 2
+    assert all("converged" in m for m in messages)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of reading the TELMoS goods files in telmos_goods.py.
+"""
+
+import numpy as np
+import pytest
+
+from sparse_matrix import as_dense
+from telmos_goods import _goods_matrix, read_goods_file
+from zone_system import ZoneSystem
+
+GOODS_LINES = ["1 1 1 0.5", "1 1 2 12", "2 1 1 3.25", "2 2 1 0"]
+EXPECTED = np.array([[1, 1, 1, 0.5], [1, 1, 2, 12], [2, 1, 1, 3.25],
+                     [2, 2, 1, 0]])
+
+
+def _goods_file(tmp_path, lines, line_end="\n", final_newline=True):
+    path = tmp_path / "AMHGV.DAT"
+    text = line_end.join(lines) + (line_end if final_newline else "")
+    path.write_bytes(text.encode("ascii"))
+    return str(path)
+
+
+def test_reads_goods_lines(tmp_path):
+    values = read_goods_file(_goods_file(tmp_path, GOODS_LINES))
+    np.testing.assert_array_equal(values, EXPECTED)
+
+
+def test_skips_header(tmp_path):
+    lines = ["Ind Orig Dest Trips"] + GOODS_LINES
+    values = read_goods_file(_goods_file(tmp_path, lines))
+    np.testing.assert_array_equal(values, EXPECTED)
+
+
+@pytest.mark.parametrize("final_newline", [True, False])
+@pytest.mark.parametrize("line_end", ["\n", "\r\n"])
+def test_line_endings(tmp_path, line_end, final_newline):
+    lines = ["Ind Orig Dest Trips"] + GOODS_LINES
+    values = read_goods_file(_goods_file(tmp_path, lines, line_end,
+                                         final_newline))
+    np.testing.assert_array_equal(values, EXPECTED)
+
+
+def test_other_lines_skipped(tmp_path):
+    # Other indicators, indicators with more than one character, blank
+    # lines and tab separated values
+    lines = ["3 1 1 99", GOODS_LINES[0], "", "12 1 1 99", "  ",
+             GOODS_LINES[1], "\t".join(GOODS_LINES[2].split()),
+             "0 2 2 99", "  " + GOODS_LINES[3]]
+    values = read_goods_file(_goods_file(tmp_path, lines))
+    np.testing.assert_array_equal(values, EXPECTED)
+
+
+@pytest.mark.parametrize("bad_line", ["1 1 2", "2 1 2 3 4", "1"])
+def test_wrong_number_of_values(tmp_path, bad_line):
+    lines = ["Ind Orig Dest Trips"] + GOODS_LINES[:2] + [bad_line]
+    with pytest.raises(ValueError, match="Line 4 .* should have 4 values"):
+        read_goods_file(_goods_file(tmp_path, lines))
+
+
+def test_other_lines_can_have_any_number_of_values(tmp_path):
+    lines = GOODS_LINES + ["3 1", "Total 4 values in this file"]
+    values = read_goods_file(_goods_file(tmp_path, lines))
+    np.testing.assert_array_equal(values, EXPECTED)
+
+
+def test_empty_file(tmp_path):
+    values = read_goods_file(_goods_file(tmp_path, [], final_newline=False))
+    assert values.shape == (0, 4)
+
+
+def _zone_system():
+    # TELMoS zone 4 is model zone 3, and TELMoS zone 3 is model zone 4
+    return ZoneSystem(np.ones(4), 3, [[1, 2], [4, 4], [3, 3]], {})
+
+
+def _od_values(num_zones=4):
+    origins, destinations = np.divmod(np.arange(num_zones ** 2), num_zones)
+    return np.column_stack([origins + 1, destinations + 1,
+                            np.arange(num_zones ** 2, dtype="float64")])
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_goods_matrix_renumbers_zones(sparse):
+    od_values = _od_values()
+    matrix = as_dense(_goods_matrix(od_values, _zone_system(), "AMHGV.DAT",
+                                    "HGV", sparse=sparse))
+    expected = od_values[:, 2].reshape(4, 4)[:, [0, 1, 3, 2]][[0, 1, 3, 2]]
+    np.testing.assert_array_equal(matrix, expected)
+
+
+def test_goods_matrix_repeated_pair():
+    od_values = _od_values()
+    # (1, 2) is given twice and (3, 4) not at all
+    od_values[11, :2] = [1, 2]
+    with pytest.raises(ValueError, match=r"zone pair \(4, 3\) is missing "
+                                         r"\(a pair is repeated or absent\)"):
+        _goods_matrix(od_values, _zone_system(), "AMHGV.DAT", "HGV")
+
+
+def test_goods_matrix_wrong_number_of_pairs():
+    with pytest.raises(ValueError, match="requires 4 \\* 4 entries"):
+        _goods_matrix(_od_values()[:-1], _zone_system(), "AMHGV.DAT", "HGV")
+
+
+@pytest.mark.parametrize("zone", [0, 5])
+def test_goods_matrix_zone_out_of_range(zone):
+    od_values = _od_values()
+    od_values[6, 1] = zone
+    with pytest.raises(ValueError, match="should be between 1 and 4"):
+        _goods_matrix(od_values, _zone_system(), "AMHGV.DAT", "HGV")
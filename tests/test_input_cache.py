@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of input_cache.InputCache.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from input_cache import InputCache
+
+
+def _input_file(folder, name, text="1,2,3\n"):
+    path = os.path.join(folder, name)
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+
+def _entry_paths(cache):
+    return [entry["path"] for entry in cache.info()["entries"]]
+
+
+def test_load_reads_file_once(tmp_path):
+    cache = InputCache(str(tmp_path / "cache"))
+    path = _input_file(str(tmp_path), "a.csv")
+    calls = []
+
+    def load():
+        calls.append(path)
+        return np.arange(10.0)
+
+    first = cache.load(path, "test", load)
+    second = cache.load(path, "test", load)
+    assert calls == [path]
+    np.testing.assert_array_equal(first, second)
+    # Other parameters give a different entry
+    cache.load(path, "test", load, params={"scale": 2})
+    assert len(calls) == 2
+
+
+def test_least_recently_used_entries_evicted(tmp_path):
+    folder = str(tmp_path)
+    cache = InputCache(os.path.join(folder, "cache"), max_bytes=1)
+    paths = [_input_file(folder, f"{name}.csv") for name in "abc"]
+    cache.put(paths[0], "test", np.zeros(1000))
+    entry_bytes = cache.info()["total_bytes"]
+    cache.max_bytes = int(2.5 * entry_bytes)
+
+    cache.put(paths[1], "test", np.zeros(1000))
+    # Use a so that b is the least recently used
+    assert cache.get(paths[0], "test") is not None
+    cache.put(paths[2], "test", np.zeros(1000))
+
+    assert sorted(_entry_paths(cache)) == [paths[0], paths[2]]
+    assert cache.get(paths[1], "test") is None
+    assert cache.info()["total_bytes"] <= cache.max_bytes
+
+
+def test_entry_larger_than_budget_kept_alone(tmp_path):
+    folder = str(tmp_path)
+    cache = InputCache(os.path.join(folder, "cache"), max_bytes=1)
+    paths = [_input_file(folder, f"{name}.csv") for name in "ab"]
+    cache.put(paths[0], "test", np.zeros(10))
+    cache.put(paths[1], "test", np.zeros(10))
+    assert _entry_paths(cache) == [paths[1]]
+
+
+@pytest.mark.parametrize("change", ["size", "mtime", "content"])
+def test_changed_file_not_loaded_from_cache(tmp_path, change):
+    cache = InputCache(str(tmp_path / "cache"))
+    path = _input_file(str(tmp_path), "a.csv")
+    cache.put(path, "test", np.arange(3))
+    assert cache.get(path, "test") is not None
+
+    mtime = os.stat(path).st_mtime_ns
+    if change == "size":
+        _input_file(str(tmp_path), "a.csv", "1,2,3,4\n")
+    elif change == "content":
+        # Same size, and the time set below in case the clock is coarse
+        _input_file(str(tmp_path), "a.csv", "4,5,6\n")
+    os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+    assert cache.get(path, "test") is None
+
+
+@pytest.mark.parametrize("memory_bytes", [0, 1 << 20])
+def test_cached_arrays_are_read_only(tmp_path, memory_bytes):
+    cache = InputCache(str(tmp_path / "cache"), memory_bytes=memory_bytes)
+    path = _input_file(str(tmp_path), "a.csv")
+    cache.put(path, "array", np.arange(3.0))
+    cache.put(path, "tuple", (np.arange(3.0), np.ones(2)))
+
+    array = cache.get(path, "array")
+    with pytest.raises(ValueError):
+        array[0] = 5
+    with pytest.raises(ValueError):
+        array *= 2
+    for value in cache.get(path, "tuple"):
+        with pytest.raises(ValueError):
+            value += 1
+    # Copies can be changed, and the cache is not affected
+    copy = array.copy()
+    copy[0] = 5
+    np.testing.assert_array_equal(cache.get(path, "array"), np.arange(3.0))
+
+
+def test_clear_removes_only_cache_entries(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache = InputCache(str(cache_dir))
+    path = _input_file(str(tmp_path), "a.csv")
+    cache.put(path, "test", np.arange(3))
+    entry = cache.info()["entries"][0]
+    assert entry["path"] == path
+
+    other_file = cache_dir / "notes.txt"
+    other_file.write_text("kept")
+    other_dir = cache_dir / "results"
+    other_dir.mkdir()
+    # Named like an entry but not made by the cache
+    lookalike = cache_dir / ("0" * 40)
+    lookalike.mkdir()
+    (cache_dir / "index.json.123.tmp").write_text("")
+
+    cache.clear()
+    assert sorted(os.listdir(str(cache_dir))) == sorted(
+        ["notes.txt", "results", "0" * 40])
+    assert cache.get(path, "test") is None
+    # The input file is not touched
+    assert os.path.isfile(path)
+
+
+def test_clear_refuses_folder_without_index(tmp_path):
+    folder = tmp_path / "data"
+    folder.mkdir()
+    (folder / "a.csv").write_text("1")
+    with pytest.raises(ValueError, match="not an input cache"):
+        InputCache(str(folder)).clear()
+    assert os.listdir(str(folder)) == ["a.csv"]
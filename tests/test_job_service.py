@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the job service HTTP interface, with telmos_all replaced by a stub
+run so that no model data is needed.
+"""
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import telmos_script
+from job_service import DEFAULT_HOST, JobService, _Handler
+from progress import ProgressEvent
+
+# The workers only see the stub if they are forked from this process
+pytestmark = pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork",
+    reason="The stub run is only passed to forked workers")
+
+TIMEOUT = 30
+
+
+def _stub_telmos_all(delta_root, tmfs_root, forecast_year, forecast_id,
+                     *args, print_func=print, progress_func=None, **kwargs):
+    # Records the order the jobs are run in, and waits for a release file
+    # for jobs whose ID starts with WAIT
+    with open(os.path.join(tmfs_root, "order.txt"), "a") as f:
+        f.write(forecast_id + "\n")
+    print_func(f"Running {forecast_id}")
+    progress_func(ProgressEvent("main", 1, 2, "Started", 0, 0, 0.0,
+                                fraction=0.5))
+    if forecast_id.startswith("WAIT"):
+        release_file = os.path.join(tmfs_root, "release_" + forecast_id)
+        end = time.time() + TIMEOUT
+        while not os.path.isfile(release_file) and time.time() < end:
+            time.sleep(0.02)
+    if forecast_id == "FAIL":
+        raise ValueError("Stub run failed")
+    print_func(f"Finished {forecast_id}")
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(telmos_script, "telmos_all", _stub_telmos_all)
+    job_service = JobService(max_workers=1, cache_dir=None)
+    # Port 0 gives a free port
+    server = ThreadingHTTPServer((DEFAULT_HOST, 0), _Handler)
+    server.daemon_threads = True
+    server.service = job_service
+    job_service.start()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    job_service.port = server.server_address[1]
+    job_service.root = str(tmp_path)
+    yield job_service
+    server.shutdown()
+    server.server_close()
+    job_service.stop()
+
+
+def _call(service, method, path, data=None):
+    # Returns the status and JSON body of a request to the service
+    request = urllib.request.Request(
+        f"http://{DEFAULT_HOST}:{service.port}{path}", method=method,
+        data=None if data is None else json.dumps(data).encode("utf-8"),
+        headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def _submit(service, forecast_id, priority=0, **settings):
+    settings = dict({"tmfs_root": service.root, "delta_root": service.root,
+                     "forecast_year": "25", "forecast_id": forecast_id},
+                    **settings)
+    return _call(service, "POST", "/jobs",
+                 {"settings": settings, "priority": priority})
+
+
+def _wait_for_status(service, job_id, statuses):
+    end = time.time() + TIMEOUT
+    while time.time() < end:
+        _, job = _call(service, "GET", f"/jobs/{job_id}")
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} is {job['status']}, not {statuses}")
+
+
+def _release(service, forecast_id):
+    with open(os.path.join(service.root, "release_" + forecast_id), "w"):
+        pass
+
+
+def _run_order(service):
+    with open(os.path.join(service.root, "order.txt"), "r") as f:
+        return f.read().split()
+
+
+def test_jobs_run_by_priority(service):
+    status, first = _submit(service, "WAIT1")
+    assert status == 201
+    _wait_for_status(service, first["id"], ["running"])
+    # Queued behind the running job
+    ids = {}
+    for forecast_id, priority in [("LOW", 0), ("HIGH", 5), ("MID", 1),
+                                  ("LOW2", 0)]:
+        status, job = _submit(service, forecast_id, priority=priority)
+        assert (status, job["status"]) == (201, "queued")
+        ids[forecast_id] = job["id"]
+
+    _release(service, "WAIT1")
+    for job_id in ids.values():
+        assert _wait_for_status(service, job_id, ["finished", "failed"])[
+            "status"] == "finished"
+    assert _run_order(service) == ["WAIT1", "HIGH", "MID", "LOW", "LOW2"]
+
+    _, status = _call(service, "GET", "/status")
+    assert status["workers"] == 1
+    assert status["jobs"] == {"finished": 5}
+    _, jobs = _call(service, "GET", "/jobs")
+    assert [job["name"] for job in jobs] == [
+        "25_WAIT1", "25_LOW", "25_HIGH", "25_MID", "25_LOW2"]
+
+
+def test_duplicate_jobs(service):
+    _, first = _submit(service, "WAIT1")
+    # The same settings, given in a different form
+    status, duplicate = _submit(service, "WAIT1", forecast_year=25,
+                                home_working="1")
+    assert status == 200
+    assert duplicate["duplicate"] is True
+    assert duplicate["id"] == first["id"]
+    # Different settings that write to the same folder
+    status, error = _submit(service, "WAIT1", forecast_scenario="CD")
+    assert status == 400
+    assert "already writes to" in error["error"]
+    # Options that telmos_all does not take
+    status, _ = _call(service, "POST", "/jobs", {
+        "settings": {"tmfs_root": service.root, "forecast_id": "WAIT1",
+                     "forecast_year": "25"},
+        "options": {"unknown": True}})
+    assert status == 400
+
+    _release(service, "WAIT1")
+    _wait_for_status(service, first["id"], ["finished"])
+    # Finished jobs can be run again
+    status, again = _submit(service, "WAIT1")
+    assert status == 201
+    assert again["id"] != first["id"]
+    _wait_for_status(service, again["id"], ["finished"])
+
+
+def test_cancel(service):
+    _, running = _submit(service, "WAIT1")
+    _wait_for_status(service, running["id"], ["running"])
+    _, queued = _submit(service, "QUEUED")
+
+    status, job = _call(service, "DELETE", f"/jobs/{queued['id']}")
+    assert (status, job["status"]) == (200, "cancelled")
+    status, job = _call(service, "POST", f"/jobs/{running['id']}/cancel")
+    assert (status, job["status"]) == (200, "cancelled")
+    # The worker running the job is stopped and replaced
+    _, after = _submit(service, "AFTER")
+    assert _wait_for_status(service, after["id"], ["finished", "failed"])[
+        "status"] == "finished"
+    assert _run_order(service) == ["WAIT1", "AFTER"]
+    assert _call(service, "GET", f"/jobs/{running['id']}")[1][
+        "status"] == "cancelled"
+    assert _call(service, "POST", "/jobs/999/cancel")[0] == 404
+
+
+def test_failed_job(service):
+    _, job = _submit(service, "FAIL")
+    job = _wait_for_status(service, job["id"], ["finished", "failed"])
+    assert job["status"] == "failed"
+    assert job["error"] == "ValueError: Stub run failed"
+
+
+def test_log_and_stream(service):
+    _, job = _submit(service, "WAIT1")
+    _wait_for_status(service, job["id"], ["running"])
+    events = []
+
+    def read_stream():
+        url = (f"http://{DEFAULT_HOST}:{service.port}/jobs/{job['id']}"
+               f"/stream")
+        with urllib.request.urlopen(url, timeout=TIMEOUT) as response:
+            events.extend(json.loads(line) for line in response)
+
+    reader = threading.Thread(target=read_stream)
+    reader.start()
+    _release(service, "WAIT1")
+    reader.join(TIMEOUT)
+    assert not reader.is_alive()
+
+    logs = [e["message"] for e in events if e["type"] == "log"]
+    assert logs == ["Running WAIT1", "Finished WAIT1"]
+    progress = [e for e in events if e["type"] == "progress"]
+    assert progress[-1]["fraction"] == 0.5
+    assert events[-1] == {"type": "status", "status": "finished",
+                          "error": None}
+
+    status, log = _call(service, "GET", f"/jobs/{job['id']}/log?since=1")
+    assert status == 200
+    assert log == {"lines": ["Finished WAIT1"], "next": 2,
+                   "status": "finished"}
+    assert _call(service, "GET", "/jobs/999/log")[0] == 404
+    assert _call(service, "GET", "/unknown")[0] == 404
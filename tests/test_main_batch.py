@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that telmos_main_batch gives the same outputs as running telmos_main
+for each forecast separately, on synthetic data.
+"""
+
+import filecmp
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.synthetic_data import (BASE_SCENARIO, FORECAST_SCENARIO,
+                                    generate_synthetic_data)
+from telmos_main import telmos_main, telmos_main_batch
+
+# The smallest synthetic zone system, with 714 internal zones
+NUM_ZONES = 730
+# Forecasts with different planning data, and two that share a scenario
+FORECASTS = [FORECAST_SCENARIO, ("30", "FAR", "EF"),
+             (FORECAST_SCENARIO[0], "ALT", FORECAST_SCENARIO[2])]
+
+
+def _add_scenario(delta_root, year, scenario, seed):
+    # Copies the synthetic forecast planning data to another scenario with
+    # each value scaled by a random factor
+    rng = np.random.default_rng(seed)
+    tel_year, _, tel_scenario = FORECAST_SCENARIO
+    scenario_dir = os.path.join(delta_root, scenario)
+    os.makedirs(scenario_dir, exist_ok=True)
+    for name, keys in [("tav_%s%s.csv", ["zone"]),
+                       ("tmfs%s%s.csv", ["zone", "hh_type"])]:
+        df = pd.read_csv(os.path.join(
+            delta_root, tel_scenario, name % (tel_year,
+                                              tel_scenario.lower())))
+        values = [c for c in df.columns if c not in keys]
+        df[values] = (df[values] * rng.uniform(
+            0.9, 1.2, (len(df), len(values)))).round(3)
+        df.to_csv(os.path.join(scenario_dir,
+                               name % (year, scenario.lower())),
+                  index=False)
+
+
+@pytest.fixture(scope="module")
+def synthetic_data(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("main_batch"))
+    paths = generate_synthetic_data(root, num_zones=NUM_ZONES,
+                                    matrices=False)
+    _add_scenario(paths["delta_root"], "30", "EF", seed=1)
+    return root
+
+
+def _output_dir(root, year, t_id):
+    return os.path.join(root, "TMFS", "Runs", year, "Demand", t_id)
+
+
+@pytest.mark.parametrize("just_pivots", [False, True])
+def test_batch_matches_separate_runs(synthetic_data, tmp_path, just_pivots):
+    roots = {}
+    for run in ("batch", "separate"):
+        roots[run] = str(tmp_path / run)
+        shutil.copytree(synthetic_data, roots[run])
+    options = dict(is_rebasing_run=False, integrate_home_working=True,
+                   just_pivots=just_pivots, log_func=lambda message: None)
+
+    telmos_main_batch(os.path.join(roots["batch"], "DELTA"),
+                      os.path.join(roots["batch"], "TMFS"), FORECASTS,
+                      *BASE_SCENARIO, **options)
+    for forecast in FORECASTS:
+        telmos_main(os.path.join(roots["separate"], "DELTA"),
+                    os.path.join(roots["separate"], "TMFS"), *forecast,
+                    *BASE_SCENARIO, **options)
+
+    for year, t_id, _ in FORECASTS:
+        batch_dir = _output_dir(roots["batch"], year, t_id)
+        separate_dir = _output_dir(roots["separate"], year, t_id)
+        names = sorted(os.listdir(batch_dir))
+        assert names == sorted(os.listdir(separate_dir))
+        assert len(names) > 0
+        _, different, errors = filecmp.cmpfiles(batch_dir, separate_dir,
+                                                names, shallow=False)
+        assert different == [] and errors == [], (year, t_id)
+
+    # The forecasts with different planning data have different outputs
+    first, second = [
+        os.path.join(_output_dir(roots["batch"], year, t_id),
+                     "tmfs%s_%s.csv" % (year, t_id))
+        for year, t_id, _ in FORECASTS[:2]]
+    assert not filecmp.cmp(first, second, shallow=False)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of converting OD, table and CSV files to binary matrix stores and back
+(data_functions.text_to_store and store_to_text), and of reading the stores
+in place of the text files.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_functions import (load_csv, load_matrix_store, load_table,
+                            matrix_to_odfile, odfile_to_matrix, store_kind,
+                            store_to_text, text_to_store)
+
+
+def _values(rng: np.random.Generator, shape) -> np.array:
+    # Zeros, whole numbers and decimals. The decimals are rounded, as
+    # pd.read_csv can read values with 17 significant digits 1 ulp out,
+    # which the stores keep so that they match reading the text files
+    values = np.round(rng.normal(0, 100, shape), 6)
+    values[rng.random(shape) < 0.3] = 0
+    values[rng.random(shape) < 0.2] = 7
+    return values
+
+
+def _round_trip(tmp_path, text_file):
+    # Converts text_file to a store and back, returning the store and the
+    # text written from it
+    store_file = str(tmp_path / "store.bin")
+    text_to_store(text_file, store_file)
+    out_file = str(tmp_path / ("out_" + text_file.rsplit("/", 1)[-1]))
+    store_to_text(store_file, out_file)
+    return store_file, out_file
+
+
+def _read_text(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("num_columns", [1, 3])
+def test_od_round_trip(tmp_path, num_columns):
+    rng = np.random.default_rng(num_columns)
+    matrices = _values(rng, (num_columns, 9, 9))
+    text_file = str(tmp_path / "matrix.dat")
+    matrix_to_odfile(matrices if num_columns > 1 else matrices[0], text_file,
+                     num_columns=num_columns)
+    store_file, out_file = _round_trip(tmp_path, text_file)
+
+    assert _read_text(out_file) == _read_text(text_file)
+    arrays, header = load_matrix_store(store_file)
+    assert header["attrs"]["kind"] == "od"
+    for path in (text_file, store_file):
+        read = odfile_to_matrix(path, num_columns=num_columns)
+        np.testing.assert_array_equal(
+            read, matrices if num_columns > 1 else matrices[0])
+    sparse = odfile_to_matrix(store_file, num_columns=num_columns,
+                              sparse=True)
+    if num_columns == 1:
+        sparse = [sparse]
+    for matrix, expected in zip(sparse, matrices):
+        np.testing.assert_array_equal(matrix.to_dense(), expected)
+    with pytest.raises(ValueError, match="zones"):
+        odfile_to_matrix(store_file, num_columns=num_columns, num_zones=10)
+    with pytest.raises(ValueError, match="matrices"):
+        odfile_to_matrix(store_file, num_columns=num_columns + 1)
+
+
+def test_table_round_trip(tmp_path):
+    rng = np.random.default_rng(5)
+    values = _values(rng, (20, 4))
+    text_file = str(tmp_path / "base.CTE")
+    with open(text_file, "w") as f:
+        for zone, row in enumerate(values, start=1):
+            f.write(",".join([str(zone)] + [repr(float(x)) for x in row])
+                    + "\n")
+    store_file, out_file = _round_trip(tmp_path, text_file)
+
+    assert _read_text(out_file) == _read_text(text_file)
+    np.testing.assert_array_equal(load_table(store_file),
+                                  load_table(text_file))
+    np.testing.assert_array_equal(load_table(store_file)[:, 1:], values)
+
+
+def test_csv_round_trip(tmp_path):
+    rng = np.random.default_rng(6)
+    text_file = str(tmp_path / "base_tmfs.csv")
+    expected = pd.DataFrame({"zone": np.arange(1, 16),
+                             "households": rng.integers(0, 500, 15),
+                             "growth": _values(rng, 15)})
+    expected.to_csv(text_file, index=False)
+    store_file, out_file = _round_trip(tmp_path, text_file)
+
+    pd.testing.assert_frame_equal(pd.read_csv(out_file), expected)
+    pd.testing.assert_frame_equal(load_csv(store_file), expected)
+    pd.testing.assert_frame_equal(load_csv(text_file), expected)
+    # A CSV store can also be read as a table of its values
+    np.testing.assert_array_equal(load_table(store_file),
+                                  expected.values.astype("float64"))
+
+
+def test_store_kind_is_checked(tmp_path):
+    matrix_file = str(tmp_path / "matrix.dat")
+    matrix_to_odfile(np.eye(3), matrix_file)
+    od_store = str(tmp_path / "od.bin")
+    text_to_store(matrix_file, od_store)
+    table_file = str(tmp_path / "base.TOD")
+    np.savetxt(table_file, np.eye(3), delimiter=",")
+    table_store = str(tmp_path / "table.bin")
+    text_to_store(table_file, table_store)
+
+    with pytest.raises(ValueError, match="does not contain a table"):
+        load_table(od_store)
+    with pytest.raises(ValueError, match="does not contain a CSV table"):
+        load_csv(table_store)
+    with pytest.raises(ValueError, match="does not contain an OD matrix"):
+        odfile_to_matrix(table_store)
+    with pytest.raises(ValueError, match="kind should be one of"):
+        text_to_store(table_file, table_store, kind="matrix")
+    with pytest.raises(ValueError, match="Cannot tell"):
+        store_kind("notes.txt")
+    assert store_kind("HGV18TE.DAT") == "table"
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the faster versions of the model calculations give the same
+results as the originals they replaced: write_fixed_format against
+np.savetxt, and the vectorised split productions against the cell-by-cell
+loop (use_loop=True).
+"""
+
+import numpy as np
+import pytest
+
+from data_functions import write_fixed_format
+from telmos_main import create_production_pivot
+
+
+def _test_values(rng: np.random.Generator, rows: int) -> np.array:
+    # Mixes large, small, zero and negative values, including values that
+    # round to zero and values exactly halfway between decimals
+    values = rng.normal(0, 1000, (rows, 6)) * rng.choice(
+        [1e-4, 1e-2, 1, 1e3], (rows, 6))
+    values[::7] = 0
+    values[1::11, 1] = -0.0
+    values[2::13, 2] = -0.0004
+    values[3::17, 3] = 0.0005
+    values[4::19, 4] = 2.5
+    values[5::23, 5] = -12345678.125
+    values[:, 0] = rng.integers(-50, 5000, rows) + rng.random(rows)
+    return values
+
+
+@pytest.mark.parametrize("precision", [3, 5, 9])
+@pytest.mark.parametrize("delimiter", [",", ", "])
+def test_write_fixed_format_matches_savetxt(tmp_path, precision, delimiter):
+    rng = np.random.default_rng(precision)
+    # More rows than one write block
+    data = _test_values(rng, 25000)
+    fmt = ["%d"] + [f"%.{precision}f"] * (data.shape[1] - 1)
+
+    expected_file = tmp_path / "savetxt.txt"
+    actual_file = tmp_path / "fixed.txt"
+    np.savetxt(expected_file, data, fmt=fmt, delimiter=delimiter)
+    write_fixed_format(str(actual_file), data, fmt=fmt, delimiter=delimiter)
+
+    assert actual_file.read_bytes() == expected_file.read_bytes()
+
+
+def test_write_fixed_format_other_formats(tmp_path):
+    # Formats that are not encoded directly use the fallback
+    data = _test_values(np.random.default_rng(1), 100)
+    fmt = ["%d", "%.3e", "%g", "%8.2f", "%.3f", "%.5f"]
+
+    expected_file = tmp_path / "savetxt.txt"
+    actual_file = tmp_path / "fixed.txt"
+    np.savetxt(expected_file, data, fmt=fmt, delimiter=",")
+    write_fixed_format(str(actual_file), data, fmt=fmt, delimiter=",")
+
+    assert actual_file.read_bytes() == expected_file.read_bytes()
+
+
+@pytest.mark.parametrize("just_pivots", [False, True])
+def test_production_pivot_matches_loop(just_pivots):
+    rng = np.random.default_rng(0)
+    int_zones = 6
+    area_types = 4
+    segments = 32 if just_pivots else 24
+    # One row per zone and household type (the original calculation leaves
+    # out the last row, which the vectorised version should match)
+    planning_data = rng.random((int_zones * 8, 11)) * 100
+    trip_rates = rng.random((area_types, segments, 8, 11))
+    area_correspondence = np.repeat(
+        rng.integers(3, 3 + area_types, int_zones), 8)
+
+    kwargs = dict(planning_data=planning_data,
+                  production_trip_rates=trip_rates,
+                  area_correspondence=area_correspondence,
+                  output_shape=(int_zones, 64),
+                  just_pivots=just_pivots,
+                  int_zones=int_zones)
+    vectorised = create_production_pivot(**kwargs)
+    loop = create_production_pivot(use_loop=True, **kwargs)
+
+    np.testing.assert_array_equal(vectorised, loop)
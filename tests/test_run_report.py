@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the peak memory recorded by run_report.RunReport.
+"""
+
+import tracemalloc
+
+import pytest
+
+from run_report import RunReport
+
+MB = 1 << 20
+
+
+def _run_stages(report):
+    # Stage "large" allocates 20 MB in its inner stage, "small" only 1 MB
+    with report.stage("large"):
+        with report.stage("inner"):
+            data = bytearray(20 * MB)
+        del data
+    with report.stage("small"):
+        data = bytearray(MB)
+        del data
+    return {stage["name"]: stage["peak_memory"] for stage in report.stages}
+
+
+@pytest.fixture
+def report():
+    report = RunReport(trace_memory=True)
+    yield report
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+@pytest.mark.skipif(not hasattr(tracemalloc, "reset_peak"),
+                    reason="tracemalloc.reset_peak needs Python 3.9")
+def test_peak_of_each_stage(report):
+    peaks = _run_stages(report)
+    assert peaks["large"] >= 20 * MB
+    assert peaks["large/inner"] >= 20 * MB
+    assert MB <= peaks["small"] < 20 * MB
+
+
+def test_peak_without_reset_peak(report, monkeypatch):
+    # As in Python 3.7 and 3.8
+    monkeypatch.delattr(tracemalloc, "reset_peak", raising=False)
+    peaks = _run_stages(report)
+    assert peaks["large"] >= 20 * MB
+    assert peaks["large/inner"] is None
+    assert MB <= peaks["small"] < 20 * MB
+
+
+def test_no_peak_without_trace_memory():
+    peaks = _run_stages(RunReport())
+    assert set(peaks.values()) == {None}
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Checks sparse_matrix.SparseMatrix against the same operations on dense numpy
+arrays, with random matrices.
+"""
+
+import numpy as np
+import pytest
+
+from sparse_matrix import SparseMatrix
+
+
+def _random_dense(rng: np.random.Generator,
+                  shape=(23, 17),
+                  density: float = 0.2
+                  ) -> np.array:
+    # Random values in a few cells, with some empty rows and columns and
+    # always an empty last row
+    dense = rng.normal(0, 100, shape) * (rng.random(shape) < density)
+    dense[rng.integers(0, shape[0], 3)] = 0
+    dense[:, rng.integers(0, shape[1], 2)] = 0
+    dense[-1] = 0
+    return dense
+
+
+def _check(matrix: SparseMatrix, expected: np.array) -> None:
+    assert isinstance(matrix, SparseMatrix)
+    assert matrix.shape == expected.shape
+    np.testing.assert_allclose(matrix.to_dense(), expected, rtol=1e-12)
+
+
+SEEDS = range(5)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("fill", [False, True])
+def test_sum(seed, fill):
+    rng = np.random.default_rng(seed)
+    dense = _random_dense(rng)
+    matrix = SparseMatrix.from_dense(dense)
+    if fill:
+        matrix = matrix.fill_zeros(1)
+        dense = np.where(dense == 0, 1, dense)
+    np.testing.assert_allclose(matrix.sum(), dense.sum(), rtol=1e-12)
+    for axis in (0, 1, -1, -2):
+        np.testing.assert_allclose(matrix.sum(axis=axis),
+                                   dense.sum(axis=axis), rtol=1e-12)
+
+
+def test_sum_of_empty_matrix():
+    matrix = SparseMatrix.from_dense(np.zeros((4, 3)))
+    assert matrix.nnz == 0
+    assert matrix.sum() == 0
+    np.testing.assert_array_equal(matrix.sum(axis=0), np.zeros(3))
+    np.testing.assert_array_equal(matrix.sum(axis=1), np.zeros(4))
+    with pytest.raises(ValueError):
+        matrix.sum(axis=2)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_scalar_operations(seed):
+    rng = np.random.default_rng(seed)
+    dense = _random_dense(rng)
+    matrix = SparseMatrix.from_dense(dense)
+    _check(matrix * 2.5, dense * 2.5)
+    _check(2.5 * matrix, dense * 2.5)
+    _check(matrix / 4, dense / 4)
+    _check(matrix.fill_zeros(1) * 3,
+           np.where(dense == 0, 1, dense) * 3)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_matrix_operations(seed):
+    rng = np.random.default_rng(seed)
+    dense_a = _random_dense(rng)
+    dense_b = _random_dense(rng)
+    a = SparseMatrix.from_dense(dense_a)
+    b = SparseMatrix.from_dense(dense_b)
+    _check(a * b, dense_a * dense_b)
+
+    # Dividing by a matrix with its zeros replaced by 1, as the goods growth
+    # calculation does
+    b_filled = b.fill_zeros(1)
+    dense_b_filled = np.where(dense_b == 0, 1, dense_b)
+    _check(b_filled, dense_b_filled)
+    _check(a / b_filled, dense_a / dense_b_filled)
+    _check(b_filled / b_filled.fill_zeros(1), np.ones(dense_b.shape))
+    _check(a.fill_zeros(1) * b_filled,
+           np.where(dense_a == 0, 1, dense_a) * dense_b_filled)
+
+    with pytest.raises(ValueError):
+        a * SparseMatrix.from_dense(dense_b[:-1])
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_slicing(seed):
+    rng = np.random.default_rng(seed)
+    dense = _random_dense(rng)
+    for matrix, expected in [
+            (SparseMatrix.from_dense(dense), dense),
+            (SparseMatrix.from_dense(dense).fill_zeros(1),
+             np.where(dense == 0, 1, dense))]:
+        for rows, cols in [(10, 5), (23, 17), (0, 3), (30, 40), (1, 17)]:
+            _check(matrix[:rows, :cols], expected[:rows, :cols])
+        _check(matrix[:, :4], expected[:, :4])
+        np.testing.assert_allclose(matrix.dense_rows(5, 12),
+                                   expected[5:12], rtol=1e-12)
+    with pytest.raises(TypeError):
+        SparseMatrix.from_dense(dense)[2:, :]
+    with pytest.raises(TypeError):
+        SparseMatrix.from_dense(dense)[:5]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_from_coo(seed):
+    rng = np.random.default_rng(seed)
+    dense = _random_dense(rng)
+    rows, cols = np.nonzero(dense)
+    order = rng.permutation(len(rows))
+    rows, cols = rows[order], cols[order]
+    _check(SparseMatrix.from_coo(rows, cols, dense[rows, cols], dense.shape),
+           dense)
+
+
+def test_from_coo_rejects_repeated_and_outside_cells():
+    with pytest.raises(ValueError, match=r"Cell \(1, 2\) is repeated"):
+        SparseMatrix.from_coo([0, 1, 2, 1], [0, 2, 1, 2], [1, 2, 3, 4],
+                              (3, 3))
+    with pytest.raises(ValueError, match="outside"):
+        SparseMatrix.from_coo([0, 3], [0, 0], [1, 2], (3, 3))
+    with pytest.raises(ValueError, match="outside"):
+        SparseMatrix.from_coo([0, 1], [0, -1], [1, 2], (3, 3))
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of skipping unchanged stages with stage_cache.StageRunner, on its own
+and in telmos_main.
+"""
+
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import telmos_main
+from scripts.synthetic_data import (BASE_SCENARIO, FORECAST_SCENARIO,
+                                    generate_synthetic_data)
+from stage_cache import StageRunner
+
+
+class _Stages:
+    """Three stages "a" -> "b" -> "c", each reading an input file and the
+    result of the stage before, and counting the times each is run"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.runs = []
+        self.fail = None
+        for name in "abc":
+            with open(self.path(name + ".in"), "w") as f:
+                f.write(name)
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _stage(self, name, previous):
+        def func():
+            self.runs.append(name)
+            if self.fail == name:
+                raise RuntimeError(f"Stage {name} failed")
+            with open(self.path(name + ".in"), "r") as f:
+                value = np.array([len(f.read())]) + previous
+            with open(self.path(name + ".out"), "w") as f:
+                f.write(str(value))
+            return value
+        return func
+
+    def run(self):
+        stages = StageRunner(self.path("stages"), log_func=lambda x: None)
+        value = np.zeros(1)
+        upstream = []
+        for name in "abc":
+            value = stages.run(name, self._stage(name, value),
+                               inputs=[self.path(name + ".in")],
+                               outputs=[self.path(name + ".out")],
+                               upstream=upstream)
+            upstream = [name]
+        return value
+
+
+def test_unchanged_stages_are_skipped(tmp_path):
+    stages = _Stages(str(tmp_path))
+    first = stages.run()
+    assert stages.runs == ["a", "b", "c"]
+
+    stages.runs = []
+    assert stages.run() == first
+    assert stages.runs == []
+
+
+def test_only_downstream_stages_rerun(tmp_path):
+    stages = _Stages(str(tmp_path))
+    stages.run()
+    with open(stages.path("b.in"), "w") as f:
+        f.write("changed")
+
+    stages.runs = []
+    assert stages.run() == np.array([1 + 7 + 1])
+    assert stages.runs == ["b", "c"]
+
+
+def test_changed_output_is_rerun(tmp_path):
+    stages = _Stages(str(tmp_path))
+    stages.run()
+    with open(stages.path("c.out"), "w") as f:
+        f.write("edited")
+
+    stages.runs = []
+    stages.run()
+    assert stages.runs == ["c"]
+
+
+def test_failed_run_resumes_from_last_finished_stage(tmp_path):
+    stages = _Stages(str(tmp_path))
+    stages.fail = "b"
+    with pytest.raises(RuntimeError):
+        stages.run()
+    assert stages.runs == ["a", "b"]
+
+    stages.fail = None
+    stages.runs = []
+    stages.run()
+    assert stages.runs == ["b", "c"]
+
+
+@pytest.fixture
+def synthetic_data(tmp_path):
+    return generate_synthetic_data(str(tmp_path), matrices=False)
+
+
+def _run_main(paths, stage_dir):
+    messages = []
+    telmos_main.telmos_main(
+        paths["delta_root"], paths["tmfs_root"], *FORECAST_SCENARIO,
+        *BASE_SCENARIO, is_rebasing_run=False, integrate_home_working=True,
+        stage_dir=stage_dir, log_func=messages.append)
+    return [m.group(1) for m in map(
+        re.compile(r"Skipping (\w+) stage").match, messages) if m]
+
+
+MAIN_STAGES = ["trip_rates", "attraction_pivot", "production_pivot",
+               "growth", "apply_growth"]
+
+
+def test_main_stages_skipped_until_airport_file_changes(synthetic_data,
+                                                        tmp_path):
+    stage_dir = str(tmp_path / "stages")
+    assert _run_main(synthetic_data, stage_dir) == []
+    assert _run_main(synthetic_data, stage_dir) == MAIN_STAGES
+
+    airport_file = os.path.join(synthetic_data["tmfs_root"], "Factors",
+                                telmos_main.AIRPORT_FAC_FILE)
+    airport = pd.read_csv(airport_file)
+    airport.iloc[:, 1:] *= 1.1
+    airport.to_csv(airport_file, index=False)
+
+    assert _run_main(synthetic_data, stage_dir) == MAIN_STAGES[:-1]
+
+
+def test_main_resumes_after_failure(synthetic_data, tmp_path, monkeypatch):
+    stage_dir = str(tmp_path / "stages")
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("Failed applying growth")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(telmos_main, "apply_pivot_files", fail)
+        with pytest.raises(RuntimeError):
+            _run_main(synthetic_data, stage_dir)
+    assert _run_main(synthetic_data, stage_dir) == MAIN_STAGES[:-1]
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the production trip rate readers in telmos_main.
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import telmos_main
+from scripts.synthetic_data import write_legacy_trip_rates
+from telmos_main import (TR_AREA_TYPES, TR_CACHE_SUFFIX, TR_PERIODS, TR_FILE,
+                         read_long_trip_rates, read_trip_rates,
+                         read_trip_rates_home_working)
+
+STANDARD_INPUT_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "standard input"
+)
+
+
+def test_legacy_just_pivots_does_not_change_periods(tmp_path):
+    # Processes that run the model several times (batch and job service
+    # workers) read the long format trip rates after a legacy run
+    write_legacy_trip_rates(str(tmp_path))
+    write_legacy_trip_rates(str(tmp_path), tag="WAH")
+
+    rates = read_trip_rates(str(tmp_path), just_pivots=True)
+    assert rates.shape[:2] == (len(TR_AREA_TYPES), 32)
+    rates = read_trip_rates_home_working(str(tmp_path), just_pivots=True,
+                                         wah_tag="WAH")
+    assert rates.shape[:2] == (len(TR_AREA_TYPES), 32)
+    assert TR_PERIODS == ["AM", "IP", "PM"]
+
+    rates = read_long_trip_rates(os.path.join(STANDARD_INPUT_DIR, TR_FILE),
+                                 use_cache=False)
+    assert rates.shape[:2] == (len(TR_AREA_TYPES), 24)
+
+
+@pytest.fixture
+def trip_rate_file(tmp_path):
+    path = str(tmp_path / TR_FILE)
+    shutil.copyfile(os.path.join(STANDARD_INPUT_DIR, TR_FILE), path)
+    return path
+
+
+@pytest.fixture
+def compile_calls(monkeypatch):
+    # Counts the times the trip rates are compiled rather than read from the
+    # sidecar file
+    calls = []
+    compile_trip_rates = telmos_main.compile_trip_rates
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return compile_trip_rates(*args, **kwargs)
+
+    monkeypatch.setattr(telmos_main, "compile_trip_rates", counted)
+    return calls
+
+
+def test_sidecar_reused_while_file_unchanged(trip_rate_file, compile_calls):
+    first = read_long_trip_rates(trip_rate_file)
+    assert os.path.isfile(trip_rate_file + TR_CACHE_SUFFIX)
+    assert len(compile_calls) == 1
+
+    second = read_long_trip_rates(trip_rate_file)
+    assert len(compile_calls) == 1
+    np.testing.assert_array_equal(first, second)
+    # The sidecar has every period, so just_pivots does not rebuild it
+    pivots = read_long_trip_rates(trip_rate_file, just_pivots=True)
+    assert len(compile_calls) == 1
+    np.testing.assert_array_equal(pivots[:, :24], first)
+    assert pivots.shape[1] == 32
+
+    uncached = read_long_trip_rates(trip_rate_file, use_cache=False)
+    assert len(compile_calls) == 2
+    np.testing.assert_array_equal(uncached, first)
+
+
+def test_sidecar_rebuilt_when_file_changes(trip_rate_file, compile_calls):
+    first = read_long_trip_rates(trip_rate_file)
+    stat = os.stat(trip_rate_file)
+    tr_df = pd.read_csv(trip_rate_file)
+    tr_df["trip_rate"] *= 2
+    tr_df.to_csv(trip_rate_file, index=False)
+    # The sidecar is keyed on the content, not the modification time
+    os.utime(trip_rate_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    second = read_long_trip_rates(trip_rate_file)
+    assert len(compile_calls) == 2
+    np.testing.assert_allclose(second, first * 2)
+
+
+def test_damaged_sidecar_replaced(trip_rate_file, compile_calls):
+    first = read_long_trip_rates(trip_rate_file)
+    with open(trip_rate_file + TR_CACHE_SUFFIX, "wb") as f:
+        f.write(b"not a numpy file")
+    np.testing.assert_array_equal(read_long_trip_rates(trip_rate_file),
+                                  first)
+    assert len(compile_calls) == 2
+    read_long_trip_rates(trip_rate_file)
+    assert len(compile_calls) == 2
+
+
+def test_sidecar_keyed_on_work_type_split(trip_rate_file, compile_calls):
+    # The same rates for all work types, so the file can be read either way
+    tr_df = pd.read_csv(trip_rate_file)
+    tr_df["work_type"] = "ALL"
+    tr_df.to_csv(trip_rate_file, index=False)
+
+    split = read_long_trip_rates(trip_rate_file, work_type_split=True)
+    assert sorted(split) == ["WAH", "WBC"]
+    combined = read_long_trip_rates(trip_rate_file)
+    assert len(compile_calls) == 2
+    np.testing.assert_array_equal(combined, split["WAH"])
+    np.testing.assert_array_equal(combined, split["WBC"])
+    split = read_long_trip_rates(trip_rate_file, work_type_split=True)
+    assert len(compile_calls) == 3
+    assert sorted(split) == ["WAH", "WBC"]
+
+
+def test_duplicate_trip_rates(trip_rate_file):
+    tr_df = pd.read_csv(trip_rate_file)
+    pd.concat([tr_df, tr_df.iloc[[10]]]).to_csv(trip_rate_file, index=False)
+    with pytest.raises(ValueError, match="1 trip rates are defined more "
+                                         "than once"):
+        read_long_trip_rates(trip_rate_file)
+    assert not os.path.isfile(trip_rate_file + TR_CACHE_SUFFIX)
+
+
+def test_missing_trip_rates(trip_rate_file):
+    tr_df = pd.read_csv(trip_rate_file)
+    am_rows = tr_df.index[tr_df["period"] == "AM"]
+    tr_df.drop(am_rows[:3]).to_csv(trip_rate_file, index=False)
+    with pytest.raises(ValueError, match="3 trip rates are missing"):
+        read_long_trip_rates(trip_rate_file)
+    assert not os.path.isfile(trip_rate_file + TR_CACHE_SUFFIX)
+
+
+def test_missing_off_peak_trip_rates(trip_rate_file):
+    tr_df = pd.read_csv(trip_rate_file)
+    tr_df = tr_df.drop(tr_df.index[tr_df["period"] == "OP"][:1])
+    tr_df.to_csv(trip_rate_file, index=False)
+    # Off-peak rates are only needed for just_pivots runs
+    assert read_long_trip_rates(trip_rate_file).shape[1] == 24
+    with pytest.raises(ValueError, match="Off-peak trip rates are missing"):
+        read_long_trip_rates(trip_rate_file, just_pivots=True)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of loading the model zone system in zone_system.py.
+"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from zone_system import (AREA_DEF_FILE, TMFS18_DEFINITION, ZONE_DEF_FILE,
+                         load_zone_system, zone_system_files)
+
+
+def _write_zone_files(tmfs_root, num_zones, definition=None):
+    factors_dir = os.path.join(str(tmfs_root), "Factors")
+    os.makedirs(factors_dir, exist_ok=True)
+    with open(os.path.join(factors_dir, AREA_DEF_FILE), "w") as f:
+        f.write("TMfS,R\n")
+        for zone in range(1, num_zones + 1):
+            f.write(f"{zone},{3 + zone % 6}\n")
+    if definition is not None:
+        with open(os.path.join(factors_dir, ZONE_DEF_FILE), "w") as f:
+            json.dump(definition, f)
+    return str(tmfs_root)
+
+
+def test_default_is_tmfs18(tmp_path):
+    tmfs_root = _write_zone_files(tmp_path, 803)
+    zone_system = load_zone_system(tmfs_root)
+    assert zone_system_files(tmfs_root) == [
+        os.path.join(tmfs_root, "Factors", AREA_DEF_FILE)]
+
+    assert zone_system.num_zones == 803
+    assert zone_system.num_internal == 787
+    assert zone_system.num_external == 16
+    np.testing.assert_array_equal(zone_system.internal, np.arange(787))
+    np.testing.assert_array_equal(zone_system.external, np.arange(787, 803))
+    # TELMoS zones 1-783 are unchanged, 800-803 are internal zones 784-787
+    # and the external zones 784-799 are 788-803
+    to_model = zone_system.telmos_to_model
+    np.testing.assert_array_equal(to_model[1:784], np.arange(1, 784))
+    np.testing.assert_array_equal(to_model[800:804], np.arange(784, 788))
+    np.testing.assert_array_equal(to_model[784:800], np.arange(788, 804))
+    np.testing.assert_array_equal(
+        zone_system.telmos_zones[to_model[1:] - 1], np.arange(1, 804))
+    assert dict(zip(zone_system.airport_names,
+                    zone_system.airport_indices)) == {
+        "Edinburgh": 708, "Prestwick": 709, "Glasgow": 710, "Aberdeen": 711}
+    np.testing.assert_array_equal(zone_system.area_types[:3], [4, 5, 6])
+
+
+def test_definition_file(tmp_path):
+    definition = {"internal_zones": 8,
+                  "telmos_order": [[1, 6], [9, 10], [7, 8]],
+                  "airport_indices": {"Airport": 3}}
+    tmfs_root = _write_zone_files(tmp_path, 10, definition)
+    assert len(zone_system_files(tmfs_root)) == 2
+    zone_system = load_zone_system(tmfs_root)
+    assert (zone_system.num_internal, zone_system.num_external) == (8, 2)
+    np.testing.assert_array_equal(zone_system.telmos_to_model[1:],
+                                  [1, 2, 3, 4, 5, 6, 9, 10, 7, 8])
+    assert zone_system.airport_names == ["Airport"]
+    # The definition argument is used in place of the file
+    zone_system = load_zone_system(tmfs_root, definition={
+        "internal_zones": 10})
+    np.testing.assert_array_equal(zone_system.telmos_to_model[1:],
+                                  np.arange(1, 11))
+    assert zone_system.num_external == 0
+
+
+@pytest.mark.parametrize("definition, message", [
+    # The TMfS18 definition with too few zones
+    (TMFS18_DEFINITION, "cannot have 787 internal zones"),
+    (dict(TMFS18_DEFINITION, internal_zones=90), "telmos_order"),
+    ({"internal_zones": 101}, "cannot have 101 internal zones"),
+    ({"internal_zones": 90, "telmos_order": [[1, 50], [50, 99]]},
+     "telmos_order"),
+    ({"internal_zones": 90, "airport_indices": {"Airport": 95}},
+     "Airport zones should be internal"),
+])
+def test_definition_does_not_match_zones(tmp_path, definition, message):
+    tmfs_root = _write_zone_files(tmp_path, 100, definition)
+    with pytest.raises(ValueError, match=message):
+        load_zone_system(tmfs_root)
+
+
+def test_default_needs_tmfs18_zones(tmp_path):
+    tmfs_root = _write_zone_files(tmp_path, 800)
+    with pytest.raises(ValueError, match="telmos_order"):
+        load_zone_system(tmfs_root)
+
+
+def test_area_file_zones_in_order(tmp_path):
+    tmfs_root = _write_zone_files(tmp_path, 5, {"internal_zones": 5})
+    area_file = os.path.join(tmfs_root, "Factors", AREA_DEF_FILE)
+    with open(area_file, "w") as f:
+        f.write("TMfS,R\n1,3\n3,3\n2,3\n")
+    with pytest.raises(ValueError, match="numbered from 1 to 3"):
+        load_zone_system(tmfs_root)
+    with open(area_file, "w") as f:
+        f.write("TMfS,R,X\n1,3,0\n")
+    with pytest.raises(ValueError, match="Should be 2 but found 3"):
+        load_zone_system(tmfs_root)
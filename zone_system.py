@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the model zone system used by the trip end model.
+
+The zone system is loaded from two files in the "Factors" folder:
+
+- AreaCorrespondence.csv - the area type of every model zone, one row per
+  zone (internal zones first, then external zones); and
+- ZoneSystem.json - an optional definition file, containing:
+    - internal_zones - the number of internal zones;
+    - telmos_order - the TELMoS zone numbers in model zone order, as a list
+      of [first, last] ranges. This is used to renumber the TELMoS goods
+      data to model zones; and
+    - airport_indices - the index (model zone - 1) of each airport zone, by
+      name.
+
+If ZoneSystem.json does not exist, the TMfS18 definition (TMFS18_DEFINITION)
+is used.
+"""
+
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from input_cache import cached_load
+from run_report import record_read
+
+AREA_DEF_FILE = "AreaCorrespondence.csv"
+ZONE_DEF_FILE = "ZoneSystem.json"
+
+# TMfS18 has 787 internal and 16 external zones. TELMoS numbers zones 1-783
+# as internal, 784-799 as external and 800-803 as internal, so TELMoS zones
+# 800-803 are model zones 784-787 and TELMoS zones 784-799 are model zones
+# 788-803
+TMFS18_DEFINITION = {
+    "internal_zones": 787,
+    "telmos_order": [[1, 783], [800, 803], [784, 799]],
+    "airport_indices": {"Edinburgh": 708,
+                        "Prestwick": 709,
+                        "Glasgow": 710,
+                        "Aberdeen": 711}
+}
+
+
+class ZoneSystem:
+    """Zone counts, area types and zone index arrays for a zone system.
+
+    Args:
+        area_types (np.array): Area type of each model zone.
+        internal_zones (int): Number of internal zones (the first zones).
+        telmos_order (List[List[int]]): TELMoS zone numbers in model zone
+        order, as a list of [first, last] ranges covering every zone.
+        airport_indices (Dict[str, int]): Index of each airport zone.
+
+    Raises:
+        ValueError: If the definition does not match the number of zones
+    """
+
+    def __init__(self,
+                 area_types: np.array,
+                 internal_zones: int,
+                 telmos_order: List[List[int]],
+                 airport_indices: Dict[str, int]
+                 ) -> None:
+        self.area_types = np.asarray(area_types, dtype="int")
+        self.num_zones = len(self.area_types)
+        self.num_internal = int(internal_zones)
+        self.num_external = self.num_zones - self.num_internal
+        if not 0 < self.num_internal <= self.num_zones:
+            raise ValueError(
+                f"Zone system has {self.num_zones} zones so cannot have "
+                f"{self.num_internal} internal zones")
+        self.internal = np.arange(self.num_internal)
+        self.external = np.arange(self.num_internal, self.num_zones)
+
+        # telmos_zones[i] is the TELMoS number of model zone i + 1, and
+        # telmos_to_model[z] is the model zone number of TELMoS zone z
+        self.telmos_zones = np.concatenate(
+            [np.arange(first, last + 1) for first, last in telmos_order])
+        if not np.array_equal(np.sort(self.telmos_zones),
+                              np.arange(1, self.num_zones + 1)):
+            raise ValueError(
+                "telmos_order should include each zone from 1 to "
+                f"{self.num_zones} once")
+        self.telmos_to_model = np.zeros(self.num_zones + 1, dtype="int")
+        self.telmos_to_model[self.telmos_zones] = np.arange(
+            1, self.num_zones + 1)
+
+        self.airport_names = list(airport_indices)
+        self.airport_indices = np.array(
+            [airport_indices[name] for name in self.airport_names],
+            dtype="int")
+        if np.any(self.airport_indices >= self.num_internal) or np.any(
+                self.airport_indices < 0):
+            raise ValueError("Airport zones should be internal zones")
+
+    def __repr__(self) -> str:
+        return (f"ZoneSystem({self.num_internal} internal, "
+                f"{self.num_external} external zones)")
+
+
+def zone_system_files(tmfs_root: str) -> List[str]:
+    """Lists the files that load_zone_system reads from tmfs_root"""
+    factors_dir = os.path.join(tmfs_root, "Factors")
+    files = [os.path.join(factors_dir, AREA_DEF_FILE)]
+    if os.path.isfile(os.path.join(factors_dir, ZONE_DEF_FILE)):
+        files.append(os.path.join(factors_dir, ZONE_DEF_FILE))
+    return files
+
+
+def load_zone_system(tmfs_root: str,
+                     definition: Optional[dict] = None
+                     ) -> ZoneSystem:
+    """Loads the zone system from the "Factors" folder of tmfs_root.
+
+    Args:
+        tmfs_root (str): TMfS root directory.
+        definition (dict, optional): Zone system definition to use instead
+        of ZoneSystem.json. Defaults to None.
+
+    Returns:
+        ZoneSystem: The zone system.
+    """
+    factors_dir = os.path.join(tmfs_root, "Factors")
+    area_file = os.path.join(factors_dir, AREA_DEF_FILE)
+    area_df = cached_load(area_file, "load_zone_system",
+                          lambda: pd.read_csv(area_file, dtype="int"))
+    record_read(area_file, rows=len(area_df))
+    if area_df.shape[1] != 2:
+        raise ValueError(f"Incorrect number of columns in Area Definition "
+                         f"File: Should be 2 but found {area_df.shape[1]}")
+    if not np.array_equal(area_df.values[:, 0],
+                          np.arange(1, len(area_df) + 1)):
+        raise ValueError(f"Zones in {area_file} should be numbered from 1 "
+                         f"to {len(area_df)} in order")
+
+    if definition is None:
+        definition_file = os.path.join(factors_dir, ZONE_DEF_FILE)
+        if os.path.isfile(definition_file):
+            with open(definition_file, "r") as f:
+                definition = json.load(f)
+            record_read(definition_file)
+        else:
+            definition = TMFS18_DEFINITION
+    num_zones = len(area_df)
+    return ZoneSystem(
+        area_df.values[:, 1],
+        definition["internal_zones"],
+        definition.get("telmos_order", [[1, num_zones]]),
+        definition.get("airport_indices", {})
+    )